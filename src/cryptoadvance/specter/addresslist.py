@@ -2,11 +2,35 @@
 Manages the list of addresses for the wallet, including labels and derivation paths
 """
 import os
-from .persistence import write_csv, read_csv
+from embit.script import address_to_scriptpubkey
+from .storage import get_store, parse_bool
+from .util.lru import LRUCache
 import logging
 
 logger = logging.getLogger(__name__)
 
+# max number of address -> scriptPubKey conversions kept in memory
+SCRIPT_CACHE_SIZE = int(os.getenv("SPECTER_SCRIPT_CACHE_SIZE", "10000"))
+_script_cache = LRUCache(SCRIPT_CACHE_SIZE)
+_NO_VALUE = object()
+
+
+def memoized(cache, fn, addr):
+    """Returns cached fn(addr), None if fn fails for this address"""
+    value = cache.get(addr, _NO_VALUE)
+    if value is _NO_VALUE:
+        try:
+            value = fn(addr)
+        except:
+            value = None
+        cache[addr] = value
+    return value
+
+
+def address_to_script(addr):
+    """Memoized scriptPubKey (bytes) of an address, None if it can't be decoded"""
+    return memoized(_script_cache, lambda a: address_to_scriptpubkey(a).data, addr)
+
 
 class Address(dict):
     columns = [
@@ -19,9 +43,9 @@ class Address(dict):
     type_converter = [
         str,
         int,
-        lambda v: v if isinstance(v, bool) else v == "True",
+        parse_bool,
         str,
-        lambda v: v if isinstance(v, bool) else v == "True",
+        parse_bool,
     ]
 
     def __init__(self, rpc, **kwargs):
@@ -92,28 +116,50 @@ class Address(dict):
 
 
 class AddressList(dict):
+    """
+    Our addresses by address string.
+    Lookups also find addresses with the same scriptPubKey in another encoding
+    (e.g. confidential or unconfidential on Liquid) using a scriptPubKey index.
+    """
+
     AddressCls = Address
+    # address -> scriptPubKey (bytes) conversion of the chain
+    address_to_script = staticmethod(address_to_script)
 
-    def __init__(self, path, rpc):
+    def __init__(self, path, rpc, store=None):
         super().__init__()
         self.path = path
         self.rpc = rpc
-        file_exists = False
-        if os.path.isfile(self.path):
-            try:
-                addresses = read_csv(self.path, self.AddressCls, self.rpc)
-                # dict allows faster lookups
-                for addr in addresses:
-                    self[addr.address] = addr
-                file_exists = True
-            except Exception as e:
-                logger.error(e)
-        self._file_exists = file_exists
-
-    def save(self):
-        if len(list(self.keys())) > 0:
-            write_csv(self.path, list(self.values()), self.AddressCls)
-        self._file_exists = True
+        # callbacks called with the list of changed addresses (None if all changed)
+        self.observers = []
+        # (change, index): address of our addresses, built on first use
+        self._by_index = None
+        # scriptPubKey: address of all addresses, built on first use
+        self._by_script = None
+        if store is None:
+            store = get_store(
+                path, self.AddressCls, "addresses", "address", indexes=["label"]
+            )
+        self.store = store
+        try:
+            addresses = self.store.load(self.rpc)
+            # dict allows faster lookups
+            for addr in addresses:
+                self[addr.address] = addr
+        except Exception as e:
+            logger.error(e)
+
+    def save(self, changed=None):
+        """Saves addresses from changed list or all if changed is None"""
+        if len(self) > 0:
+            self.store.save(
+                self.values(),
+                changed=None
+                if changed is None
+                else [dict.__getitem__(self, addr) for addr in changed],
+            )
+        for callback in self.observers:
+            callback(changed)
 
     def add(self, arr, check_rpc=False):
         """arr should be a list of dicts"""
@@ -130,6 +176,7 @@ class AddressList(dict):
                 # go through all addresses and assign labels
                 for k in result["result"].keys():
                     labeled_addresses[k] = label
+        changed = []
         # go through all addresses and assign
         for addr in arr:
             if addr["address"] in self:
@@ -138,6 +185,7 @@ class AddressList(dict):
             if addr["address"] in labeled_addresses:
                 addr["label"] = labeled_addresses[addr["address"]]
             self[addr["address"]] = self.AddressCls(self.rpc, **addr)
+            changed.append(addr["address"])
         # add all labeled addresses but not from the array (destination)
         for addr in labeled_addresses:
             if addr not in self:
@@ -148,13 +196,91 @@ class AddressList(dict):
                     change=None,
                     index=None,
                 )
-        self.save()
+                changed.append(addr)
+        self.save(changed=changed)
+
+    def __setitem__(self, address, addr):
+        super().__setitem__(address, addr)
+        # keep indexes up to date
+        self._index_address(addr)
+        self._index_script(addr)
+
+    def __contains__(self, address):
+        return super().__contains__(address) or self.get_by_address(address) is not None
+
+    def __getitem__(self, address):
+        if super().__contains__(address):
+            return super().__getitem__(address)
+        addr = self.get_by_address(address)
+        if addr is None:
+            raise KeyError(address)
+        return addr
+
+    def get(self, address, default=None):
+        try:
+            return self[address]
+        except KeyError:
+            return default
+
+    def _index_address(self, addr):
+        if self._by_index is not None and not addr.is_external:
+            self._by_index[(bool(addr.change), addr.index)] = addr.address
+
+    def _index_script(self, addr):
+        if self._by_script is None:
+            return
+        script = self.address_to_script(addr.address)
+        # first address with this scriptPubKey wins
+        if script and script not in self._by_script:
+            self._by_script[script] = addr
+
+    def get_by_script(self, script, default=None):
+        """Returns our address with scriptPubKey (bytes) or default"""
+        if self._by_script is None:
+            self._by_script = {}
+            for addr in self.values():
+                self._index_script(addr)
+        return self._by_script.get(bytes(script), default)
+
+    def get_by_address(self, address, default=None):
+        """Finds our address with the same scriptPubKey as address"""
+        script = self.address_to_script(address)
+        if not script:
+            return default
+        return self.get_by_script(script, default)
+
+    def get_by_index(self, index, change=False):
+        """Returns our address with derivation index or None if we don't have it"""
+        if self._by_index is None:
+            self._by_index = {}
+            for addr in self.values():
+                self._index_address(addr)
+        return self._by_index.get((bool(change), index))
 
     def set_label(self, address, label):
         if address not in self:
             self[address] = self.AddressCls(self.rpc, address=address, label=label)
         self[address].set_label(label)
-        self.save()
+        self.save(changed=[self[address].address])
+
+    def set_labels(self, labels):
+        """Sets labels of many addresses ({address: label}) with one rpc batch"""
+        changed = []
+        calls = []
+        for address, label in labels.items():
+            if address not in self:
+                self[address] = self.AddressCls(self.rpc, address=address, label=label)
+            elif self[address]["label"] != label:
+                self[address]["label"] = label
+                calls.append(("setlabel", self[address].address, label))
+            else:
+                continue
+            # address can be in another encoding, save the key we store
+            changed.append(self[address].address)
+        if calls:
+            self.rpc.multi(calls)
+        if changed:
+            self.save(changed=changed)
 
     def get_labels(self):
         labels = {}
@@ -165,7 +291,7 @@ class AddressList(dict):
         return labels
 
     def set_used(self, addresses):
-        need_save = False
+        changed = []
         for address in addresses:
             if address not in self:
                 # external maybe???
@@ -175,9 +301,9 @@ class AddressList(dict):
             if addr.is_external or addr.used:
                 continue
             addr["used"] = True
-            need_save = True
-        if need_save:
-            self.save()
+            changed.append(addr.address)
+        if changed:
+            self.save(changed=changed)
 
     def max_index(self, change=False):
         return max(
@@ -199,4 +325,4 @@ class AddressList(dict):
 
     @property
     def file_exists(self):
-        return self._file_exists and os.path.isfile(self.path)
+        return self.store.exists
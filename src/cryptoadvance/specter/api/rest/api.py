@@ -17,7 +17,7 @@ from ...util.fee_estimation import get_fees
 
 from .. import auth
 from .resource_healthz import ResourceLiveness, ResourceReadyness
-from .resource_psbt import ResourcePsbt
+from .resource_psbt import ResourceBatchPsbt, ResourcePsbt
 from .resource_specter import ResourceSpecter
 from .resource_txlist import ResourceTXlist
 
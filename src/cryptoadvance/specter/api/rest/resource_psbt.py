@@ -1,3 +1,4 @@
+import io
 import logging
 
 from .base import (
@@ -6,7 +7,7 @@ from .base import (
 )
 from flask import current_app as app, request
 from ...wallet import Wallet
-from ...util.psbt_creator import PsbtCreator
+from ...util.psbt_creator import BATCH_MAX_VSIZE, PsbtCreator
 
 from .. import auth
 
@@ -39,3 +40,39 @@ class ResourcePsbt(SecureResource):
         )
         psbt_creator.create_psbt(wallet)
         return {"result": psbt_creator.psbt}
+
+
+@rest_resource
+class ResourceBatchPsbt(SecureResource):
+    """/api/v1alpha/wallets/<wallet_alias>/psbt/batch
+    Batch payout: the body is a CSV with lines "address,amount[,label]".
+    Query parameters: unit (btc|sat), fee_rate (sat/vB), rbf (true|false),
+    max_vsize and estimate (true: only report, don't save the PSBTs)
+    """
+
+    endpoints = ["/v1alpha/wallets/<wallet_alias>/psbt/batch"]
+
+    def post(self, wallet_alias):
+        user = auth.current_user()
+        wallet: Wallet = app.specter.user_manager.get_user(
+            user
+        ).wallet_manager.get_by_alias(wallet_alias)
+        request_form = {
+            "fee_options": "manual",
+            "fee_rate": request.args.get("fee_rate", ""),
+            "rbf": request.args.get("rbf", "true") == "true",
+        }
+        if request.args.get("estimate", "false") == "true":
+            request_form["estimate_fee"] = True
+        psbt_creator = PsbtCreator(
+            app.specter,
+            wallet,
+            "csv",
+            request_form=request_form,
+            recipients_csv=io.TextIOWrapper(request.stream, encoding="utf-8"),
+            recipients_amount_unit=request.args.get("unit", "btc"),
+        )
+        batches = psbt_creator.create_batch_psbts(
+            wallet, int(request.args.get("max_vsize", BATCH_MAX_VSIZE))
+        )
+        return {"result": {"batches": batches, "psbts": psbt_creator.psbts}}
@@ -4,6 +4,8 @@ from cryptoadvance.specter.api.rest.base import (
     AdminResource,
     rest_resource,
 )
+from cryptoadvance.specter.persistence import callback_runner
+from cryptoadvance.specter.rpc import BitcoinRPC
 from flask import current_app as app
 from datetime import datetime
 
@@ -43,4 +45,10 @@ class ResourceSpecter(AdminResource):
         return_dict["alias_name"] = alias_name
         return_dict["name_alias"] = name_alias
         return_dict["wallets_alias"] = wallets_alias
+        return_dict["wallets_cache_stats"] = {
+            wallet.alias: wallet.cache_stats
+            for wallet in specter_data.wallet_manager.wallets.values()
+        }
+        return_dict["rpc_metrics"] = BitcoinRPC.metrics.stats()
+        return_dict["persistence_callback"] = callback_runner.stats()
         return return_dict
@@ -22,7 +22,8 @@ class ResourceTXlist(AdminResource):
         idx = 0
         tx_len = 1
         tx_list = []
-        transactions = wallet_manager.full_txlist(
+        # reads materialized rows from the wallets' transaction index
+        transactions, _count = wallet_manager.full_txlist_query(
             fetch_transactions=False, validate_merkle_proofs=validate_merkle_proofs
         )
         tx_list.append(transactions)
@@ -11,6 +11,7 @@ from OpenSSL import SSL, crypto
 from stem.control import Controller
 from urllib.parse import urlparse
 
+from ..persistence import flush as flush_persistence
 from ..server import create_app, init_app
 from ..util.tor import start_hidden_service, stop_hidden_services
 from ..specter_error import SpecterError
@@ -246,6 +247,7 @@ def server(
             app.run(debug=debug, **kwargs)
             stop_hidden_services(app)
         finally:
+            flush_persistence()
             try:
                 if app.specter.tor_controller is not None:
                     app.specter.tor_controller.close()
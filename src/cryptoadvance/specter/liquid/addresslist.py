@@ -1,11 +1,27 @@
 from ..addresslist import *
+from ..addresslist import memoized
 from embit.liquid.addresses import addr_decode, to_unconfidential
+from ..util.lru import LRUCache
+
+# address -> scriptPubKey and confidential -> unconfidential conversions
+_script_cache = LRUCache(SCRIPT_CACHE_SIZE)
+_unconfidential_cache = LRUCache(SCRIPT_CACHE_SIZE)
+
+
+def address_to_script(addr):
+    """Memoized scriptPubKey (bytes) of a confidential or unconfidential address"""
+    return memoized(_script_cache, lambda a: addr_decode(a)[0].data, addr)
+
+
+def unconfidential(addr):
+    """Memoized unconfidential address, None if it can't be decoded"""
+    return memoized(_unconfidential_cache, to_unconfidential, addr)
 
 
 class LAddress(Address):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._unconfidential = to_unconfidential(self.address)
+        self._unconfidential = unconfidential(self.address)
 
     @property
     def unconfidential(self):
@@ -17,42 +33,7 @@ class LAddress(Address):
 
 
 class LAddressList(AddressList):
-    AddressCls = LAddress
+    """Finds addresses by confidential or unconfidential address"""
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # scriptpubkey dict for lookups of unconf addresses
-        self._scripts = {}
-        self._update_scripts()
-
-    def _update_scripts(self):
-        for addr in self:
-            sc, _ = addr_decode(addr)
-            if sc and sc not in self._scripts:
-                self._scripts[sc] = self[addr]
-
-    def add(self, *args, **kwargs):
-        res = super().add(*args, **kwargs)
-        # update scriptpubkey dict for lookups of unconf addresses
-        self._update_scripts()
-        return res
-
-    def __contains__(self, addr):
-        """finds address by confidential or unconfidential address by converting to scriptpubkey"""
-        sc, _ = addr_decode(addr)
-        if sc and self._scripts.__contains__(sc):
-            return True
-        return super().__contains__(addr)
-
-    def __getitem__(self, addr):
-        """finds address by confidential or unconfidential address by converting to scriptpubkey"""
-        sc, _ = addr_decode(addr)
-        if sc in self._scripts:
-            return self._scripts[sc]
-        return super().__getitem__(addr)
-
-    def get(self, addr, default=None):
-        try:
-            return self[addr]
-        except KeyError:
-            return default
+    AddressCls = LAddress
+    address_to_script = staticmethod(address_to_script)
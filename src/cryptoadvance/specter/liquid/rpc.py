@@ -10,6 +10,7 @@ from embit.liquid.networks import get_network
 from embit.liquid.transaction import LTransaction, unblind
 from embit.liquid import slip77
 from embit.psbt import read_string
+from ..util.lru import LRUCache
 
 from io import BytesIO
 
@@ -17,6 +18,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# max number of unblinded outputs kept in memory if no cache is passed
+UNBLINDED_CACHE_SIZE = 10000
+
 
 class LiquidRPC(BitcoinRPC):
     """
@@ -34,6 +38,12 @@ class LiquidRPC(BitcoinRPC):
     """
 
     _master_blinding_key = None
+    # SLIP77 blinding keys by scriptPubKey
+    _blinding_keys = None
+    # unblinded outputs by (txid, vout) if no cache is passed to decoderawtransaction
+    _unblinded = None
+    # networks by (host, port) of the node
+    _networks = {}
 
     def getbalance(
         self,
@@ -337,11 +347,41 @@ class LiquidRPC(BitcoinRPC):
             )
         return self._master_blinding_key
 
-    def decoderawtransaction(self, tx):
+    @property
+    def network(self):
+        """Network of the node, the chain doesn't change so we ask only once per node"""
+        key = (self.host, self.port)
+        if key not in LiquidRPC._networks:
+            chain = self.getblockchaininfo().get("chain")
+            LiquidRPC._networks[key] = get_network(chain)
+        return LiquidRPC._networks[key]
+
+    def blinding_key(self, script_pubkey):
+        """SLIP77 blinding key for the scriptPubKey, cached per wallet"""
+        if self._blinding_keys is None:
+            self._blinding_keys = {}
+        key = script_pubkey.data
+        if key not in self._blinding_keys:
+            self._blinding_keys[key] = slip77.blinding_key(
+                self.master_blinding_key, script_pubkey
+            )
+        return self._blinding_keys[key]
+
+    def decoderawtransaction(self, tx, unblinded=None):
+        """
+        Decodes the transaction and unblinds the outputs we can unblind.
+        unblinded is a dict {(txid, vout): value, asset and addresses} used as a cache
+        of the unblinding, outputs of new transactions are added to it.
+        Without it a bounded LRUCache of the instance is used.
+        """
+        if unblinded is None:
+            if self._unblinded is None:
+                self._unblinded = LRUCache(UNBLINDED_CACHE_SIZE)
+            unblinded = self._unblinded
         blinded = super().__getattr__("decoderawtransaction")(tx)
         try:
-            unblinded = self.unblindrawtransaction(tx)["hex"]
-            obj = super().__getattr__("decoderawtransaction")(unblinded)
+            unblinded_hex = self.unblindrawtransaction(tx)["hex"]
+            obj = super().__getattr__("decoderawtransaction")(unblinded_hex)
             if "vsize" in blinded:
                 obj["vsize"] = blinded["vsize"]
             if "size" in blinded:
@@ -354,124 +394,131 @@ class LiquidRPC(BitcoinRPC):
             logger.error(e)
             obj = blinded
         try:
-            # unblind the rest of outputs
             b = LTransaction.from_string(tx)
-
-            mbpk = self.master_blinding_key
-            net = get_network(self.getblockchaininfo().get("chain"))
-
-            outputs = obj["vout"]
-            datas = []
+            txid = b.txid().hex()
+            keys = [(txid, i) for i in range(len(b.vout))]
+            if not all(key in unblinded for key in keys):
+                for key, res in zip(keys, self._unblind_outputs(b)):
+                    unblinded[key] = res
             fee = 0
-            # search for datas encoded in rangeproofs
             for i, out in enumerate(b.vout):
-                o = outputs[i]
-                if isinstance(out.value, int):
-                    if "value" in o:
-                        assert o["value"] == round(out.value * 1e-8, 8)
-                    else:
-                        o["value"] = round(out.value * 1e-8, 8)
-                    if "asset" in o:
-                        assert o["asset"] == bytes(reversed(out.asset[-32:])).hex()
-                    else:
-                        o["asset"] = bytes(reversed(out.asset[-32:])).hex()
-                    try:
-                        o["scriptPubKey"]["addresses"] = [
-                            liquid_address(out.script_pubkey, network=net)
-                        ]
-                    except:
-                        pass
-                    if out.script_pubkey.data == b"":
-                        # fee negative?
-                        fee -= out.value
-
-                pk = slip77.blinding_key(mbpk, out.script_pubkey)
+                if isinstance(out.value, int) and out.script_pubkey.data == b"":
+                    # fee negative?
+                    fee -= out.value
                 try:
-                    res = out.unblind(pk.secret, message_length=1000)
-                    value, asset, vbf, abf, extra, min_value, max_value = res
-                    if "value" in o:
-                        assert o["value"] == round(value * 1e-8, 8)
-                    else:
-                        o["value"] = round(value * 1e-8, 8)
-                    if "asset" in o:
-                        assert o["asset"] == bytes(reversed(asset[-32:])).hex()
-                    else:
-                        o["asset"] = bytes(reversed(asset[-32:])).hex()
-                    try:
-                        o["scriptPubKey"]["addresses"] = [
-                            liquid_address(out.script_pubkey, pk, network=net)
-                        ]
-                    except:
-                        pass
-                    if len(extra.rstrip(b"\x00")) > 0:
-                        datas.append(extra)
+                    self._set_unblinded(obj["vout"][i], unblinded.get(keys[i]))
                 except Exception as e:
-                    pass
-
-            # should be changed with seed from tx
-            tx = PSET(b)
-            seed = tagged_hash("liquid/blinding_seed", mbpk.secret)
-            txseed = tx.txseed(seed)
-            pubkeys = {}
-
-            for extra in datas:
-                s = BytesIO(extra)
-                while True:
-                    k = read_string(s)
-                    if len(k) == 0:
-                        break
-                    v = read_string(s)
-                    if k[0] == 1 and len(k) == 5:
-                        idx = int.from_bytes(k[1:], "little")
-                        pubkeys[idx] = v
-                    elif k == b"\x01\x00":
-                        txseed = v
-
-            for i, out in enumerate(outputs):
-                o = out
-                if i in pubkeys and len(pubkeys[i]) in [33, 65]:
-                    nonce = tagged_hash(
-                        "liquid/range_proof", txseed + i.to_bytes(4, "little")
-                    )
-                    if b.vout[i].ecdh_pubkey == PrivateKey(nonce).sec():
-                        try:
-                            res = unblind(
-                                pubkeys[i],
-                                nonce,
-                                b.vout[i].witness.range_proof.data,
-                                b.vout[i].value,
-                                b.vout[i].asset,
-                                b.vout[i].script_pubkey,
-                            )
-                            value, asset, vbf, abf, extra, min_value, max_value = res
-                            if "value" in o:
-                                assert o["value"] == round(value * 1e-8, 8)
-                            else:
-                                o["value"] = round(value * 1e-8, 8)
-                            if "asset" in o:
-                                assert o["asset"] == bytes(reversed(asset[-32:])).hex()
-                            else:
-                                o["asset"] = bytes(reversed(asset[-32:])).hex()
-                            try:
-                                o["scriptPubKey"]["addresses"] = [
-                                    liquid_address(
-                                        b.vout[i].script_pubkey,
-                                        PublicKey.parse(pubkeys[i]),
-                                        network=net,
-                                    )
-                                ]
-                            except:
-                                pass
-                        except Exception as e:
-                            logger.warn(f"Failed at unblinding output {i}: {e}")
-                    else:
-                        logger.warn(f"Failed at unblinding: {e}")
+                    logger.warn(f"Failed at unblinding output {i}: {e}")
             if fee != 0:
                 obj["fee"] = round(-fee * 1e-8, 8)
         except Exception as e:
             logger.warn(f"Failed at unblinding transaction: {e}")
         return obj
 
+    @staticmethod
+    def _set_unblinded(o, res):
+        """Fills decoded output o with unblinded value, asset and addresses"""
+        for k in ["value", "asset"]:
+            if k in res:
+                if k in o:
+                    assert o[k] == res[k]
+                else:
+                    o[k] = res[k]
+        if "addresses" in res and "scriptPubKey" in o:
+            o["scriptPubKey"]["addresses"] = res["addresses"]
+
+    def _unblind_outputs(self, b):
+        """
+        Returns value, asset and addresses of every output of LTransaction b
+        (empty dict if we can't unblind it). Rangeproof unblinding is expensive,
+        use decoderawtransaction that caches the results.
+        """
+        net = self.network
+        results = [{} for _ in b.vout]
+        datas = []
+        # search for datas encoded in rangeproofs
+        for i, out in enumerate(b.vout):
+            res = results[i]
+            if isinstance(out.value, int):
+                res["value"] = round(out.value * 1e-8, 8)
+                res["asset"] = bytes(reversed(out.asset[-32:])).hex()
+                try:
+                    res["addresses"] = [liquid_address(out.script_pubkey, network=net)]
+                except:
+                    pass
+                # explicit outputs have nothing to unblind
+                continue
+            pk = self.blinding_key(out.script_pubkey)
+            try:
+                value, asset, vbf, abf, extra, min_value, max_value = out.unblind(
+                    pk.secret, message_length=1000
+                )
+            except Exception:
+                continue
+            res["value"] = round(value * 1e-8, 8)
+            res["asset"] = bytes(reversed(asset[-32:])).hex()
+            try:
+                res["addresses"] = [liquid_address(out.script_pubkey, pk, network=net)]
+            except:
+                pass
+            if len(extra.rstrip(b"\x00")) > 0:
+                datas.append(extra)
+        if not datas:
+            return results
+
+        # should be changed with seed from tx
+        mbpk = self.master_blinding_key
+        tx = PSET(b)
+        seed = tagged_hash("liquid/blinding_seed", mbpk.secret)
+        txseed = tx.txseed(seed)
+        pubkeys = {}
+
+        for extra in datas:
+            s = BytesIO(extra)
+            while True:
+                k = read_string(s)
+                if len(k) == 0:
+                    break
+                v = read_string(s)
+                if k[0] == 1 and len(k) == 5:
+                    idx = int.from_bytes(k[1:], "little")
+                    pubkeys[idx] = v
+                elif k == b"\x01\x00":
+                    txseed = v
+
+        for i, res in enumerate(results):
+            if i in pubkeys and len(pubkeys[i]) in [33, 65]:
+                nonce = tagged_hash(
+                    "liquid/range_proof", txseed + i.to_bytes(4, "little")
+                )
+                if b.vout[i].ecdh_pubkey != PrivateKey(nonce).sec():
+                    logger.warn(f"Failed at unblinding output {i}: nonce mismatch")
+                    continue
+                try:
+                    value, asset, vbf, abf, extra, min_value, max_value = unblind(
+                        pubkeys[i],
+                        nonce,
+                        b.vout[i].witness.range_proof.data,
+                        b.vout[i].value,
+                        b.vout[i].asset,
+                        b.vout[i].script_pubkey,
+                    )
+                    res["value"] = round(value * 1e-8, 8)
+                    res["asset"] = bytes(reversed(asset[-32:])).hex()
+                    try:
+                        res["addresses"] = [
+                            liquid_address(
+                                b.vout[i].script_pubkey,
+                                PublicKey.parse(pubkeys[i]),
+                                network=net,
+                            )
+                        ]
+                    except:
+                        pass
+                except Exception as e:
+                    logger.warn(f"Failed at unblinding output {i}: {e}")
+        return results
+
     def __repr__(self) -> str:
         return f"<LiquidRpc {self.url}>"
 
@@ -489,4 +536,6 @@ class LiquidRPC(BitcoinRPC):
             session=rpc.session,
             proxy_url=rpc.proxy_url,
             only_tor=rpc.only_tor,
+            pool_size=rpc.pool_size,
+            retries=rpc.retries,
         )
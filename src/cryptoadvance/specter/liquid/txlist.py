@@ -1,15 +1,78 @@
 from ..txlist import *
 from embit.liquid.transaction import LTransaction
+from ..storage import CsvStore
 
 
 class LTxItem(TxItem):
     TransactionCls = LTransaction
 
 
+class UnblindedOutput(dict):
+    """Value, asset and addresses of an output we unblinded before"""
+
+    columns = ["outpoint", "value", "asset", "addresses"]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # csv and sqlite store everything as strings
+        if self.get("value") not in [None, ""]:
+            self["value"] = float(self["value"])
+        self["addresses"] = parse_arr(self.get("addresses") or None)
+
+    @property
+    def result(self):
+        """Unblinded output as LiquidRPC.decoderawtransaction expects it"""
+        return {k: self[k] for k in ["value", "asset", "addresses"] if self.get(k)}
+
+
 class LTxList(TxList):
     ItemCls = LTxItem
     counter = 0
 
+    def __init__(self, path, rpc, addresses, chain, store=None):
+        super().__init__(path, rpc, addresses, chain, store=store)
+        # unblinding is expensive, so we keep results of all outputs
+        self.unblinded_store = get_store(
+            path.rsplit("_", 1)[0] + "_unblinded.csv",
+            UnblindedOutput,
+            "unblinded_outputs",
+            "outpoint",
+        )
+        self._unblinded = None
+
+    @property
+    def unblinded_outputs(self):
+        """dict (txid, vout): value, asset and addresses of unblinded outputs"""
+        if self._unblinded is None:
+            self._unblinded = {}
+            try:
+                for out in self.unblinded_store.load():
+                    txid, vout = out["outpoint"].split(":")
+                    self._unblinded[(txid, int(vout))] = out.result
+            except Exception as e:
+                logger.error(e)
+        return self._unblinded
+
     def decoderawtransaction(self, txhex):
         # TODO: using rpc for now, can be moved to utils
-        return self.rpc.decoderawtransaction(txhex)
+        unblinded = self.unblinded_outputs
+        known = len(unblinded)
+        res = self.rpc.decoderawtransaction(txhex, unblinded=unblinded)
+        changed = []
+        if len(unblinded) != known:
+            txid = res["txid"]
+            changed = [
+                UnblindedOutput(outpoint=f"{txid}:{vout}", **unblinded[(txid, vout)])
+                for vout in range(len(res["vout"]))
+                if (txid, vout) in unblinded
+            ]
+        if changed:
+            objs = []
+            # only csv needs all rows, sqlite just upserts the changed ones
+            if isinstance(self.unblinded_store, CsvStore):
+                objs = [
+                    UnblindedOutput(outpoint=f"{txid}:{vout}", **out)
+                    for (txid, vout), out in unblinded.items()
+                ]
+            self.unblinded_store.save(objs, changed=changed)
+        return res
@@ -4,8 +4,7 @@ from embit import ec
 from embit.liquid.pset import PSET
 from embit.liquid.transaction import LTransaction
 from .txlist import LTxList
-from .addresslist import LAddressList
-from embit.liquid.addresses import to_unconfidential
+from .addresslist import LAddressList, unconfidential
 
 
 class LWallet(Wallet):
@@ -322,6 +321,14 @@ class LWallet(Wallet):
         except:
             return None
 
+    def delete_files(self):
+        super().delete_files()
+        self._transactions.unblinded_store.delete()
+
+    def decodepsbt(self, b64psbt):
+        # PSETs are decoded and unblinded by LiquidRPC
+        return self.rpc.decodepsbt(b64psbt)
+
     def createpsbt(
         self,
         addresses: [str],
@@ -504,4 +511,4 @@ class LWallet(Wallet):
 
     @property
     def unconfidential_address(self):
-        return to_unconfidential(self.address)
+        return unconfidential(self.address)
@@ -7,12 +7,14 @@ import threading
 import traceback
 import hashlib
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 from ..helpers import alias, load_jsons, is_liquid, add_dicts
 from ..persistence import delete_file, delete_folder
 from ..rpc import RpcError, get_default_datadir
 from ..specter_error import SpecterError
+from ..txindex import merge_queries
 from ..util.descriptor import AddChecksum
 from ..wallet import Wallet, purposes
 from ..liquid.wallet import LWallet
@@ -34,6 +36,8 @@ from embit.descriptor.checksum import add_checksum
 
 logger = logging.getLogger(__name__)
 
+WALLET_LOADING_THREADS = int(os.getenv("SPECTER_WALLET_LOADING_THREADS", "4"))
+
 
 class WalletManager:
     # chain is required to manage wallets when bitcoind is not running
@@ -58,6 +62,10 @@ class WalletManager:
         self.failed_load_wallets = []
         self.bitcoin_core_version_raw = bitcoin_core_version_raw
         self.allow_threading = allow_threading
+        # max number of wallets loaded in parallel
+        self.loading_threads = WALLET_LOADING_THREADS
+        # wallet alias: "queued" / "loading" / "done" / "failed" during update
+        self.loading_progress = {}
         # define different wallet classes for liquid and bitcoin
         self.WalletClass = LWallet if is_liquid(chain) else Wallet
         self.update(data_folder, rpc, chain)
@@ -125,134 +133,36 @@ class WalletManager:
         existing_names = list(self.wallets.keys())
         # list of wallet to keep
         self.failed_load_wallets = []
+        self.loading_progress = {
+            self.wallets_update_list[wallet]["alias"]: "queued"
+            for wallet in self.wallets_update_list
+        }
         try:
             if self.wallets_update_list:
                 loaded_wallets = self.rpc.listwallets()
                 logger.info("Getting loaded wallets list from Bitcoin Core")
-                for wallet in self.wallets_update_list:
-                    wallet_alias = self.wallets_update_list[wallet]["alias"]
-                    wallet_name = self.wallets_update_list[wallet]["name"]
-                    if os.path.join(self.rpc_path, wallet_alias) not in loaded_wallets:
-                        try:
-                            logger.info(
-                                "Loading %s to Bitcoin Core"
-                                % self.wallets_update_list[wallet]["alias"]
-                            )
-                            self.rpc.loadwallet(
-                                os.path.join(self.rpc_path, wallet_alias)
-                            )
-                            logger.info(
-                                "Initializing %s Wallet object"
-                                % self.wallets_update_list[wallet]["alias"]
-                            )
-                            loaded_wallet = self.WalletClass.from_json(
-                                self.wallets_update_list[wallet],
-                                self.device_manager,
-                                self,
-                            )
-                            if not loaded_wallet:
-                                raise Exception("Failed to load wallet")
-                            # Lock UTXO of pending PSBTs
-                            logger.info(
-                                "Re-locking UTXOs of wallet %s"
-                                % self.wallets_update_list[wallet]["alias"]
-                            )
-                            if len(loaded_wallet.pending_psbts) > 0:
-                                for psbt in loaded_wallet.pending_psbts:
-                                    logger.info(
-                                        "lock %s " % wallet_alias,
-                                        loaded_wallet.pending_psbts[psbt]["tx"]["vin"],
-                                    )
-                                    loaded_wallet.rpc.lockunspent(
-                                        False,
-                                        [
-                                            utxo
-                                            for utxo in loaded_wallet.pending_psbts[
-                                                psbt
-                                            ]["tx"]["vin"]
-                                        ],
-                                    )
-                            if len(loaded_wallet.frozen_utxo) > 0:
-                                loaded_wallet.rpc.lockunspent(
-                                    False,
-                                    [
-                                        {
-                                            "txid": utxo.split(":")[0],
-                                            "vout": int(utxo.split(":")[1]),
-                                        }
-                                        for utxo in loaded_wallet.frozen_utxo
-                                    ],
-                                )
-                            self.wallets[wallet_name] = loaded_wallet
-                            logger.info(
-                                "Finished loading wallet into Bitcoin Core and Specter: %s"
-                                % self.wallets_update_list[wallet]["alias"]
-                            )
-                        except RpcError as e:
-                            logger.warning(
-                                f"Couldn't load wallet {wallet_alias} into core. Silently ignored! RPC error: {e}"
-                            )
-                            self.failed_load_wallets.append(
-                                {
-                                    **self.wallets_update_list[wallet],
-                                    "loading_error": str(e).replace("'", ""),
-                                }
-                            )
-                        except Exception as e:
-                            logger.warning(
-                                f"Couldn't load wallet {wallet_alias}. Silently ignored! Wallet error: {e}"
-                            )
-                            self.failed_load_wallets.append(
-                                {
-                                    **self.wallets_update_list[wallet],
-                                    "loading_error": str(e).replace("'", ""),
-                                }
-                            )
-                    else:
-                        if wallet_name not in existing_names:
-                            # ok wallet is already there
-                            # we only need to update
-                            try:
-                                logger.info(
-                                    "Wallet already loaded in Bitcoin Core. Initializing %s Wallet object"
-                                    % self.wallets_update_list[wallet]["alias"]
-                                )
-                                loaded_wallet = self.WalletClass.from_json(
-                                    self.wallets_update_list[wallet],
-                                    self.device_manager,
-                                    self,
-                                )
-                                if loaded_wallet:
-                                    self.wallets[wallet_name] = loaded_wallet
-                                    logger.info(
-                                        "Finished loading wallet into Specter: %s"
-                                        % self.wallets_update_list[wallet]["alias"]
-                                    )
-                                else:
-                                    raise Exception("Failed to load wallet")
-                            except Exception as e:
-                                logger.warning(
-                                    f"Failed to load wallet {wallet_name}: {e}"
-                                )
-                                logger.warning(traceback.format_exc())
-                                self.failed_load_wallets.append(
-                                    {
-                                        **self.wallets_update_list[wallet],
-                                        "loading_error": str(e).replace("'", ""),
-                                    }
-                                )
-                        else:
-                            # wallet is loaded and should stay
-                            logger.info(
-                                "Wallet already in Specter, updating wallet: %s"
-                                % self.wallets_update_list[wallet]["alias"]
-                            )
-                            self.wallets[wallet_name].update()
-                            logger.info(
-                                "Finished updating wallet:  %s"
-                                % self.wallets_update_list[wallet]["alias"]
-                            )
-                            # TODO: check wallet file didn't change
+                wallets = list(self.wallets_update_list.keys())
+                args = (loaded_wallets, existing_names)
+                if self.allow_threading and self.loading_threads > 1:
+                    # bounded pool so we don't overload Bitcoin Core
+                    with ThreadPoolExecutor(
+                        max_workers=self.loading_threads,
+                        thread_name_prefix="wallet_loading",
+                    ) as executor:
+                        futures = [
+                            executor.submit(self._load_wallet_task, wallet, *args)
+                            for wallet in wallets
+                        ]
+                    results = [future.result() for future in futures]
+                else:
+                    results = [
+                        self._load_wallet_task(wallet, *args) for wallet in wallets
+                    ]
+                # insert in the order of the update list, not in completion order
+                for wallet, loaded_wallet in zip(wallets, results):
+                    if loaded_wallet is not None:
+                        wallet_name = self.wallets_update_list[wallet]["name"]
+                        self.wallets[wallet_name] = loaded_wallet
         # only ignore rpc errors
         except RpcError as e:
             logger.error(f"Failed updating wallet manager. RPC error: {e}")
@@ -260,6 +170,147 @@ class WalletManager:
         self.wallets_update_list = {}
         self.is_loading = False
 
+    def _load_wallet_task(self, wallet, loaded_wallets, existing_names):
+        """
+        Loads or updates a single wallet in the worker pool and tracks progress.
+        Returns the new Wallet object or None if it failed or was already there.
+        """
+        wallet_alias = self.wallets_update_list[wallet]["alias"]
+        self.loading_progress[wallet_alias] = "loading"
+        loaded_wallet = None
+        try:
+            loaded_wallet = self._load_wallet(wallet, loaded_wallets, existing_names)
+            failed = [w["alias"] for w in list(self.failed_load_wallets)]
+            status = "failed" if wallet_alias in failed else "done"
+        except Exception as e:
+            # errors of one wallet should not stop loading of the others
+            logger.error(f"Failed updating wallet {wallet_alias}: {e}")
+            status = "failed"
+        self.loading_progress[wallet_alias] = status
+        return loaded_wallet
+
+    def _load_wallet(self, wallet, loaded_wallets, existing_names):
+        """Returns the new Wallet object, None if it failed or was already there"""
+        wallet_alias = self.wallets_update_list[wallet]["alias"]
+        wallet_name = self.wallets_update_list[wallet]["name"]
+        if os.path.join(self.rpc_path, wallet_alias) not in loaded_wallets:
+            try:
+                logger.info(
+                    "Loading %s to Bitcoin Core"
+                    % self.wallets_update_list[wallet]["alias"]
+                )
+                self.rpc.loadwallet(os.path.join(self.rpc_path, wallet_alias))
+                logger.info(
+                    "Initializing %s Wallet object"
+                    % self.wallets_update_list[wallet]["alias"]
+                )
+                loaded_wallet = self.WalletClass.from_json(
+                    self.wallets_update_list[wallet],
+                    self.device_manager,
+                    self,
+                )
+                if not loaded_wallet:
+                    raise Exception("Failed to load wallet")
+                # Lock UTXO of pending PSBTs
+                logger.info(
+                    "Re-locking UTXOs of wallet %s"
+                    % self.wallets_update_list[wallet]["alias"]
+                )
+                if len(loaded_wallet.pending_psbts) > 0:
+                    for psbt in loaded_wallet.pending_psbts:
+                        logger.info(
+                            "lock %s " % wallet_alias,
+                            loaded_wallet.pending_psbts[psbt]["tx"]["vin"],
+                        )
+                        loaded_wallet.rpc.lockunspent(
+                            False,
+                            [
+                                utxo
+                                for utxo in loaded_wallet.pending_psbts[psbt]["tx"][
+                                    "vin"
+                                ]
+                            ],
+                        )
+                if len(loaded_wallet.frozen_utxo) > 0:
+                    loaded_wallet.rpc.lockunspent(
+                        False,
+                        [
+                            {
+                                "txid": utxo.split(":")[0],
+                                "vout": int(utxo.split(":")[1]),
+                            }
+                            for utxo in loaded_wallet.frozen_utxo
+                        ],
+                    )
+                logger.info(
+                    "Finished loading wallet into Bitcoin Core and Specter: %s"
+                    % self.wallets_update_list[wallet]["alias"]
+                )
+                return loaded_wallet
+            except RpcError as e:
+                logger.warning(
+                    f"Couldn't load wallet {wallet_alias} into core. Silently ignored! RPC error: {e}"
+                )
+                self.failed_load_wallets.append(
+                    {
+                        **self.wallets_update_list[wallet],
+                        "loading_error": str(e).replace("'", ""),
+                    }
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Couldn't load wallet {wallet_alias}. Silently ignored! Wallet error: {e}"
+                )
+                self.failed_load_wallets.append(
+                    {
+                        **self.wallets_update_list[wallet],
+                        "loading_error": str(e).replace("'", ""),
+                    }
+                )
+        else:
+            if wallet_name not in existing_names:
+                # ok wallet is already there
+                # we only need to update
+                try:
+                    logger.info(
+                        "Wallet already loaded in Bitcoin Core. Initializing %s Wallet object"
+                        % self.wallets_update_list[wallet]["alias"]
+                    )
+                    loaded_wallet = self.WalletClass.from_json(
+                        self.wallets_update_list[wallet],
+                        self.device_manager,
+                        self,
+                    )
+                    if loaded_wallet:
+                        logger.info(
+                            "Finished loading wallet into Specter: %s"
+                            % self.wallets_update_list[wallet]["alias"]
+                        )
+                        return loaded_wallet
+                    else:
+                        raise Exception("Failed to load wallet")
+                except Exception as e:
+                    logger.warning(f"Failed to load wallet {wallet_name}: {e}")
+                    logger.warning(traceback.format_exc())
+                    self.failed_load_wallets.append(
+                        {
+                            **self.wallets_update_list[wallet],
+                            "loading_error": str(e).replace("'", ""),
+                        }
+                    )
+            else:
+                # wallet is loaded and should stay
+                logger.info(
+                    "Wallet already in Specter, updating wallet: %s"
+                    % self.wallets_update_list[wallet]["alias"]
+                )
+                self.wallets[wallet_name].update()
+                logger.info(
+                    "Finished updating wallet:  %s"
+                    % self.wallets_update_list[wallet]["alias"]
+                )
+                # TODO: check wallet file didn't change
+
     def get_by_alias(self, alias):
         for wallet_name in self.wallets:
             if self.wallets[wallet_name] and self.wallets[wallet_name].alias == alias:
@@ -344,7 +395,9 @@ class WalletManager:
                 if os.path.exists(path):
                     shutil.rmtree(path)
                     break
-        # Delete files
+        # Delete files, the rescan state first:
+        # a new wallet with this alias must not resume the old rescan
+        delete_file(wallet.rescan_state_path)
         wallet.delete_files()
         del self.wallets[wallet.name]
         self.update()
@@ -379,32 +432,68 @@ class WalletManager:
         #    validate_merkle_proofs (bool): Return transactions with validated_blockhash
         #    current_blockheight (int): Current blockheight for calculating confirmations number (None will fetch the block count from the RPC)
         """
-        txlists = [
-            [
-                {**tx, "wallet_alias": wallet.alias}
-                for tx in wallet.txlist(
-                    fetch_transactions=fetch_transactions,
-                    validate_merkle_proofs=validate_merkle_proofs,
-                    current_blockheight=current_blockheight,
+        return self.full_txlist_query(
+            fetch_transactions=fetch_transactions,
+            validate_merkle_proofs=validate_merkle_proofs,
+            current_blockheight=current_blockheight,
+        )[0]
+
+    def full_txlist_query(
+        self,
+        search=None,
+        sortby=None,
+        sortdir="asc",
+        idx=0,
+        limit=0,
+        fetch_transactions=True,
+        validate_merkle_proofs=False,
+        current_blockheight=None,
+    ):
+        """Returns a page of transactions of all wallets and the total number of matching transactions.
+        See Wallet.txlist_query for parameters.
+        """
+        wallets = {}
+        for wallet in self.wallets.values():
+            wallet._update_txlist(fetch_transactions)
+            wallets[id(wallet._transactions.index)] = wallet
+        if not wallets:
+            return [], 0
+        try:
+            if not current_blockheight:
+                current_blockheight = next(iter(wallets.values())).rpc.getblockcount()
+            items, total = merge_queries(
+                [wallet._transactions.index for wallet in wallets.values()],
+                search=search,
+                sortby=sortby,
+                sortdir=sortdir,
+                idx=idx,
+                limit=limit,
+                current_blockheight=current_blockheight,
+            )
+            # process transactions wallet by wallet to batch rpc calls
+            by_wallet = {}
+            for index, txid in items:
+                by_wallet.setdefault(id(index), []).append(txid)
+            processed = {}
+            for key, txids in by_wallet.items():
+                wallet = wallets[key]
+                txs = wallet.process_txs(
+                    txids, current_blockheight, validate_merkle_proofs
                 )
-            ]
-            for wallet in self.wallets.values()
-        ]
-        result = []
-        for txlist in txlists:
-            for tx in txlist:
-                result.append(tx)
-        return list(reversed(sorted(result, key=lambda tx: tx["time"])))
+                for tx in txs:
+                    tx["wallet_alias"] = wallet.alias
+                    processed[(key, tx["txid"])] = tx
+            return [processed[(id(index), txid)] for index, txid in items], total
+        except Exception as e:
+            logger.error("Exception while processing full txlist: {}".format(e))
+            return [], 0
 
     def full_utxo(self):
         """Returns a list of all UTXOs in all wallets loaded in the wallet_manager."""
         txlists = [
             [
-                {
-                    **utxo,
-                    "label": wallet.getlabel(utxo["address"]),
-                    "wallet_alias": wallet.alias,
-                }
+                # labels are kept up to date by the wallet
+                {**utxo, "wallet_alias": wallet.alias}
                 for utxo in wallet.full_utxo
             ]
             for wallet in self.wallets.values()
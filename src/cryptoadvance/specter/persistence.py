@@ -3,10 +3,12 @@
     call the call-back-method.
 """
 
+import atexit
 import os
 import json
 import csv
 import threading
+import time
 import logging
 from flask import current_app as app
 from .util.shell import run_shell
@@ -15,13 +17,183 @@ import shutil
 
 logger = logging.getLogger(__name__)
 
-fslock = threading.Lock()
+# storage callbacks of changes within this time (in seconds) are merged into one
+CALLBACK_DELAY = float(os.getenv("SPECTER_PERSISTENCE_CALLBACK_DELAY", "2"))
+
+# max time in seconds a write of an existing json file can be delayed,
+# repeated writes of the same file within this window are merged into one
+WRITE_DELAY = float(os.getenv("SPECTER_WRITE_DELAY", "1"))
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def file_lock(path):
+    """Returns a lock for the file, writes of different files don't block each other"""
+    path = os.path.abspath(path)
+    with _locks_lock:
+        if path not in _locks:
+            _locks[path] = threading.RLock()
+        return _locks[path]
+
+
+class WriteBehind:
+    """
+    Keeps serialized content of json files that should be written
+    and writes them from a timer thread after delay seconds.
+    Only the last content of a file is written, reads of pending files
+    get the pending content. flush() writes everything immediately,
+    it's called on exit.
+    """
+
+    def __init__(self, delay=WRITE_DELAY):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+    def schedule(self, path, data):
+        with self.lock:
+            self._pending[os.path.abspath(path)] = data
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def get(self, path):
+        """Returns pending content of the file or None"""
+        with self.lock:
+            return self._pending.get(os.path.abspath(path))
+
+    def cancel(self, path):
+        """Drops pending writes of the file or all files in the folder"""
+        path = os.path.abspath(path)
+        with self.lock:
+            for fname in list(self._pending):
+                if fname == path or fname.startswith(path + os.sep):
+                    self._pending.pop(fname)
+
+    def flush(self):
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            paths = list(self._pending)
+        written = []
+        for path in paths:
+            # we hold the file lock from taking the content until the write
+            # is done, so readers get either pending content or the new file
+            with file_lock(path):
+                with self.lock:
+                    data = self._pending.pop(path, None)
+                if data is None:
+                    continue
+                try:
+                    _write_file(data, path)
+                    written.append(path)
+                except Exception as e:
+                    logger.exception(f"Failed to write to file {path}: {e}")
+        if written:
+            storage_callback(written)
+
+
+write_behind = WriteBehind()
+
+
+class CallbackRunner:
+    """
+    Runs SPECTER_PERSISTENCE_CALLBACK in a background thread.
+    All changes within delay seconds are merged into one run,
+    the changed paths are passed in the SPECTER_CHANGED_PATHS env-var,
+    one per line. Runs, failures and latency are available via stats().
+    """
+
+    def __init__(self, delay=CALLBACK_DELAY):
+        self.delay = delay
+        self.lock = threading.Lock()
+        # only one callback runs at a time
+        self.run_lock = threading.Lock()
+        self._paths = set()
+        self._pending = False
+        self._timer = None
+        self.runs = 0
+        self.failures = 0
+        self.total_time = 0
+        self.last_time = 0
+
+    def notify(self, paths=None):
+        with self.lock:
+            self._pending = True
+            self._paths.update(os.path.abspath(path) for path in paths or [])
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def run(self):
+        """Runs the callback now if there are changes"""
+        with self.run_lock:
+            with self.lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._pending:
+                    return
+                paths = sorted(self._paths)
+                self._paths = set()
+                self._pending = False
+            cmd = os.getenv("SPECTER_PERSISTENCE_CALLBACK")
+            if not cmd:
+                return
+            t0 = time.time()
+            result = run_shell(
+                cmd.split(" "),
+                env={**os.environ, "SPECTER_CHANGED_PATHS": "\n".join(paths)},
+            )
+            self.last_time = time.time() - t0
+            self.total_time += self.last_time
+            self.runs += 1
+            if result["code"] != 0:
+                self.failures += 1
+                logger.error("callback failed stdout: {}".format(result["out"]))
+                logger.error("stderr {}".format(result["err"]))
+            else:
+                logger.info(
+                    "Successfully executed {} for {} changed files in {:.2f}s".format(
+                        cmd, len(paths), self.last_time
+                    )
+                )
+                logger.debug("result: {}".format(result))
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "pending": self._pending,
+            "last_ms": round(1000 * self.last_time, 2),
+            "avg_ms": round(1000 * self.total_time / self.runs, 2) if self.runs else 0,
+        }
+
+
+callback_runner = CallbackRunner()
+
+
+def flush():
+    """Writes all pending files to disk and runs the pending callback"""
+    write_behind.flush()
+    callback_runner.run()
+
+
+atexit.register(flush)
 
 
 def read_json_file(path):
     """read_json_file from the .specter-directory. Don't use it for
     something else"""
-    with fslock:
+    with file_lock(path):
+        data = write_behind.get(path)
+        if data is not None:
+            return json.loads(data)
         bkp = path + ".bkp"
         # try reading file
         try:
@@ -45,55 +217,66 @@ def read_json_file(path):
 
 def _delete_folder(path):
     """Internal method which won't trigger the callback"""
-    with fslock:
+    write_behind.cancel(path)
+    with file_lock(path):
         if os.path.exists(path):
             shutil.rmtree(path)
 
 
-def _write_json_file(content, path, lock=None):
-    """Internal method which won't trigger the callback"""
+def _write_file(data, path):
+    """
+    Atomic write: the content goes to a temporary file which replaces
+    the file after fsync. The old file is kept as .bkp
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.isfile(path):
+        os.replace(path, path + ".bkp")
+    os.replace(tmp, path)
+
+
+def _serialize(content, lock=None):
+    """lock protects the content from changes while we serialize it"""
     if lock is None:
-        lock = fslock
+        return json.dumps(content, indent=4)
     with lock:
-        # backup file
-        bkp = path + ".bkp"
-        # check if file exists
-        if os.path.isfile(path):
-            # check if backup exists
-            if os.path.isfile(bkp):
-                # remove backup file
-                os.remove(bkp)
-            # move file to backup
-            os.rename(path, bkp)
-        with open(path, "w") as f:
-            json.dump(content, f, indent=4)
-        # check if write was sucessfull
-        try:
-            with open(path, "r") as f:
-                c = json.load(f)
-        # if not - move back backup
-        except:
-            # remove damaged file
-            if os.path.isfile(path):
-                os.remove(path)
-            os.rename(bkp, path)
-            logger.error(f"Failed to write to file {path}")
+        return json.dumps(content, indent=4)
+
+
+def _write_json_file(content, path, lock=None):
+    """Internal method which won't trigger the callback"""
+    data = _serialize(content, lock)
+    with file_lock(path):
+        write_behind.cancel(path)
+        _write_file(data, path)
 
 
 def write_json_file(content, path, lock=None):
-    _write_json_file(content, path, lock)
-    storage_callback()
+    """
+    Writes of existing files are delayed and merged (see WriteBehind),
+    new files are written immediately so they can be found in the folder.
+    """
+    if WRITE_DELAY <= 0 or not os.path.isfile(path):
+        _write_json_file(content, path, lock)
+        storage_callback([path])
+    else:
+        write_behind.schedule(path, _serialize(content, lock))
 
 
 def delete_files(paths):
     """deletes multiple files and calls storage callback once"""
-    need_callback = False
+    deleted = []
     for path in paths:
-        if os.path.exists(path):
-            os.remove(path)
-            need_callback = True
-    if need_callback:
-        storage_callback()
+        write_behind.cancel(path)
+        with file_lock(path):
+            if os.path.exists(path):
+                os.remove(path)
+                deleted.append(path)
+    if deleted:
+        storage_callback(deleted)
 
 
 def delete_file(path):
@@ -102,14 +285,15 @@ def delete_file(path):
 
 def write_devices(devices_json):
     """interpret a json as a list of devices and write them in the devices subfolder inside the specter-folder"""
+    paths = []
     for device_json in devices_json:
-        _write_json_file(
-            device_json,
+        paths.append(
             os.path.join(
                 app.specter.device_manager.data_folder, "%s.json" % device_json["alias"]
-            ),
+            )
         )
-    storage_callback()
+        _write_json_file(device_json, paths[-1])
+    storage_callback(paths)
 
 
 def write_wallet(wallet_json):
@@ -120,28 +304,28 @@ def write_wallet(wallet_json):
         app.specter.wallet_manager.working_folder, "%s.json" % wallet_json["alias"]
     )
     _write_json_file(wallet_json, fpath)
-    storage_callback()
+    storage_callback([fpath])
 
 
 def write_device(device, fullpath):
     _write_json_file(device.json, fullpath)
-    storage_callback()
+    storage_callback([fullpath])
 
 
 def write_node(node, fullpath):
     _write_json_file(node.json, fullpath)
-    storage_callback()
+    storage_callback([fullpath])
 
 
 def delete_folder(path):
     _delete_folder(path)
-    storage_callback()
+    storage_callback([path])
 
 
 def delete_folders(paths):
     for path in paths:
         _delete_folder(path)
-    storage_callback()
+    storage_callback(paths)
 
 
 def _write_csv(fname, objs, cls=dict):
@@ -152,7 +336,7 @@ def _write_csv(fname, objs, cls=dict):
     # if it's just a dict
     elif len(objs) > 0:
         columns = objs[0].keys()
-    with fslock:
+    with file_lock(fname):
         with open(fname, mode="w") as csv_file:
             writer = csv.DictWriter(csv_file, fieldnames=columns, extrasaction="ignore")
             writer.writeheader()
@@ -162,26 +346,23 @@ def _write_csv(fname, objs, cls=dict):
 
 def write_csv(fname, objs, cls=dict):
     _write_csv(fname, objs, cls)
-    storage_callback()
+    storage_callback([fname])
 
 
 def read_csv(fname, cls=dict, *args):
-    with fslock:
+    with file_lock(fname):
         with open(fname, mode="r") as csv_file:
             csv_reader = csv.DictReader(csv_file)
             return [cls(*args, **row) for row in csv_reader]
 
 
-def storage_callback():
-    if os.getenv("SPECTER_PERSISTENCE_CALLBACK"):
-        result = run_shell(os.getenv("SPECTER_PERSISTENCE_CALLBACK").split(" "))
-        if result["code"] != 0:
-            logger.error("callback failed stdout: {}".format(result["out"]))
-            logger.error("stderr {}".format(result["err"]))
-        else:
-            logger.info(
-                "Successfully executed {}".format(
-                    os.getenv("SPECTER_PERSISTENCE_CALLBACK")
-                )
-            )
-            logger.debug("result: {}".format(result))
+def storage_callback(paths=None):
+    """
+    Schedules SPECTER_PERSISTENCE_CALLBACK for changed paths,
+    runs it immediately if SPECTER_PERSISTENCE_CALLBACK_DELAY is 0
+    """
+    if not os.getenv("SPECTER_PERSISTENCE_CALLBACK"):
+        return
+    callback_runner.notify(paths)
+    if callback_runner.delay <= 0:
+        callback_runner.run()
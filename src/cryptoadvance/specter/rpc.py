@@ -1,10 +1,35 @@
 import logging
 import requests, json, os
 import os, sys, errno
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .helpers import is_ip_private
 
 logger = logging.getLogger(__name__)
 
+# max number of parallel connections to one node
+RPC_POOL_SIZE = int(os.getenv("SPECTER_RPC_POOL_SIZE", "10"))
+# retries of transient errors (connection refused, node warming up)
+RPC_RETRIES = int(os.getenv("SPECTER_RPC_RETRIES", "3"))
+RPC_BACKOFF = float(os.getenv("SPECTER_RPC_BACKOFF", "0.5"))
+
+# default timeouts in seconds for methods that can take long,
+# all other methods use the timeout of the BitcoinRPC instance
+METHOD_TIMEOUTS = {
+    "rescanblockchain": 3600,
+    "scantxoutset": 3600,
+    "importmulti": 600,
+    "importdescriptors": 600,
+    "loadwallet": 600,
+    "createwallet": 600,
+    "gettxoutproof": 120,
+}
+
+# Bitcoin Core is starting up (loading block index, verifying blocks...)
+RPC_IN_WARMUP = -28
+
 # TODO: redefine __dir__ and help
 
 RPC_PORTS = {
@@ -212,12 +237,55 @@ class RpcError(Exception):
             self.error = "UNKNOWN API-ERROR:%s" % response.text
 
 
+class RpcMetrics:
+    """Thread-safe per-method counters of rpc calls and their latency"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._methods = {}
+
+    def record(self, methods, elapsed, error=False):
+        """Records one request, a batch request counts for every method in it"""
+        with self.lock:
+            for method in set(methods):
+                m = self._methods.setdefault(
+                    method,
+                    {"calls": 0, "requests": 0, "errors": 0, "total": 0, "max": 0},
+                )
+                m["calls"] += methods.count(method)
+                m["requests"] += 1
+                m["errors"] += int(error)
+                m["total"] += elapsed
+                m["max"] = max(m["max"], elapsed)
+
+    def stats(self):
+        """Returns {method: {calls, requests, errors, avg_ms, max_ms}}"""
+        with self.lock:
+            return {
+                method: {
+                    "calls": m["calls"],
+                    "requests": m["requests"],
+                    "errors": m["errors"],
+                    "avg_ms": round(1000 * m["total"] / m["requests"], 2),
+                    "max_ms": round(1000 * m["max"], 2),
+                }
+                for method, m in self._methods.items()
+            }
+
+    def clear(self):
+        with self.lock:
+            self._methods = {}
+
+
 class BitcoinRPC:
     counter = 0
 
     last_call_hash = None
     last_call_hash_counter = 0
 
+    metrics = RpcMetrics()
+    _lock = threading.Lock()
+
     def __init__(
         self,
         user="bitcoin",
@@ -230,6 +298,8 @@ class BitcoinRPC:
         session=None,
         proxy_url="socks5h://localhost:9050",
         only_tor=False,
+        pool_size=None,
+        retries=None,
         **kwargs,
     ):
         path = path.replace("//", "/")  # just in case
@@ -242,6 +312,8 @@ class BitcoinRPC:
         self.timeout = timeout
         self.proxy_url = proxy_url
         self.only_tor = only_tor
+        self.pool_size = pool_size or RPC_POOL_SIZE
+        self.retries = RPC_RETRIES if retries is None else retries
         self.r = None
         self.last_call_hash = None
         self.last_call_hash_counter = 0
@@ -254,6 +326,25 @@ class BitcoinRPC:
     def _create_session(self):
         session = requests.Session()
         session.auth = (self.user, self.password)
+        # the session is shared by all clones and wallets of this node
+        # and used from many threads, so we need a pool of connections.
+        # Only failed connects are retried here, a request that reached
+        # the node is never sent twice.
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=True,
+            max_retries=Retry(
+                total=self.retries,
+                connect=self.retries,
+                read=0,
+                status=0,
+                backoff_factor=RPC_BACKOFF,
+            ),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive"
         # check if we need to connect over Tor
         if not is_ip_private(self.host):
             if self.only_tor or ".onion" in self.host:
@@ -274,6 +365,8 @@ class BitcoinRPC:
             session=self.session,
             proxy_url=self.proxy_url,
             only_tor=self.only_tor,
+            pool_size=self.pool_size,
+            retries=self.retries,
         )
 
     @property
@@ -313,11 +406,21 @@ class BitcoinRPC:
             self.session,
             self.proxy_url,
             self.only_tor,
+            self.pool_size,
+            self.retries,
         )
 
+    def get_timeout(self, methods):
+        """Timeout of a request, the longest of the methods in the batch"""
+        timeouts = [METHOD_TIMEOUTS.get(method, self.timeout) for method in methods]
+        if None in timeouts:
+            return None
+        return max(timeouts, default=self.timeout)
+
     def multi(self, calls: list, **kwargs):
         """Makes batch request to Core"""
-        type(self).counter += len(calls)
+        with type(self)._lock:
+            type(self).counter += len(calls)
         # some debug info for optimizations
         # methods = " ".join(list(dict.fromkeys([call[0] for call in calls])))
         # wallet = self.path.split("/")[-1]
@@ -332,27 +435,55 @@ class BitcoinRPC:
             }
             for i, (method, *args) in enumerate(calls)
         ]
-        timeout = self.timeout
+        methods = [call[0] for call in calls]
+        timeout = self.get_timeout(methods)
         if "timeout" in kwargs:
             timeout = kwargs["timeout"]
         url = self.url
         if "wallet" in kwargs:
             url = url + "/wallet/{}".format(kwargs["wallet"])
         self.trace_call(url, payload)
-        r = self.session.post(
-            url, data=json.dumps(payload), headers=headers, timeout=timeout
-        )
-        self.r = r
-        if r.status_code != 200:
-            raise RpcError(
-                "Server responded with error code %d: %s" % (r.status_code, r.text), r
+        data = json.dumps(payload)
+        for attempt in range(self.retries + 1):
+            t0 = time.time()
+            try:
+                r = self.session.post(url, data=data, headers=headers, timeout=timeout)
+            except requests.exceptions.RequestException:
+                self.metrics.record(methods, time.time() - t0, error=True)
+                raise
+            self.metrics.record(methods, time.time() - t0, error=r.status_code != 200)
+            self.r = r
+            if r.status_code != 200:
+                raise RpcError(
+                    "Server responded with error code %d: %s" % (r.status_code, r.text),
+                    r,
+                )
+            r = r.json()
+            # the node is starting up - wait and try again
+            warmup = [
+                res
+                for res in r
+                if res.get("error") and res["error"].get("code") == RPC_IN_WARMUP
+            ]
+            if not warmup or attempt == self.retries:
+                break
+            delay = RPC_BACKOFF * 2 ** attempt
+            logger.info(
+                f"Bitcoin Core is warming up ({warmup[0]['error'].get('message')}), retrying in {delay}s"
             )
-        r = r.json()
+            time.sleep(delay)
         return r
 
     @classmethod
     def trace_call(cls, url, payload):
         """logs out the call and its payload, reduces noise by suppressing repeated calls"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        with cls._lock:
+            cls._trace_call(url, payload)
+
+    @classmethod
+    def _trace_call(cls, url, payload):
         if False:  # noise-reduction
             logger.debug(f"call({url}) payload:{payload}")
         else:
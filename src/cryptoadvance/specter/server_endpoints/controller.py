@@ -202,13 +202,15 @@ def about():
 def wallets_loading():
     return {
         "is_loading": app.specter.wallet_manager.is_loading,
+        # wallets are added by the loading threads, so we iterate over copies
         "loaded_wallets": [
-            app.specter.wallet_manager.wallets[wallet].alias
-            for wallet in app.specter.wallet_manager.wallets
+            wallet.alias for wallet in list(app.specter.wallet_manager.wallets.values())
         ],
         "failed_load_wallets": [
-            wallet["alias"] for wallet in app.specter.wallet_manager.failed_load_wallets
+            wallet["alias"]
+            for wallet in list(app.specter.wallet_manager.failed_load_wallets)
         ],
+        "loading_progress": dict(app.specter.wallet_manager.loading_progress),
     }
 
 
@@ -244,12 +246,17 @@ def txout_set_info():
 def get_scantxoutset_status():
     status = app.specter.rpc.scantxoutset("status", [])
     app.specter.info["utxorescan"] = status.get("progress", None) if status else None
-    if app.specter.info["utxorescan"] is None:
-        app.specter.utxorescanwallet = None
-    return {
-        "active": app.specter.info["utxorescan"] is not None,
-        "progress": app.specter.info["utxorescan"],
-    }
+    if app.specter.info["utxorescan"] is not None:
+        return {"active": True, "progress": app.specter.info["utxorescan"]}
+    # scantxoutset is done, found transactions may still be imported
+    for wallet in app.specter.wallet_manager.wallets.values():
+        progress = wallet.utxo_rescan_progress
+        if progress is not None:
+            app.specter.info["utxorescan"] = progress["progress"]
+            app.specter.utxorescanwallet = wallet.alias
+            return dict(progress, active=True)
+    app.specter.utxorescanwallet = None
+    return {"active": False, "progress": None}
 
 
 @app.route("/toggle_hide_sensitive_info/", methods=["POST"])
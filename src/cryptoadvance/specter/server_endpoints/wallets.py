@@ -37,8 +37,9 @@ from ..specter_error import SpecterError, handle_exception
 from ..util.base43 import b43_decode
 from ..util.descriptor import AddChecksum, Descriptor
 from ..util.fee_estimation import get_fees
-from ..util.price_providers import get_price_at
+from ..util.price_providers import get_prices_at
 from ..util.tx import decoderawtransaction
+from ..util.utxo_rescan import rescan_state_path
 from ..managers.wallet_manager import purposes
 
 rand = random.randint(0, 1e32)  # to force style refresh
@@ -103,6 +104,13 @@ def failed_wallets():
                 delete_file(fullpath + ".bkp")
                 delete_file(fullpath.replace(".json", "_addr.csv"))
                 delete_file(fullpath.replace(".json", "_txs.csv"))
+                delete_file(fullpath.replace(".json", "_proofs.csv"))
+                delete_file(fullpath.replace(".json", ".sqlite"))
+                delete_file(fullpath.replace(".json", "_txs_raw.pack"))
+                delete_file(fullpath.replace(".json", "_txs_raw.idx"))
+                delete_file(fullpath.replace(".json", "_unblinded.csv"))
+                # a new wallet with this alias must not resume the old rescan
+                delete_file(rescan_state_path(fullpath))
                 app.specter.wallet_manager.update()
             except Exception as e:
                 flash(_("Failed to delete wallet: {}").format(str(e)), "error")
@@ -769,7 +777,7 @@ def settings(wallet_alias):
         if action == "rescanblockchain":
             startblock = int(request.form["startblock"])
             try:
-                delete_file(wallet._transactions.path)
+                wallet._transactions.clear()
                 wallet.fetch_transactions()
                 res = wallet.rpc.rescanblockchain(startblock, timeout=1)
             except requests.exceptions.ReadTimeout:
@@ -810,6 +818,11 @@ def settings(wallet_alias):
                 wallet.change_keypool, wallet.change_keypool + delta, change=True
             )
             wallet.getdata()
+        elif action == "compacttxstore":
+            freed = wallet._transactions.compact()
+            flash(
+                _("Transactions storage compacted, {} kB freed").format(freed // 1000)
+            )
         elif action == "deletewallet":
             app.specter.wallet_manager.delete_wallet(
                 wallet, app.specter.bitcoin_datadir, app.specter.chain
@@ -1089,14 +1102,17 @@ def txlist(wallet_alias):
     sortby = request.form.get("sortby", None)
     sortdir = request.form.get("sortdir", "asc")
     fetch_transactions = request.form.get("fetch_transactions", False)
-    txlist = wallet.txlist(
+    txlist, count = wallet.txlist_query(
+        search=search,
+        sortby=sortby,
+        sortdir=sortdir,
+        idx=idx,
+        limit=limit,
         fetch_transactions=fetch_transactions,
         validate_merkle_proofs=app.specter.config.get("validate_merkle_proofs", False),
         current_blockheight=app.specter.info["blocks"],
     )
-    return process_txlist(
-        txlist, idx=idx, limit=limit, search=search, sortby=sortby, sortdir=sortdir
-    )
+    return txlist_page(txlist, count, limit)
 
 
 @wallets_endpoint.route("/wallet/<wallet_alias>/utxo_list", methods=["POST"])
@@ -1109,10 +1125,8 @@ def utxo_list(wallet_alias):
     search = request.form.get("search", None)
     sortby = request.form.get("sortby", None)
     sortdir = request.form.get("sortdir", "asc")
+    # labels are kept up to date by the wallet
     txlist = wallet.full_utxo
-    for tx in txlist:
-        if not tx.get("label", None):
-            tx["label"] = wallet.getlabel(tx["address"])
     return process_txlist(
         txlist, idx=idx, limit=limit, search=search, sortby=sortby, sortdir=sortdir
     )
@@ -1128,14 +1142,17 @@ def wallets_overview_txlist():
     sortby = request.form.get("sortby", None)
     sortdir = request.form.get("sortdir", "asc")
     fetch_transactions = request.form.get("fetch_transactions", False)
-    txlist = app.specter.wallet_manager.full_txlist(
+    txlist, count = app.specter.wallet_manager.full_txlist_query(
+        search=search,
+        sortby=sortby,
+        sortdir=sortdir,
+        idx=idx,
+        limit=limit,
         fetch_transactions=fetch_transactions,
         validate_merkle_proofs=app.specter.config.get("validate_merkle_proofs", False),
         current_blockheight=app.specter.info["blocks"],
     )
-    return process_txlist(
-        txlist, idx=idx, limit=limit, search=search, sortby=sortby, sortdir=sortdir
-    )
+    return txlist_page(txlist, count, limit)
 
 
 @wallets_endpoint.route("/wallets_overview/utxo_list", methods=["POST"])
@@ -1281,14 +1298,14 @@ def addresses_list_csv(wallet_alias):
 def tx_history_csv(wallet_alias):
     wallet = app.specter.wallet_manager.get_by_alias(wallet_alias)
     validate_merkle_proofs = app.specter.config.get("validate_merkle_proofs", False)
-    txlist = wallet.txlist(validate_merkle_proofs=validate_merkle_proofs)
     search = request.args.get("search", None)
     sortby = request.args.get("sortby", "time")
     sortdir = request.args.get("sortdir", "desc")
-    txlist = json.loads(
-        process_txlist(
-            txlist, idx=0, limit=0, search=search, sortby=sortby, sortdir=sortdir
-        )["txlist"]
+    txlist, _count = wallet.txlist_query(
+        search=search,
+        sortby=sortby,
+        sortdir=sortdir,
+        validate_merkle_proofs=validate_merkle_proofs,
     )
     includePricesHistory = request.args.get("exportPrices", "false") == "true"
 
@@ -1349,16 +1366,14 @@ def utxo_csv(wallet_alias):
 def wallet_overview_txs_csv():
     try:
         validate_merkle_proofs = app.specter.config.get("validate_merkle_proofs", False)
-        txlist = app.specter.wallet_manager.full_txlist(
-            validate_merkle_proofs=validate_merkle_proofs,
-        )
         search = request.args.get("search", None)
         sortby = request.args.get("sortby", "time")
         sortdir = request.args.get("sortdir", "desc")
-        txlist = json.loads(
-            process_txlist(
-                txlist, idx=0, limit=0, search=search, sortby=sortby, sortdir=sortdir
-            )["txlist"]
+        txlist, _count = app.specter.wallet_manager.full_txlist_query(
+            search=search,
+            sortby=sortby,
+            sortdir=sortdir,
+            validate_merkle_proofs=validate_merkle_proofs,
         )
         includePricesHistory = request.args.get("exportPrices", "false") == "true"
         # stream the response as the data is generated
@@ -1453,6 +1468,11 @@ def txlist_to_csv(wallet, _txlist, specter, current_user, includePricesHistory=F
     data.seek(0)
     data.truncate(0)
 
+    # resolve all prices at once, days are fetched only once and in bulk
+    prices = {}
+    if includePricesHistory:
+        prices = get_prices_at(specter, current_user, [tx["time"] for tx in txlist])
+
     # write each log item
     _wallet = wallet
     for tx in txlist:
@@ -1474,12 +1494,7 @@ def txlist_to_csv(wallet, _txlist, specter, current_user, includePricesHistory=F
         if specter.unit == "sat":
             value = float(tx["amount"])
             tx["amount"] = round(value * 1e8)
-        if includePricesHistory:
-            success, rate, symbol = get_price_at(
-                specter, current_user, timestamp=tx["time"]
-            )
-        else:
-            success = False
+        success, rate, symbol = prices.get(tx["time"], (False, 0, ""))
         if success:
             rate = float(rate)
             if specter.unit == "sat":
@@ -1547,11 +1562,7 @@ def addresses_list_to_csv(wallet):
         if address_info.is_external:
             balance_on_address = _("unknown (external address)")
         else:
-            balance_on_address = 0
-            if address_info.used:
-                for tx in wallet.full_utxo:
-                    if tx.get("address", "") == address:
-                        balance_on_address += tx.get("amount", 0)
+            balance_on_address = wallet.utxo_on_address(address)[1]
         row += (balance_on_address,)
 
         w.writerow(row)
@@ -1646,9 +1657,16 @@ def process_txlist(txlist, idx=0, limit=100, search=None, sortby=None, sortdir="
             return final
 
         txlist = sorted(txlist, key=sort, reverse=sortdir != "asc")
+    count = len(txlist)
     if limit:
-        page_count = (len(txlist) // limit) + (0 if len(txlist) % limit == 0 else 1)
         txlist = txlist[limit * idx : limit * (idx + 1)]
+    return txlist_page(txlist, count, limit)
+
+
+def txlist_page(txlist, count, limit=100):
+    """Returns a page of transactions for the UI, count is the number of all matching transactions"""
+    if limit:
+        page_count = (count // limit) + (0 if count % limit == 0 else 1)
     else:
         page_count = 1
     # add assets
@@ -41,7 +41,8 @@ from .specter_error import ExtProcTimeoutException, SpecterError
 from .tor_daemon import TorDaemonController
 from .user import User
 from .util.checker import Checker
-from .util.price_providers import update_price
+from .util.fee_estimation import FeeEstimation
+from .util.price_providers import PriceHistory, update_price
 from .util.setup_states import SETUP_STATES
 from .util.tor import get_tor_daemon_suffix
 
@@ -89,6 +90,8 @@ class Specter:
         )
 
         self._tor_daemon = None
+        self._fee_estimation = None
+        self._price_history = None
 
         self.setup_status = {
             "stage": "start",
@@ -132,6 +135,10 @@ class Specter:
             logger.info("Specter exit cleanup: Stopping Tor daemon")
             self._tor_daemon.stop_tor_daemon()
 
+        if self._fee_estimation:
+            logger.info("Specter exit cleanup: Stopping fee estimation")
+            self._fee_estimation.stop()
+
         for node in self.node_manager.nodes.values():
             if not node.external_node:
                 node.stop()
@@ -534,6 +541,22 @@ class Specter:
     def fee_estimator(self):
         return self.user_config.get("fee_estimator", "mempool")
 
+    @property
+    def price_history(self):
+        """Daily prices on disk, used for historical prices"""
+        if self._price_history is None:
+            self._price_history = PriceHistory(
+                os.path.join(self.data_folder, "price_history.sqlite")
+            )
+        return self._price_history
+
+    @property
+    def fee_estimation(self):
+        """Background fee estimation, started on first use"""
+        if self._fee_estimation is None:
+            self._fee_estimation = FeeEstimation(self)
+        return self._fee_estimation
+
     @property
     def tor_type(self):
         return self.user_config.get("tor_type", "builtin")
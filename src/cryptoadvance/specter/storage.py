@@ -0,0 +1,388 @@
+""" Storage backends for the per-wallet lists (addresses, transactions).
+    CsvStore is the legacy format: one csv-file per list which gets
+    rewritten completely on every save.
+    SqliteStore keeps all lists of a wallet in one indexed sqlite database
+    next to the wallet's json-file and only upserts the rows that changed.
+    The backend is selected via the SPECTER_WALLET_STORAGE env-var
+    ("sqlite" by default or "csv").
+    RawTxStore keeps raw transactions of a wallet in one append-only pack file.
+"""
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+
+from .persistence import (
+    delete_file,
+    delete_files,
+    delete_folder,
+    read_csv,
+    storage_callback,
+    write_csv,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "sqlite"
+
+
+def parse_bool(v):
+    """Converts "True"/"False" from csv and 0/1 from sqlite to bool"""
+    if isinstance(v, str):
+        return v == "True"
+    return bool(v)
+
+
+def get_store(path, cls, table, key, indexes=[]):
+    """
+    Returns a store for a list of cls objects.
+    path is the legacy csv path, i.e. <wallet>_txs.csv or <wallet>_addr.csv,
+    the sqlite database of the wallet is <wallet>.sqlite
+    """
+    backend = os.getenv("SPECTER_WALLET_STORAGE", DEFAULT_BACKEND)
+    if backend == "csv":
+        return CsvStore(path, cls)
+    dbpath = path.rsplit("_", 1)[0] + ".sqlite"
+    return SqliteStore(dbpath, table, cls, key, indexes=indexes, csv_path=path)
+
+
+class CsvStore:
+    """Legacy storage, csv can't be updated in place so we always write everything"""
+
+    def __init__(self, path, cls):
+        self.path = path
+        self.cls = cls
+
+    @property
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self, *args):
+        if not self.exists:
+            return []
+        return read_csv(self.path, self.cls, *args)
+
+    def save(self, objs, changed=None):
+        write_csv(self.path, list(objs), self.cls)
+
+    def clear(self):
+        delete_file(self.path)
+
+    def delete(self):
+        delete_file(self.path)
+
+
+class SqliteStore:
+    """
+    Stores objects of cls in a table of a sqlite database.
+    Columns are taken from cls.columns, key is the primary key column.
+    Lists are stored as json, booleans as integers.
+    If the table is empty and csv_path exists the csv file is migrated once.
+    """
+
+    def __init__(self, path, table, cls, key, indexes=[], csv_path=None):
+        self.path = path
+        self.table = table
+        self.cls = cls
+        self.key = key
+        self.columns = list(cls.columns)
+        self.indexes = indexes
+        self.csv_path = csv_path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._create_table()
+        return self._conn
+
+    def _create_table(self):
+        columns = ", ".join(
+            f'"{col}" PRIMARY KEY' if col == self.key else f'"{col}"'
+            for col in self.columns
+        )
+        with self._conn:
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.table}" ({columns})')
+            for col in self.indexes:
+                self._conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{self.table}_{col}" '
+                    f'ON "{self.table}" ("{col}")'
+                )
+
+    @staticmethod
+    def _dump(v):
+        if isinstance(v, (list, dict)):
+            return json.dumps(v)
+        if isinstance(v, bool):
+            return int(v)
+        return v
+
+    def _row(self, obj):
+        return tuple(self._dump(obj.get(col, None)) for col in self.columns)
+
+    def _insert(self, objs):
+        columns = ", ".join(f'"{col}"' for col in self.columns)
+        placeholders = ", ".join("?" for col in self.columns)
+        self.conn.executemany(
+            f'INSERT OR REPLACE INTO "{self.table}" ({columns}) VALUES ({placeholders})',
+            [self._row(obj) for obj in objs],
+        )
+
+    @property
+    def exists(self):
+        if not os.path.isfile(self.path):
+            return False
+        with self.lock:
+            res = self.conn.execute(f'SELECT 1 FROM "{self.table}" LIMIT 1')
+            return res.fetchone() is not None
+
+    def load(self, *args):
+        if not self.exists and self.csv_path and os.path.isfile(self.csv_path):
+            return self.migrate(*args)
+        with self.lock:
+            cur = self.conn.execute(f'SELECT * FROM "{self.table}"')
+            names = [d[0] for d in cur.description]
+            return [self.cls(*args, **dict(zip(names, row))) for row in cur]
+
+    def migrate(self, *args):
+        """One-time migration from the legacy csv file"""
+        objs = read_csv(self.csv_path, self.cls, *args)
+        with self.lock:
+            with self.conn:
+                self._insert(objs)
+        logger.info(f"Migrated {len(objs)} rows from {self.csv_path} to {self.path}")
+        delete_file(self.csv_path)
+        return objs
+
+    def save(self, objs, changed=None):
+        """Upserts changed objects, rewrites the whole table if changed is None"""
+        if changed is not None and len(changed) == 0:
+            return
+        with self.lock:
+            with self.conn:
+                if changed is None:
+                    self.conn.execute(f'DELETE FROM "{self.table}"')
+                    self._insert(objs)
+                else:
+                    self._insert(changed)
+        storage_callback([self.path])
+
+    def clear(self):
+        with self.lock:
+            with self.conn:
+                self.conn.execute(f'DELETE FROM "{self.table}"')
+        storage_callback([self.path])
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def delete(self):
+        self.close()
+        delete_file(self.path)
+
+
+class RawTxStore:
+    """
+    Append-only pack of raw transactions.
+    <rawdir>.pack contains records of (txid, length, raw tx),
+    <rawdir>.idx contains (txid, offset, length) entries so we don't need
+    to scan the pack on startup. If the index lags behind the pack
+    (crash between the two writes) the missing entries are recovered from the pack.
+    Reads can use mmap if SPECTER_RAWTX_MMAP=True.
+    Legacy <rawdir>/<txid>.bin files are migrated on first access.
+    """
+
+    RECORD = struct.Struct("<32sI")
+    INDEX = struct.Struct("<32sQI")
+
+    def __init__(self, rawdir, use_mmap=None):
+        self.rawdir = rawdir
+        self.path = rawdir + ".pack"
+        self.index_path = rawdir + ".idx"
+        if use_mmap is None:
+            use_mmap = parse_bool(os.getenv("SPECTER_RAWTX_MMAP", "False"))
+        self.use_mmap = use_mmap
+        self.lock = threading.RLock()
+        self._index = None
+        self._pack = None
+        self._idx = None
+        self._mmap = None
+
+    @property
+    def index(self):
+        with self.lock:
+            if self._index is None:
+                self._load()
+            return self._index
+
+    def _load(self):
+        self._index = {}
+        data = b""
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+        end = 0
+        for pos in range(0, len(data) - self.INDEX.size + 1, self.INDEX.size):
+            txid, offset, length = self.INDEX.unpack_from(data, pos)
+            self._index[txid.hex()] = (offset, length)
+            end = max(end, offset + length)
+        size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        if end > size or len(data) % self.INDEX.size:
+            # index is broken - rebuild it from the pack
+            logger.warning(f"Rebuilding broken index {self.index_path}")
+            self._index, end = {}, 0
+            delete_file(self.index_path)
+        if end < size:
+            self._recover(end, size)
+        if os.path.isdir(self.rawdir):
+            self._migrate()
+
+    def _recover(self, start, size):
+        """Adds records from the tail of the pack that are not in the index"""
+        entries = []
+        with open(self.path, "rb") as f:
+            pos = start
+            f.seek(pos)
+            while pos + self.RECORD.size <= size:
+                txid, length = self.RECORD.unpack(f.read(self.RECORD.size))
+                offset = pos + self.RECORD.size
+                if offset + length > size:
+                    break
+                entries.append((txid, offset, length))
+                pos = offset + length
+                f.seek(pos)
+        if pos < size:
+            logger.warning(f"Dropping incomplete record at the end of {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(pos)
+        with open(self.index_path, "ab") as f:
+            for entry in entries:
+                f.write(self.INDEX.pack(*entry))
+        for txid, offset, length in entries:
+            self._index[txid.hex()] = (offset, length)
+        logger.info(f"Recovered {len(entries)} index entries of {self.path}")
+
+    def _migrate(self):
+        """One-time migration from the legacy folder with one file per transaction"""
+        items = []
+        for fname in os.listdir(self.rawdir):
+            if not fname.endswith(".bin"):
+                continue
+            with open(os.path.join(self.rawdir, fname), "rb") as f:
+                items.append((fname[:-4], f.read()))
+        self.put_many(items)
+        logger.info(f"Migrated {len(items)} raw transactions from {self.rawdir}")
+        delete_folder(self.rawdir)
+
+    def __contains__(self, txid):
+        return txid in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, txid):
+        """Returns raw transaction bytes or None if we don't have it"""
+        entry = self.index.get(txid)
+        if entry is None:
+            return None
+        offset, length = entry
+        with self.lock:
+            if not self.use_mmap:
+                with open(self.path, "rb") as f:
+                    f.seek(offset)
+                    return f.read(length)
+            # remap if the pack has grown
+            if self._mmap is None or offset + length > len(self._mmap):
+                self._close_mmap()
+                with open(self.path, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._mmap[offset : offset + length]
+
+    def put(self, txid, raw):
+        self.put_many([(txid, raw)])
+
+    def put_many(self, items):
+        """Appends (txid, raw) items that are not in the store yet"""
+        with self.lock:
+            index = self.index
+            if self._pack is None:
+                self._pack = open(self.path, "ab")
+                self._idx = open(self.index_path, "ab")
+            entries = []
+            for txid, raw in items:
+                if txid in index:
+                    continue
+                offset = self._pack.tell() + self.RECORD.size
+                self._pack.write(self.RECORD.pack(bytes.fromhex(txid), len(raw)))
+                self._pack.write(raw)
+                index[txid] = (offset, len(raw))
+                entries.append(self.INDEX.pack(bytes.fromhex(txid), offset, len(raw)))
+            if not entries:
+                return
+            # pack first, so index never points to missing data
+            self._pack.flush()
+            self._idx.write(b"".join(entries))
+            self._idx.flush()
+
+    def compact(self, keep=None):
+        """
+        Rewrites the pack with transactions in keep (all if None).
+        Returns the number of bytes freed.
+        """
+        with self.lock:
+            index = self.index
+            txids = [txid for txid in index if keep is None or txid in keep]
+            size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+            new_index = {}
+            with open(self.path + ".tmp", "wb") as pack, open(
+                self.index_path + ".tmp", "wb"
+            ) as idx:
+                for txid in txids:
+                    raw = self.get(txid)
+                    offset = pack.tell() + self.RECORD.size
+                    pack.write(self.RECORD.pack(bytes.fromhex(txid), len(raw)))
+                    pack.write(raw)
+                    idx.write(self.INDEX.pack(bytes.fromhex(txid), offset, len(raw)))
+                    new_index[txid] = (offset, len(raw))
+                for f in (pack, idx):
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.close()
+            os.replace(self.path + ".tmp", self.path)
+            os.replace(self.index_path + ".tmp", self.index_path)
+            self._index = new_index
+            freed = size - os.path.getsize(self.path)
+        logger.info(
+            f"Compacted {self.path}: {len(txids)} transactions, {freed} bytes freed"
+        )
+        storage_callback([self.path, self.index_path])
+        return freed
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def close(self):
+        with self.lock:
+            self._close_mmap()
+            for f in (self._pack, self._idx):
+                if f is not None:
+                    f.close()
+            self._pack = self._idx = None
+
+    def delete(self):
+        with self.lock:
+            self.close()
+            self._index = None
+            delete_files([self.path, self.index_path])
+            if os.path.isdir(self.rawdir):
+                delete_folder(self.rawdir)
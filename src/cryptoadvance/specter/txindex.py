@@ -0,0 +1,316 @@
+"""
+Search, sort and pagination index over the transactions of a wallet
+"""
+import heapq
+import logging
+import threading
+from datetime import datetime
+
+from .util.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SORT_FIELDS = [
+    "time",
+    "txid",
+    "category",
+    "amount",
+    "label",
+    "blockhash",
+    "confirmations",
+]
+
+
+def _sortable(val, reverse=False):
+    """Sort key of a value - same rules as the transactions table in the UI"""
+    if isinstance(val, list) and val:
+        if isinstance(val[0], str):
+            # first value in the requested order
+            val = sorted(val, key=lambda s: s.lower(), reverse=reverse)[0]
+        else:
+            val = sum(val)
+    if isinstance(val, str):
+        val = val.lower()
+    if isinstance(val, list) or val is None:
+        return (0, "")
+    return (1, val)
+
+
+class TxIndex:
+    """
+    Keeps display-ready rows of the visible transactions of a TxList
+    with labels and precomputed sort keys,
+    and an inverted index of search tokens (txid, addresses, labels, amounts and time).
+    A page of the transactions list is found without processing all transactions.
+    Rows are updated incrementally when transactions or labels change,
+    only confirmations depend on the current height and are added by the caller.
+    """
+
+    def __init__(self, txlist):
+        self.txlist = txlist
+        self.lock = threading.RLock()
+        # txid -> {"tx": display row, "values": {field: value}, "tokens": set}
+        # only for visible txs
+        self._rows = None
+        # search token -> set of txids
+        self._postings = {}
+        # address -> set of txids, to update labels
+        self._by_address = {}
+        # txid -> set of txids that have it in conflicts
+        self._conflicted_by = {}
+        # (sortby, sortdir) -> list of txids
+        self._orders = {}
+        self._searches = LRUCache(100)
+        txlist._addresses.observers.append(self.relabel)
+
+    def _label(self, address):
+        addresses = self.txlist._addresses
+        if address in addresses:
+            return addresses[address].label
+        return address
+
+    def _conflict_time(self, txid):
+        if txid in self.txlist:
+            return self.txlist[txid]["time"]
+        try:
+            tx = self.txlist.rpc.gettransaction(txid)
+            return tx.get("time", tx.get("timereceived"))
+        except Exception as e:
+            logger.warning(f"Can't get conflicting transaction {txid}: {e}")
+            return None
+
+    def _is_visible(self, tx):
+        """Only our transactions that are not replaced by a newer conflicting one"""
+        if not tx["ismine"]:
+            return False
+        if not tx["conflicts"]:
+            return True
+        times = [self._conflict_time(txid) for txid in tx["conflicts"]]
+        return max([t for t in times if t is not None] + [0]) < tx["time"]
+
+    def _remove_row(self, txid):
+        row = self._rows.pop(txid, None)
+        if row is None:
+            return
+        for token in row["tokens"]:
+            txids = self._postings.get(token)
+            if txids is not None:
+                txids.discard(txid)
+                if not txids:
+                    del self._postings[token]
+        for address in row["addresses"]:
+            self._by_address.get(address, set()).discard(txid)
+
+    def _update_row(self, txid):
+        self._remove_row(txid)
+        tx = self.txlist.get(txid)
+        if tx is None:
+            return
+        for conflict in tx["conflicts"] or []:
+            self._conflicted_by.setdefault(conflict, set()).add(txid)
+        if not self._is_visible(tx):
+            return
+        addresses = tx["address"]
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        addresses = addresses or []
+        amounts = tx["amount"]
+        if not isinstance(amounts, list):
+            amounts = [amounts]
+        labels = [self._label(address) for address in addresses]
+        label = labels[0] if isinstance(tx["address"], str) else labels
+        if tx["address"] is None:
+            label = None
+        tokens = {txid, str(tx["time"])}
+        tokens.update(addresses)
+        tokens.update(str(amount) for amount in amounts)
+        tokens.update(labels)
+        if tx["time"] is not None:
+            tokens.add(format(datetime.fromtimestamp(tx["time"]), "%d.%m.%Y %H:%M"))
+        for token in tokens:
+            self._postings.setdefault(token, set()).add(txid)
+        for address in addresses:
+            self._by_address.setdefault(address, set()).add(txid)
+        display = tx.__dict__().copy()
+        display["label"] = label
+        self._rows[txid] = {
+            "tx": display,
+            "values": {
+                "time": tx["time"],
+                "txid": txid,
+                "category": tx["category"],
+                "amount": tx["amount"],
+                "label": label,
+                "blockhash": tx["blockhash"],
+                "blockheight": tx["blockheight"],
+            },
+            "tokens": tokens,
+            "addresses": addresses,
+        }
+
+    def _build(self):
+        self._rows = {}
+        self._postings = {}
+        self._by_address = {}
+        self._conflicted_by = {}
+        for txid in list(self.txlist.keys()):
+            self._update_row(txid)
+
+    def _invalidate(self):
+        self._orders = {}
+        self._searches.clear()
+
+    @property
+    def rows(self):
+        with self.lock:
+            if self._rows is None:
+                self._build()
+            return self._rows
+
+    def update(self, txids):
+        """Updates rows of changed transactions"""
+        with self.lock:
+            if self._rows is None:
+                return
+            txids = set(txids)
+            for txid in list(txids):
+                txids.update(self._conflicted_by.get(txid, set()))
+            for txid in txids:
+                self._update_row(txid)
+            self._invalidate()
+
+    def relabel(self, addresses=None):
+        """Updates labels of transactions with these addresses, all if None"""
+        with self.lock:
+            if self._rows is None:
+                return
+            if addresses is None:
+                self._rows = None
+                self._invalidate()
+                return
+            txids = set()
+            for address in addresses:
+                txids.update(self._by_address.get(address, set()))
+            for txid in txids:
+                self._update_row(txid)
+            if txids:
+                self._invalidate()
+
+    def clear(self):
+        with self.lock:
+            self._rows = None
+            self._invalidate()
+
+    def display_row(self, txid):
+        """Transaction with labels for the UI - don't modify it, make a copy"""
+        return self.rows[txid]["tx"]
+
+    def sort_key(self, txid, sortby=None, sortdir="asc"):
+        values = self.rows[txid]["values"]
+        if sortby == "confirmations":
+            # more confirmations - lower blockheight, unconfirmed first
+            height = values["blockheight"]
+            return (1, -height) if height else (0, 0)
+        if sortby not in SORT_FIELDS:
+            sortby = "time"
+        return _sortable(values[sortby], reverse=sortdir != "asc")
+
+    def _order(self, sortby, sortdir):
+        """txids sorted by sortby, ties keep the default order (newest first)"""
+        if sortby not in SORT_FIELDS:
+            sortby, sortdir = None, "asc"
+        key = (sortby, sortdir)
+        with self.lock:
+            if key not in self._orders:
+                rows = self.rows
+                order = sorted(
+                    rows, key=lambda txid: self.sort_key(txid, "time"), reverse=True
+                )
+                if sortby:
+                    order = sorted(
+                        order,
+                        key=lambda txid: self.sort_key(txid, sortby, sortdir),
+                        reverse=sortdir != "asc",
+                    )
+                self._orders[key] = order
+            return self._orders[key]
+
+    def _search(self, search, current_blockheight=None):
+        """Returns a set of txids with search in any of the tokens"""
+        with self.lock:
+            rows = self.rows
+            res = self._searches.get(search)
+            if res is None:
+                res = set()
+                # we scan unique tokens, not the transactions
+                for token, txids in self._postings.items():
+                    if search in token:
+                        res.update(txids)
+                self._searches[search] = res
+        # confirmations change with every block, so they are not indexed
+        if current_blockheight and search.isdigit():
+            res = res.union(
+                txid
+                for txid, row in rows.items()
+                if search
+                in str(
+                    current_blockheight - row["values"]["blockheight"] + 1
+                    if row["values"]["blockheight"]
+                    else 0
+                )
+            )
+        return res
+
+    def query(
+        self,
+        search=None,
+        sortby=None,
+        sortdir="asc",
+        idx=0,
+        limit=0,
+        current_blockheight=None,
+    ):
+        """
+        Returns a page of txids and the total number of matching transactions.
+        Without sortby transactions are sorted by time, newest first.
+        """
+        txids = self._order(sortby, sortdir)
+        if search:
+            found = self._search(search, current_blockheight)
+            txids = [txid for txid in txids if txid in found]
+        total = len(txids)
+        if limit:
+            txids = txids[limit * idx : limit * (idx + 1)]
+        return txids, total
+
+
+def merge_queries(indexes, sortby=None, sortdir="asc", idx=0, limit=0, **kwargs):
+    """
+    Queries multiple indexes (i.e. all wallets) and merges the results.
+    Returns a page of (index, txid) tuples and the total count.
+    """
+    results = []
+    total = 0
+    for index in indexes:
+        # we need at most all items up to the end of the requested page
+        txids, count = index.query(
+            sortby=sortby,
+            sortdir=sortdir,
+            idx=0,
+            limit=limit * (idx + 1),
+            **kwargs,
+        )
+        total += count
+        results.append([(index, txid) for txid in txids])
+    if sortby not in SORT_FIELDS:
+        sortby, sortdir = "time", "desc"
+    merged = list(
+        heapq.merge(
+            *results,
+            key=lambda item: item[0].sort_key(item[1], sortby, sortdir),
+            reverse=sortdir != "asc",
+        )
+    )
+    if limit:
+        merged = merged[limit * idx : limit * (idx + 1)]
+    return merged, total
@@ -2,16 +2,20 @@
 Manages the list of transactions for the wallet
 """
 import os
-from .persistence import write_csv, read_csv
 from .helpers import get_address_from_dict
+from .storage import RawTxStore, get_store, parse_bool
+from .txindex import TxIndex
 from embit.transaction import Transaction
-from embit.liquid.networks import get_network
 import json
 import logging
-from .util.tx import decoderawtransaction
+from .util.lru import LRUCache
+from .util.tx import RawTransaction, script_to_address
 
 logger = logging.getLogger(__name__)
 
+# max number of parsed / decoded transactions kept in memory per wallet
+TX_CACHE_SIZE = int(os.getenv("SPECTER_TX_CACHE_SIZE", "1000"))
+
 
 def parse_arr(v):
     if not isinstance(v, str):
@@ -48,13 +52,13 @@ class TxItem(dict):
         str,
         parse_arr,
         parse_arr,
-        bool,
+        parse_bool,
     ]
 
-    def __init__(self, rpc, addresses, rawdir, **kwargs):
+    def __init__(self, rpc, addresses, rawstore, **kwargs):
         self.rpc = rpc
         self._addresses = addresses
-        self.rawdir = rawdir
+        self.rawstore = rawstore
         # copy
         kwargs = dict(**kwargs)
         # replace with None or convert
@@ -68,20 +72,16 @@ class TxItem(dict):
         if kwargs.get("hex"):
             self._tx = self.TransactionCls.from_string(kwargs["hex"])
 
-    @property
-    def fname(self):
-        return os.path.join(self.rawdir, self.txid + ".bin")
-
     @property
     def tx(self):
         if not self._tx:
-            # Get transaction from file if we don't have it cached.
+            # Get transaction from the raw store if we don't have it cached.
             # We cache transactions to self._tx
             # only when new tx is added before dump() is called
             try:
-                if os.path.isfile(self.fname):
-                    with open(self.fname, "rb") as f:
-                        return self.TransactionCls.read_from(f)
+                raw = self.rawstore.get(self.txid)
+                if raw is not None:
+                    return self.TransactionCls.parse(raw)
             except Exception as e:
                 logger.error(e)
         # if we failed to load tx from file - load it from RPC
@@ -95,16 +95,12 @@ class TxItem(dict):
         return self._tx
 
     def dump(self):
-        """Dumps transaction in binary to the folder if it's not there"""
-        # nothing to do if file exists or we don't have binary tx
-        if os.path.isfile(self.fname) or not self.tx:
+        """Dumps transaction in binary to the raw store if it's not there"""
+        # nothing to do if it's stored already or we don't have binary tx
+        if self.txid in self.rawstore or not self.tx:
             return
-        # create dir if it doesn't exist
-        if not os.path.isdir(self.rawdir):
-            os.mkdir(self.rawdir)
-        with open(self.fname, "wb") as f:
-            self._tx.write_to(f)
-        # clear cached tx as we saved the transaction to file
+        self.rawstore.put(self.txid, self._tx.serialize())
+        # clear cached tx as we saved the transaction to the store
         self._tx = None
 
     @property
@@ -137,39 +133,145 @@ class TxItem(dict):
         }
 
 
+class ValidatedProof(dict):
+    """Blockhash the merkle proof of a transaction was validated against"""
+
+    columns = ["txid", "blockhash"]
+
+
 class TxList(dict):
     ItemCls = TxItem  # for inheritance
 
-    def __init__(self, path, rpc, addresses, chain):
+    def __init__(self, path, rpc, addresses, chain, store=None):
         self.chain = chain
         self.path = path
-        # folder to store transactions in binary form
+        # transactions in binary form, used to be a folder with one file per tx
         self.rawdir = path.replace(".csv", "_raw")
+        self.rawstore = RawTxStore(self.rawdir)
         self.rpc = rpc
         self._addresses = addresses
-        txs = []
-        file_exists = False
+        # parsed transactions and decoderawtransaction results by txid,
+        # so we don't re-read and re-parse raw files for every lookup
+        self._tx_cache = LRUCache(TX_CACHE_SIZE)
+        self._decoded_cache = LRUCache(TX_CACHE_SIZE)
+        if store is None:
+            store = get_store(
+                path,
+                self.ItemCls,
+                "txs",
+                "txid",
+                indexes=["address", "blockheight", "time"],
+            )
+        self.store = store
         try:
-            if os.path.isfile(self.path):
-                txs = read_csv(
-                    self.path, self.ItemCls, self.rpc, self._addresses, self.rawdir
-                )
-                for tx in txs:
-                    self[tx.txid] = tx
-                file_exists = True
+            txs = self.store.load(self.rpc, self._addresses, self.rawstore)
+            for tx in txs:
+                self[tx.txid] = tx
         except Exception as e:
             logger.error(e)
-        self._file_exists = file_exists
+        # search / sort index for the transactions list
+        self.index = TxIndex(self)
+        # merkle proofs validated before, loaded on first use
+        self.proofs_store = get_store(
+            path.rsplit("_", 1)[0] + "_proofs.csv",
+            ValidatedProof,
+            "merkle_proofs",
+            "txid",
+        )
+        self._validated = None
 
-    def save(self):
+    def save(self, changed=None):
+        """Saves transactions with txids in changed list or all if changed is None"""
         # check if we have at least one transaction
         if self:
-            # Dump all transactions to binary files
+            txs = self.values() if changed is None else [self[txid] for txid in changed]
+            # Dump transactions to binary files
             # This happens only if they have not been dumped before
-            for tx in self.values():
+            for tx in txs:
+                # keep the parsed tx in memory as dump() drops it
+                if tx._tx is not None:
+                    self._tx_cache[tx.txid] = tx._tx
                 tx.dump()
-            write_csv(self.path, list(self.values()), self.ItemCls)
-        self._file_exists = True
+            self.store.save(self.values(), changed=None if changed is None else txs)
+
+    def clear(self):
+        """Removes all transactions from the cache and the storage"""
+        super().clear()
+        self.index.clear()
+        self._tx_cache.clear()
+        self._decoded_cache.clear()
+        self.store.clear()
+
+    @property
+    def validated_proofs(self):
+        """dict txid: blockhash of transactions with a valid merkle proof"""
+        if self._validated is None:
+            try:
+                self._validated = {
+                    proof["txid"]: proof["blockhash"]
+                    for proof in self.proofs_store.load()
+                }
+            except Exception as e:
+                logger.error(e)
+                self._validated = {}
+        return self._validated
+
+    def set_validated(self, txs):
+        """Remembers (txid, blockhash) of txs with a valid merkle proof"""
+        if not txs:
+            return
+        proofs = [
+            ValidatedProof(txid=tx["txid"], blockhash=tx["blockhash"]) for tx in txs
+        ]
+        for proof in proofs:
+            self.validated_proofs[proof["txid"]] = proof["blockhash"]
+        self.proofs_store.save(
+            [
+                ValidatedProof(txid=txid, blockhash=blockhash)
+                for txid, blockhash in self.validated_proofs.items()
+            ],
+            changed=proofs,
+        )
+
+    def compact(self):
+        """Removes raw transactions we don't have in the list anymore from the raw store"""
+        return self.rawstore.compact(keep=self)
+
+    def get_tx(self, txid):
+        """Returns parsed transaction from the cache or loads it"""
+        tx = self._tx_cache.get(txid)
+        if tx is None:
+            tx = self[txid].tx
+            if tx is not None:
+                self._tx_cache[txid] = tx
+        return tx
+
+    def decodetx(self, txid):
+        """
+        Returns cached decoderawtransaction result for a transaction in the list.
+        The result is shared between callers - don't modify it.
+        """
+        res = self._decoded_cache.get(txid)
+        if res is None:
+            res = self.decoderawtransaction(self.get_raw(txid).hex())
+            self._decoded_cache[txid] = res
+        return res
+
+    def get_raw(self, txid):
+        """Returns raw transaction bytes without parsing them if they are stored"""
+        raw = None
+        if txid not in self._tx_cache:
+            raw = self.rawstore.get(txid)
+        if raw is None:
+            raw = self.get_tx(txid).serialize()
+        return raw
+
+    @property
+    def cache_stats(self):
+        return {
+            "transactions": self._tx_cache.stats(),
+            "decoded": self._decoded_cache.stats(),
+        }
 
     def gettransaction(self, txid, blockheight=None, decode=False, full=True):
         """
@@ -192,13 +294,13 @@ class TxList(dict):
         tx = self[txid]
         res = dict(**tx)
         if full:
-            res["hex"] = tx.hex
+            res["hex"] = str(self.get_tx(txid))
         if decode:
-            res.update(self.decoderawtransaction(tx.hex))
+            res.update(self.decodetx(txid))
         return res
 
     def decoderawtransaction(self, txhex):
-        return decoderawtransaction(txhex, self.chain)
+        return RawTransaction.from_string(txhex, self.chain)
 
     def add(self, txs):
         """
@@ -237,20 +339,21 @@ class TxList(dict):
                 "bip125-replaceable": tx.get("bip125-replaceable", "no"),
                 "hex": tx.get("hex", None),
             }
-            txitem = self.ItemCls(self.rpc, self._addresses, self.rawdir, **obj)
+            txitem = self.ItemCls(self.rpc, self._addresses, self.rawstore, **obj)
             self[txid] = txitem
-            if txitem.tx:
-                for vout in txitem.tx.vout:
-                    try:
-                        addr = vout.script_pubkey.address(get_network(self.chain))
-                        if addr not in addresses:
-                            addresses.append(addr)
-                    except:
-                        pass  # maybe not an address, but a raw script?
+            self._tx_cache.pop(txid)
+            self._decoded_cache.pop(txid)
+            parsed = self.get_tx(txid)
+            if parsed:
+                for vout in parsed.vout:
+                    addr = script_to_address(vout.script_pubkey.data, self.chain)
+                    # maybe not an address, but a raw script?
+                    if addr is not None and addr not in addresses:
+                        addresses.append(addr)
         self._addresses.set_used(addresses)
         # detect category, amounts and addresses
         for tx in [self[tx] for tx in self if tx in txs]:
-            raw_tx = self.decoderawtransaction(tx.hex)
+            raw_tx = self.decodetx(tx.txid)
             tx["vsize"] = raw_tx["vsize"]
 
             category = ""
@@ -268,9 +371,7 @@ class TxList(dict):
                 if vin["txid"] in self:
                     try:
                         address = get_address_from_dict(
-                            self.decoderawtransaction(self[vin["txid"]].hex)["vout"][
-                                vin["vout"]
-                            ]
+                            self.decodetx(vin["txid"])["vout"][vin["vout"]]
                         )
                         address_info = self._addresses.get(address, None)
                         if address_info and not address_info.is_external:
@@ -337,7 +438,8 @@ class TxList(dict):
                 tx["ismine"] = False
             else:
                 tx["ismine"] = True
-        self.save()
+        self.save(changed=list(txs.keys()))
+        self.index.update(txs.keys())
 
     def load(self, arr):
         """
@@ -366,4 +468,4 @@ class TxList(dict):
 
     @property
     def file_exists(self):
-        return self._file_exists and os.path.isfile(self.path)
+        return self.store.exists
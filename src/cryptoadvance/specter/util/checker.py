@@ -12,13 +12,15 @@ class Checker:
     set checker.last_check to 0.
     """
 
-    def __init__(self, callback, period=600, desc="unknown"):
+    def __init__(self, callback, period=600, desc="unknown", initial_delay=False):
         """Checker Contructor
         :param callback: a function to be called periodically
         :param period: defines the waiting time in seconds. If you specify values below 1, it won't sleep anymore
         :param desc: specifies an optional description used in logging
+        :param initial_delay: first call after one period instead of right after start
         """
         self.desc = desc
+        self.initial_delay = initial_delay
         self.callback = callback
         self.last_check = 0
         self.period = period
@@ -39,7 +41,10 @@ class Checker:
         self.running = False
 
     def loop(self):
-        self._execute(first_execution=True)
+        if self.initial_delay:
+            self.last_check = time.time()
+        else:
+            self._execute(first_execution=True)
         while self.running:
             # check if it's time to update
             if time.time() - self.last_check >= self.period:
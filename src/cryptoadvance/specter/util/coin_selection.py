@@ -0,0 +1,286 @@
+""" Local coin selection over the cached UTXO set """
+import logging
+import os
+import random
+from math import ceil
+
+logger = logging.getLogger(__name__)
+
+# "core" leaves coin selection to Bitcoin Core,
+# "auto" runs all local algorithms and takes the one with the lowest waste
+COIN_SELECTION = os.getenv("SPECTER_COIN_SELECTION", "core")
+# same limit as Bitcoin Core
+BNB_MAX_TRIES = 100000
+KNAPSACK_ITERATIONS = 1000
+# fee rate (sat/vB) the change is expected to be spent at
+LONG_TERM_FEE_RATE = float(os.getenv("SPECTER_LONG_TERM_FEE_RATE", "10"))
+# version, locktime, in / out counts, segwit marker and flag
+TX_OVERHEAD_VSIZE = 11
+# outpoint, sequence and scriptSig length of an input
+INPUT_BASE_VSIZE = 41
+# smallest change the knapsack solver tries to leave, in sats
+MIN_CHANGE = 1000
+
+
+class Coin:
+    """Unspent output with value in sats and vsize of the signed input"""
+
+    def __init__(self, txid, vout, value, vsize):
+        self.txid = txid
+        self.vout = vout
+        self.value = value
+        self.vsize = vsize
+
+    @classmethod
+    def from_utxo(cls, utxo, vsize):
+        """Coin from a listunspent entry (amount in BTC)"""
+        return cls(utxo["txid"], utxo["vout"], round(utxo["amount"] * 1e8), vsize)
+
+    def fee(self, fee_rate):
+        return ceil(fee_rate * self.vsize)
+
+    def effective_value(self, fee_rate):
+        """Value of the coin after paying for its own input"""
+        return self.value - self.fee(fee_rate)
+
+    def __repr__(self):
+        return f"<Coin {self.txid}:{self.vout} {self.value}>"
+
+
+class Selection:
+    """Coins selected by an algorithm and the waste of the selection"""
+
+    def __init__(self, coins, algorithm, target, fee_rate, cost_of_change):
+        self.coins = coins
+        self.algorithm = algorithm
+        self.value = sum(coin.value for coin in coins)
+        self.fee = sum(coin.fee(fee_rate) for coin in coins)
+        excess = self.value - self.fee - target
+        # the excess goes to the miner if a change output costs more than it
+        self.change = excess > cost_of_change
+        self.waste = waste(coins, target, fee_rate, cost_of_change)
+
+    @property
+    def inputs(self):
+        """Inputs for walletcreatefundedpsbt"""
+        return [{"txid": coin.txid, "vout": coin.vout} for coin in self.coins]
+
+    def __repr__(self):
+        return (
+            f"<Selection {self.algorithm} inputs={len(self.coins)} waste={self.waste}>"
+        )
+
+
+def waste(coins, target, fee_rate, cost_of_change, long_term_fee_rate=None):
+    """
+    Waste metric of Bitcoin Core: the extra fee of spending the inputs now
+    instead of at the long term fee rate, plus the cost of the change output
+    or the excess given to the miner if there is no change.
+    """
+    if long_term_fee_rate is None:
+        long_term_fee_rate = LONG_TERM_FEE_RATE
+    result = sum(coin.fee(fee_rate) - coin.fee(long_term_fee_rate) for coin in coins)
+    excess = sum(coin.effective_value(fee_rate) for coin in coins) - target
+    if excess > cost_of_change:
+        result += cost_of_change
+    else:
+        result += excess
+    return result
+
+
+def select_bnb(coins, target, fee_rate, cost_of_change, max_tries=BNB_MAX_TRIES):
+    """
+    Branch and bound: searches for a set of coins with effective value between
+    target and target + cost_of_change, so no change output is needed.
+    Returns the selection with the lowest waste or None.
+    """
+    coins = sorted(
+        [coin for coin in coins if coin.effective_value(fee_rate) > 0],
+        key=lambda coin: coin.effective_value(fee_rate),
+        reverse=True,
+    )
+    values = [coin.effective_value(fee_rate) for coin in coins]
+    wastes = [coin.fee(fee_rate) - coin.fee(LONG_TERM_FEE_RATE) for coin in coins]
+    remaining = sum(values)
+    if remaining < target:
+        return None
+    # inclusion flags of coins up to the current depth
+    selection = []
+    value = 0
+    current_waste = 0
+    best = None
+    best_waste = None
+    for _ in range(max_tries):
+        backtrack = False
+        if (
+            value + remaining < target
+            or value > target + cost_of_change
+            or (
+                best_waste is not None
+                and fee_rate > LONG_TERM_FEE_RATE
+                and current_waste > best_waste
+            )
+        ):
+            backtrack = True
+        elif value >= target:
+            excess_waste = current_waste + value - target
+            if best_waste is None or excess_waste <= best_waste:
+                best = list(selection)
+                best_waste = excess_waste
+            backtrack = True
+        if backtrack:
+            # walk back to the last included coin and try to omit it
+            while selection and not selection[-1]:
+                selection.pop()
+                remaining += values[len(selection)]
+            if not selection:
+                break
+            i = len(selection) - 1
+            selection[-1] = False
+            value -= values[i]
+            current_waste -= wastes[i]
+        else:
+            i = len(selection)
+            remaining -= values[i]
+            # omitting a coin equal to the previously omitted one
+            # leads to the same results as including it
+            if (
+                selection
+                and not selection[-1]
+                and values[i] == values[i - 1]
+                and wastes[i] == wastes[i - 1]
+            ):
+                selection.append(False)
+            else:
+                selection.append(True)
+                value += values[i]
+                current_waste += wastes[i]
+    if best is None:
+        return None
+    return [coin for coin, included in zip(coins, best) if included]
+
+
+def _approximate_best_subset(values, total, target, iterations, rng):
+    best = [True] * len(values)
+    best_value = total
+    for _ in range(iterations):
+        if best_value == target:
+            break
+        included = [False] * len(values)
+        value = 0
+        reached = False
+        for npass in range(2):
+            if reached:
+                break
+            for i, v in enumerate(values):
+                # random subsets first, then fill up with the rest
+                if rng.random() < 0.5 if npass == 0 else not included[i]:
+                    value += v
+                    included[i] = True
+                    if value >= target:
+                        reached = True
+                        if value < best_value:
+                            best_value = value
+                            best = list(included)
+                        value -= v
+                        included[i] = False
+    return best, best_value
+
+
+def select_knapsack(
+    coins,
+    target,
+    fee_rate,
+    min_change=MIN_CHANGE,
+    iterations=KNAPSACK_ITERATIONS,
+    rng=None,
+):
+    """
+    Knapsack solver of Bitcoin Core: random subsets of the smaller coins
+    close to target (+ min_change), or the smallest coin larger than that.
+    """
+    if rng is None:
+        rng = random.Random()
+    lower = []
+    lowest_larger = None
+    for coin in coins:
+        value = coin.effective_value(fee_rate)
+        if value <= 0:
+            continue
+        if value == target:
+            return [coin]
+        if value < target + min_change:
+            lower.append(coin)
+        elif lowest_larger is None or value < lowest_larger.effective_value(fee_rate):
+            lowest_larger = coin
+    total_lower = sum(coin.effective_value(fee_rate) for coin in lower)
+    if total_lower == target:
+        return lower
+    if total_lower < target:
+        return [lowest_larger] if lowest_larger is not None else None
+    lower.sort(key=lambda coin: coin.effective_value(fee_rate), reverse=True)
+    values = [coin.effective_value(fee_rate) for coin in lower]
+    best, best_value = _approximate_best_subset(
+        values, total_lower, target, iterations, rng
+    )
+    if best_value != target and total_lower >= target + min_change:
+        best, best_value = _approximate_best_subset(
+            values, total_lower, target + min_change, iterations, rng
+        )
+    if lowest_larger is not None and (
+        (best_value != target and best_value < target + min_change)
+        or lowest_larger.effective_value(fee_rate) <= best_value
+    ):
+        return [lowest_larger]
+    return [coin for coin, included in zip(lower, best) if included]
+
+
+def select_largest_first(coins, target, fee_rate):
+    """Takes the largest coins until the target is reached"""
+    selected = []
+    value = 0
+    for coin in sorted(
+        coins, key=lambda coin: coin.effective_value(fee_rate), reverse=True
+    ):
+        if coin.effective_value(fee_rate) <= 0:
+            break
+        selected.append(coin)
+        value += coin.effective_value(fee_rate)
+        if value >= target:
+            return selected
+    return None
+
+
+ALGORITHMS = ["bnb", "knapsack", "largest_first"]
+
+
+def _select(algorithm, coins, target, fee_rate, cost_of_change):
+    if algorithm == "bnb":
+        return select_bnb(coins, target, fee_rate, cost_of_change)
+    if algorithm == "knapsack":
+        return select_knapsack(coins, target, fee_rate)
+    return select_largest_first(coins, target, fee_rate)
+
+
+def select_coins(coins, target, fee_rate, cost_of_change, algorithm="auto"):
+    """
+    Selects coins for target sats (outputs and fee of everything but the inputs).
+    With algorithm="auto" all algorithms run and the selection with
+    the lowest waste wins, otherwise only the given one.
+    Returns a Selection or None if the coins don't cover the target.
+    """
+    if algorithm == "auto":
+        names = ALGORITHMS
+    elif algorithm in ALGORITHMS:
+        names = [algorithm]
+    else:
+        raise ValueError(f"Unknown coin selection algorithm {algorithm}")
+    best = None
+    for name in names:
+        coins_selected = _select(name, coins, target, fee_rate, cost_of_change)
+        if not coins_selected:
+            continue
+        selection = Selection(coins_selected, name, target, fee_rate, cost_of_change)
+        if best is None or selection.waste < best.waste:
+            best = selection
+    return best
@@ -0,0 +1,77 @@
+""" Fast batched address derivation from wallet descriptors """
+import logging
+import threading
+
+from embit.descriptor.arguments import AllowedDerivation, KeyOrigin
+from embit.liquid.descriptor import LDescriptor
+from embit.liquid.networks import get_network
+
+from .lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+_derivers = LRUCache(100)
+
+
+def get_address_deriver(desc, chain):
+    """Returns a cached AddressDeriver for the descriptor"""
+    deriver = _derivers.get((desc, chain))
+    if deriver is None:
+        deriver = AddressDeriver(desc, chain)
+        _derivers[(desc, chain)] = deriver
+    return deriver
+
+
+def _derive_prefix(key):
+    """
+    Replaces xpub/a/b/* with (xpub/a/b)/* so every address needs
+    only one child derivation instead of the full path from the xpub.
+    """
+    der = key.allowed_derivation
+    if not key.can_derive or der is None:
+        return
+    indexes = der.indexes
+    # only fixed indexes followed by a wildcard, no branches like {0,1}
+    if len(indexes) < 2 or indexes[-1] is not None:
+        return
+    prefix = indexes[:-1]
+    if not all(isinstance(idx, int) for idx in prefix):
+        return
+    if key.origin is not None:
+        key.origin = KeyOrigin(key.origin.fingerprint, key.origin.derivation + prefix)
+    else:
+        key.origin = KeyOrigin(key.key.my_fingerprint, prefix)
+    key.key = key.key.derive(prefix)
+    key.allowed_derivation = AllowedDerivation([None])
+
+
+class AddressDeriver:
+    """
+    Derives addresses of a ranged descriptor.
+    The descriptor is parsed once and the account / chain levels of all keys
+    are derived once, derived addresses are memoized by index.
+    """
+
+    def __init__(self, desc, chain):
+        self.network = get_network(chain)
+        self.descriptor = LDescriptor.from_string(desc)
+        for key in self.descriptor.keys:
+            _derive_prefix(key)
+        blinding_key = getattr(self.descriptor, "blinding_key", None)
+        if blinding_key is not None and not blinding_key.slip77:
+            _derive_prefix(blinding_key.key)
+        self.lock = threading.Lock()
+        self._addresses = {}
+
+    def address(self, index):
+        return self.addresses(index, index + 1)[0]
+
+    def addresses(self, start, end):
+        """Returns addresses with indexes in range(start, end)"""
+        with self.lock:
+            for idx in range(start, end):
+                if idx not in self._addresses:
+                    self._addresses[idx] = self.descriptor.derive(idx).address(
+                        self.network
+                    )
+            return [self._addresses[idx] for idx in range(start, end)]
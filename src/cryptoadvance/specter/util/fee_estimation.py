@@ -1,9 +1,22 @@
 import logging
+import threading
+import time
+
+from .checker import Checker
 
 logger = logging.getLogger(__name__)
 
+# seconds between background refreshes of the fee estimation
+FEES_PERIOD = 60
+# timeout of requests to fee estimation providers
+FEES_TIMEOUT = 10
+
 
 def get_fees(specter, config):
+    """
+    Returns the last fee estimation immediately and refreshes it in the background.
+    "age" is the number of seconds since the estimation was fetched.
+    """
     if specter.is_liquid:
         return {
             "fastestFee": 0.1,
@@ -11,63 +24,153 @@ def get_fees(specter, config):
             "hourFee": 0.1,
             "minimumFee": 0.1,
             "failed": False,
+            "age": 0,
         }
-    if specter.fee_estimator == "mempool":
-        # Try first with Tor hidden service
-        try:
-            requests_session = specter.requests_session(force_tor=True)
-            return requests_session.get(
-                f"{config['EXPLORERS_LIST']['MEMPOOL_SPACE_ONION']['url']}api/v1/fees/recommended"
-            ).json()
-            return
-        except Exception as e:
-            # Try without Tor if failed, or fall back to Bitcoin Core if only Tor is on
-            logger.warning(
-                f"Failed to fetch fee estimation from mempool.space Tor hidden service. Using Bitcoin Core instead. Error: {e}"
-            )  # Falling back to Bitcoin Core
-            if not specter.only_tor:
-                try:
-                    requests_session = specter.requests_session(force_tor=False)
-                    return requests_session.get(
-                        f"{config['EXPLORERS_LIST']['MEMPOOL_SPACE']['url']}api/v1/fees/recommended"
-                    ).json()
-                except Exception as e:
-                    logger.warning(
-                        f"Failed to fetch fee estimation from mempool.space. Using Bitcoin Core instead. Error: {e}"
-                    )  # Falling back to Bitcoin Core
-    elif specter.fee_estimator == "custom":
-        try:
-            if specter.config["fee_estimator_custom_url"].endswith("/"):
-                custom_url = (
-                    specter.config["fee_estimator_custom_url"]
-                    + "api/v1/fees/recommended"
+    return specter.fee_estimation.get(config)
+
+
+class CircuitBreaker:
+    """
+    Skips a failing source instead of waiting for its timeout on every refresh.
+    After max_failures failures in a row the source is skipped for reset_after
+    seconds, then it gets one more try.
+    """
+
+    def __init__(self, max_failures=2, reset_after=300):
+        self.max_failures = max_failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return (
+            self.opened_at is not None
+            and time.time() - self.opened_at < self.reset_after
+        )
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            self.opened_at = time.time()
+
+
+class FeeEstimation:
+    """
+    Fee estimations of a Specter instance refreshed by a Checker thread.
+    Serves the last good estimation (stale-while-revalidate),
+    only the first request for a provider waits for the fetch.
+    Users can select different providers, so estimations are kept per provider.
+    Every external source has its own circuit breaker, Bitcoin Core is the last resort.
+    """
+
+    def __init__(self, specter, period=FEES_PERIOD):
+        self.specter = specter
+        self.config = None
+        self.lock = threading.Lock()
+        self.breakers = {}
+        # provider -> (fees, timestamp)
+        self._cache = {}
+        # get() fetches the first estimation, so the checker waits one period
+        self.checker = Checker(
+            self.refresh, period=period, desc="fees", initial_delay=True
+        )
+
+    @property
+    def provider(self):
+        """Fee estimator of the current user"""
+        return (
+            self.specter.fee_estimator,
+            self.specter.config.get("fee_estimator_custom_url", ""),
+        )
+
+    def get(self, config):
+        self.config = config
+        provider = self.provider
+        if provider not in self._cache:
+            self.refresh(provider)
+            self.checker.start()
+        fees, updated = self._cache[provider]
+        fees = dict(fees)
+        fees["age"] = int(time.time() - updated)
+        return fees
+
+    def refresh(self, provider=None):
+        """Refreshes estimations of the provider or all providers in use"""
+        providers = [provider] if provider else list(self._cache)
+        for provider in providers:
+            with self.lock:
+                cached = self._cache.get(provider)
+                fees = self._fetch(provider)
+                # keep the last good estimation if everything failed
+                if cached is None or not fees.get("failed"):
+                    self._cache[provider] = (fees, time.time())
+
+    def stop(self):
+        self.checker.stop()
+
+    def _sources(self, provider):
+        """List of (name, url, force_tor) to try in this order"""
+        fee_estimator, custom_url = provider
+        explorers = self.config["EXPLORERS_LIST"]
+        if fee_estimator == "mempool":
+            sources = [
+                (
+                    "mempool_onion",
+                    f"{explorers['MEMPOOL_SPACE_ONION']['url']}api/v1/fees/recommended",
+                    True,
+                )
+            ]
+            if not self.specter.only_tor:
+                sources.append(
+                    (
+                        "mempool",
+                        f"{explorers['MEMPOOL_SPACE']['url']}api/v1/fees/recommended",
+                        False,
+                    )
                 )
-            else:
-                custom_url = (
-                    specter.config["fee_estimator_custom_url"]
-                    + "/api/v1/fees/recommended"
+            return sources
+        if fee_estimator == "custom":
+            if not custom_url.endswith("/"):
+                custom_url += "/"
+            custom_url += "api/v1/fees/recommended"
+            return [(custom_url, custom_url, ".onion/" in custom_url)]
+        return []
+
+    def _fetch(self, provider):
+        for name, url, force_tor in self._sources(provider):
+            breaker = self.breakers.setdefault(name, CircuitBreaker())
+            if breaker.is_open:
+                continue
+            try:
+                requests_session = self.specter.requests_session(force_tor=force_tor)
+                fees = requests_session.get(url, timeout=FEES_TIMEOUT).json()
+                # make sure we got what we need
+                for key in ["fastestFee", "halfHourFee", "hourFee", "minimumFee"]:
+                    float(fees[key])
+                breaker.success()
+                return fees
+            except Exception as e:
+                breaker.failure()
+                logger.warning(
+                    f"Failed to fetch fee estimation from {name}. Using the next source. Error: {e}"
                 )
-            requests_session = specter.requests_session(
-                force_tor=".onion/" in custom_url
-            )
-            return requests_session.get(custom_url).json()
-        except Exception as e:
-            logger.warning(
-                f"Failed to fetch fee estimation from custom provider. Using Bitcoin Core instead. Error: {e}"
-            )  # Falling back to Bitcoin Core
-
-    return {
-        "fastestFee": int(
-            (float(specter.estimatesmartfee(1).get("feerate", 0.00001)) / 1000) * 1e8
-        ),
-        "halfHourFee": int(
-            (float(specter.estimatesmartfee(3).get("feerate", 0.00001)) / 1000) * 1e8
-        ),
-        "hourFee": int(
-            (float(specter.estimatesmartfee(6).get("feerate", 0.00001)) / 1000) * 1e8
-        ),
-        "minimumFee": int(
-            (float(specter.estimatesmartfee(20).get("feerate", 0.00001)) / 1000) * 1e8
-        ),
-        "failed": "feerate" not in specter.estimatesmartfee(1),
-    }
+        return self._fetch_core()
+
+    def _fetch_core(self):
+        fees = {"failed": False}
+        for key, blocks in [
+            ("fastestFee", 1),
+            ("halfHourFee", 3),
+            ("hourFee", 6),
+            ("minimumFee", 20),
+        ]:
+            res = self.specter.estimatesmartfee(blocks)
+            if blocks == 1:
+                fees["failed"] = "feerate" not in res
+            fees[key] = int((float(res.get("feerate", 0.00001)) / 1000) * 1e8)
+        return fees
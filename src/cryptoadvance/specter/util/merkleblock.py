@@ -1,9 +1,15 @@
 # Code adopted from https://github.com/jimmysong/pb-exercises/
 import hashlib
+import logging
 import math
+import threading
 
 from io import BytesIO
 
+from .lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
 
 def hash256(s):
     return hashlib.sha256(hashlib.sha256(s).digest()).digest()
@@ -26,6 +32,18 @@ def read_varint(s):
         return i
 
 
+def encode_varint(i):
+    """encodes an integer as a varint"""
+    if i < 0xFD:
+        return bytes([i])
+    elif i < 0x10000:
+        return b"\xfd" + int_to_little_endian(i, 2)
+    elif i < 0x100000000:
+        return b"\xfe" + int_to_little_endian(i, 4)
+    else:
+        return b"\xff" + int_to_little_endian(i, 8)
+
+
 def merkle_parent(hash1, hash2):
     """Takes the binary hashes and calculates the hash256"""
     # return the hash256 of hash1 + hash2
@@ -446,3 +464,200 @@ def is_valid_merkle_proof(
         return False
 
     return True
+
+
+# blocks with verified headers and merkle tree nodes kept in memory
+MERKLE_CACHE_SIZE = 1000
+
+
+def _tree_width(total, height):
+    """Number of nodes at height (0 for the leaves) of a tree with total leaves"""
+    return (total + (1 << height) - 1) >> height
+
+
+def _tree_height(total):
+    height = 0
+    while _tree_width(total, height) > 1:
+        height += 1
+    return height
+
+
+def parse_merkle_proof(proof):
+    """Splits a BIP37 proof (bytes) into header, total, hashes and flags"""
+    s = BytesIO(proof)
+    header = s.read(80)
+    total = little_endian_to_int(s.read(4))
+    hashes = [s.read(32) for _ in range(read_varint(s))]
+    flags = s.read(read_varint(s))
+    if len(header) != 80 or any(len(h) != 32 for h in hashes) or s.read(1):
+        raise ValueError("Invalid merkle proof length")
+    return header, total, hashes, flags
+
+
+def extract_merkle_root(total, hashes, flags, verified=None):
+    """
+    Computes the root of a partial merkle tree like TraverseAndExtract of Core.
+    Nodes found in verified {(height, pos): hash} are known to lead to the root,
+    so parents with verified children only are taken from there without hashing.
+    Returns the root, all nodes by (height, pos) and the matched leaves by pos.
+    Hashes are in internal byte order.
+    """
+    if total == 0 or len(hashes) > total:
+        raise ValueError("Invalid number of transactions")
+    if len(flags) * 8 < len(hashes):
+        raise ValueError("Not enough flag bits")
+    if verified is None:
+        verified = {}
+    nodes = {}
+    matches = {}
+    # number of used bits and hashes
+    used = [0, 0]
+
+    def traverse(height, pos):
+        """Returns the hash of the node and whether it's verified"""
+        nbit = used[0]
+        if nbit >= len(flags) * 8:
+            raise ValueError("Flag bits overflow")
+        used[0] += 1
+        flag = (flags[nbit >> 3] >> (nbit & 7)) & 1
+        if height == 0 or not flag:
+            if used[1] >= len(hashes):
+                raise ValueError("Hashes overflow")
+            h = hashes[used[1]]
+            used[1] += 1
+            if height == 0 and flag:
+                matches[pos] = h
+            nodes[(height, pos)] = h
+            return h, verified.get((height, pos)) == h
+        left, left_done = traverse(height - 1, pos * 2)
+        if pos * 2 + 1 < _tree_width(total, height - 1):
+            right, right_done = traverse(height - 1, pos * 2 + 1)
+            # CVE-2012-2459: duplicated transactions
+            if right == left:
+                raise ValueError("Identical merkle tree branches")
+        else:
+            right, right_done = left, left_done
+        if left_done and right_done:
+            return verified[(height, pos)], True
+        h = hash256(left + right)
+        nodes[(height, pos)] = h
+        return h, verified.get((height, pos)) == h
+
+    root, _ = traverse(_tree_height(total), 0)
+    if used[1] != len(hashes) or (used[0] + 7) // 8 != len(flags):
+        raise ValueError("Hashes or flag bits not all consumed")
+    return root, nodes, matches
+
+
+class MerkleProofVerifier:
+    """
+    Verifies many merkle proofs at once.
+    Proofs are grouped by block: a proof shared by several transactions
+    (gettxoutproof with many txids) is checked once, and branches verified
+    by earlier proofs of the same block are not hashed again.
+    Block headers, tree nodes and valid (txid, blockhash) pairs are cached.
+    """
+
+    def __init__(self, maxsize=MERKLE_CACHE_SIZE):
+        # blockhash: (header, verified nodes)
+        self.blocks = LRUCache(maxsize)
+        self.results = LRUCache(maxsize * 10)
+        self.lock = threading.Lock()
+
+    def verify(self, items):
+        """
+        Takes a list of (txid, blockhash, proof_hex),
+        returns a list of bools - True if the proof is valid
+        """
+        results = [False] * len(items)
+        groups = {}
+        for i, (txid, blockhash, proof_hex) in enumerate(items):
+            if self.results.get((txid, blockhash)):
+                results[i] = True
+            elif proof_hex:
+                groups.setdefault((blockhash, proof_hex), []).append((i, txid))
+        with self.lock:
+            for (blockhash, proof_hex), txs in groups.items():
+                try:
+                    proved = self.proved_txids(blockhash, proof_hex)
+                except Exception as e:
+                    logger.debug(f"Invalid merkle proof for block {blockhash}: {e}")
+                    proved = set()
+                for i, txid in txs:
+                    if txid in proved:
+                        results[i] = True
+                        self.results[(txid, blockhash)] = True
+        return results
+
+    def proved_txids(self, blockhash, proof_hex):
+        """Returns txids proven to be in the block, raises if the proof is invalid"""
+        header, total, hashes, flags = parse_merkle_proof(bytes.fromhex(proof_hex))
+        cached = self.blocks.get(blockhash)
+        if cached is None or cached[0] != header:
+            if hash256(header)[::-1].hex() != blockhash:
+                raise ValueError("Block hash doesn't match the header")
+            cached = (header, {})
+            self.blocks[blockhash] = cached
+        verified = cached[1]
+        root, nodes, matches = extract_merkle_root(total, hashes, flags, verified)
+        # merkle root is at bytes 36..68 of the header
+        if root != header[36:68]:
+            raise ValueError("Merkle root doesn't match the header")
+        verified.update(nodes)
+        return {h[::-1].hex() for h in matches.values()}
+
+
+merkle_proof_verifier = MerkleProofVerifier()
+
+
+def verify_merkle_proofs(items):
+    """Batch version of is_valid_merkle_proof, see MerkleProofVerifier.verify"""
+    return merkle_proof_verifier.verify(items)
+
+
+def build_merkle_proof(header, txids, matched):
+    """
+    Builds a BIP37 proof like gettxoutproof (TraverseAndBuild of Core)
+    for the txids in matched, txids are all transactions of the block.
+    Returns the proof in hex.
+    """
+    leaves = [bytes.fromhex(txid)[::-1] for txid in txids]
+    matched = set(matched)
+    total = len(leaves)
+    hashes = []
+    bits = []
+
+    def node_hash(height, pos):
+        if height == 0:
+            return leaves[pos]
+        left = node_hash(height - 1, pos * 2)
+        if pos * 2 + 1 < _tree_width(total, height - 1):
+            right = node_hash(height - 1, pos * 2 + 1)
+        else:
+            right = left
+        return hash256(left + right)
+
+    def traverse(height, pos):
+        first = pos << height
+        last = min((pos + 1) << height, total)
+        parent_of_match = any(txids[i] in matched for i in range(first, last))
+        bits.append(1 if parent_of_match else 0)
+        if height == 0 or not parent_of_match:
+            hashes.append(node_hash(height, pos))
+            return
+        traverse(height - 1, pos * 2)
+        if pos * 2 + 1 < _tree_width(total, height - 1):
+            traverse(height - 1, pos * 2 + 1)
+
+    traverse(_tree_height(total), 0)
+    flags = bytearray((len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        flags[i // 8] |= bit << (i % 8)
+    return (
+        header
+        + int_to_little_endian(total, 4)
+        + encode_varint(len(hashes))
+        + b"".join(hashes)
+        + encode_varint(len(flags))
+        + bytes(flags)
+    ).hex()
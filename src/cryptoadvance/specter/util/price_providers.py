@@ -1,9 +1,17 @@
 import requests
 import logging
+import threading
+import time
+
+from ..storage import SqliteStore
 
 logger = logging.getLogger(__name__)
 
 OZ_TO_G = 28.3495231
+DAY = 86400
+# max number of daily candles in one bitstamp request
+BITSTAMP_MAX_CANDLES = 1000
+SPOTBIT_URL = "http://h6zwwkcivy2hjys6xpinlnz2f74dsmvltzsd4xb42vinhlcaoe7fdeqd.onion"
 
 
 def update_price(specter, current_user):
@@ -14,6 +22,69 @@ def update_price(specter, current_user):
     return success
 
 
+def get_currency(price_provider):
+    """Returns (currency, currency_symbol, weight_unit_convertible) of the provider"""
+    currency = "usd"
+    currency_symbol = "$"
+    weight_unit_convertible = False
+    if price_provider.endswith("_eur"):
+        currency = "eur"
+        currency_symbol = "€"
+    elif price_provider.endswith("_gbp"):
+        currency = "gbp"
+        currency_symbol = "£"
+    elif price_provider.endswith("_chf"):
+        currency = "chf"
+        currency_symbol = " Fr."
+    elif price_provider.endswith("_aud"):
+        currency = "aud"
+        currency_symbol = "$"
+    elif price_provider.endswith("_cad"):
+        currency = "cad"
+        currency_symbol = "$"
+    elif price_provider.endswith("_nzd"):
+        currency = "nzd"
+        currency_symbol = "$"
+    elif price_provider.endswith("_hkd"):
+        currency = "hkd"
+        currency_symbol = "$"
+    elif price_provider.endswith("_jpy"):
+        currency = "jpy"
+        currency_symbol = "¥"
+    elif price_provider.endswith("_rub"):
+        currency = "rub"
+        currency_symbol = "₽"
+    elif price_provider.endswith("_ils"):
+        currency = "ils"
+        currency_symbol = "₪"
+    elif price_provider.endswith("_jod"):
+        currency = "jod"
+        currency_symbol = "د.ا"
+    elif price_provider.endswith("_twd"):
+        currency = "twd"
+        currency_symbol = "$"
+    elif price_provider.endswith("_brl"):
+        currency = "brl"
+        currency_symbol = " BRL"
+    elif price_provider.endswith("_xau"):
+        currency = "xau"
+        currency_symbol = " oz. "
+        weight_unit_convertible = True
+    elif price_provider.endswith("_xag"):
+        currency = "xag"
+        currency_symbol = " oz. "
+        weight_unit_convertible = True
+    elif price_provider.endswith("_xpt"):
+        currency = "xpt"
+        currency_symbol = " oz. "
+        weight_unit_convertible = True
+    elif price_provider.endswith("_xpd"):
+        currency = "xpd"
+        currency_symbol = " oz. "
+        weight_unit_convertible = True
+    return currency, currency_symbol, weight_unit_convertible
+
+
 """
     Tries to get the current BTC price based on the user provider preferences.
     Returns: (success, price, symbol)
@@ -21,112 +92,32 @@ def update_price(specter, current_user):
 
 
 def get_price_at(specter, current_user, timestamp="now"):
+    if timestamp != "now":
+        return get_prices_at(specter, current_user, [timestamp])[timestamp]
     try:
         if specter.price_check:
             requests_session = specter.requests_session(
                 force_tor=("spotbit" in specter.price_provider)
             )
-            currency = "usd"
-            currency_symbol = "$"
-            weight_unit_convertible = False
-            if specter.price_provider.endswith("_eur"):
-                currency = "eur"
-                currency_symbol = "€"
-            elif specter.price_provider.endswith("_gbp"):
-                currency = "gbp"
-                currency_symbol = "£"
-            elif specter.price_provider.endswith("_chf"):
-                currency = "chf"
-                currency_symbol = " Fr."
-            elif specter.price_provider.endswith("_aud"):
-                currency = "aud"
-                currency_symbol = "$"
-            elif specter.price_provider.endswith("_cad"):
-                currency = "cad"
-                currency_symbol = "$"
-            elif specter.price_provider.endswith("_nzd"):
-                currency = "nzd"
-                currency_symbol = "$"
-            elif specter.price_provider.endswith("_hkd"):
-                currency = "hkd"
-                currency_symbol = "$"
-            elif specter.price_provider.endswith("_jpy"):
-                currency = "jpy"
-                currency_symbol = "¥"
-            elif specter.price_provider.endswith("_rub"):
-                currency = "rub"
-                currency_symbol = "₽"
-            elif specter.price_provider.endswith("_ils"):
-                currency = "ils"
-                currency_symbol = "₪"
-            elif specter.price_provider.endswith("_jod"):
-                currency = "jod"
-                currency_symbol = "د.ا"
-            elif specter.price_provider.endswith("_twd"):
-                currency = "twd"
-                currency_symbol = "$"
-            elif specter.price_provider.endswith("_brl"):
-                currency = "brl"
-                currency_symbol = " BRL"
-            elif specter.price_provider.endswith("_xau"):
-                currency = "xau"
-                currency_symbol = " oz. "
-                weight_unit_convertible = True
-            elif specter.price_provider.endswith("_xag"):
-                currency = "xag"
-                currency_symbol = " oz. "
-                weight_unit_convertible = True
-            elif specter.price_provider.endswith("_xpt"):
-                currency = "xpt"
-                currency_symbol = " oz. "
-                weight_unit_convertible = True
-            elif specter.price_provider.endswith("_xpd"):
-                currency = "xpd"
-                currency_symbol = " oz. "
-                weight_unit_convertible = True
+            currency, currency_symbol, weight_unit_convertible = get_currency(
+                specter.price_provider
+            )
 
             if specter.price_provider.startswith("bitstamp"):
-                if timestamp == "now":
-                    price = requests_session.get(
-                        "https://www.bitstamp.net/api/v2/ticker/btc{}".format(currency)
-                    ).json()["last"]
-                else:
-                    price = requests_session.get(
-                        "https://www.bitstamp.net/api/v2/ohlc/btc{}/?limit=1&step=86400&start={}".format(
-                            currency, timestamp
-                        )
-                    ).json()["data"]["ohlc"][0]["close"]
+                price = requests_session.get(
+                    "https://www.bitstamp.net/api/v2/ticker/btc{}".format(currency)
+                ).json()["last"]
             elif specter.price_provider.startswith("coindesk"):
-                if timestamp == "now":
-                    price = requests_session.get(
-                        f"https://api.coindesk.com/v1/bpi/currentprice/{currency.upper()}.json"
-                    ).json()["bpi"][currency.upper()]["rate_float"]
-                else:
-                    return False, 0, ""
+                price = requests_session.get(
+                    f"https://api.coindesk.com/v1/bpi/currentprice/{currency.upper()}.json"
+                ).json()["bpi"][currency.upper()]["rate_float"]
             elif specter.price_provider.startswith("spotbit"):
                 exchange = specter.price_provider.split("spotbit_")[1].split("_")[0]
-                if timestamp == "now":
-                    price = requests_session.get(
-                        "http://h6zwwkcivy2hjys6xpinlnz2f74dsmvltzsd4xb42vinhlcaoe7fdeqd.onion/now/{}/{}".format(
-                            currency, exchange
-                        )
-                    ).json()["close"]
-                else:
-                    price = requests_session.get(
-                        "http://h6zwwkcivy2hjys6xpinlnz2f74dsmvltzsd4xb42vinhlcaoe7fdeqd.onion/hist/{}/{}/{}/{}".format(
-                            currency,
-                            exchange,
-                            timestamp * 1000,
-                            (timestamp + 121) * 1000,
-                        )
-                    ).json()["data"][0][7]
+                price = requests_session.get(
+                    "{}/now/{}/{}".format(SPOTBIT_URL, currency, exchange)
+                ).json()["close"]
             if weight_unit_convertible:
-                if specter.weight_unit == "gram":
-                    price = price * OZ_TO_G
-                    currency_symbol = " g."
-                elif specter.weight_unit == "kg":
-                    price = price * OZ_TO_G / 1000
-                    currency_symbol = " kg"
+                price, currency_symbol = convert_weight_unit(specter, price)
 
             return (True, price, currency_symbol)
     except Exception as e:
@@ -136,3 +127,153 @@ def get_price_at(specter, current_user, timestamp="now"):
             )
         )
     return (False, 0, "")
+
+
+def convert_weight_unit(specter, price):
+    """Converts price per oz. to the weight unit of the user"""
+    if specter.weight_unit == "gram":
+        return price * OZ_TO_G, " g."
+    if specter.weight_unit == "kg":
+        return price * OZ_TO_G / 1000, " kg"
+    return price, " oz. "
+
+
+def get_prices_at(specter, current_user, timestamps):
+    """
+    Returns {timestamp: (success, price, symbol)} for many historical timestamps.
+    Prices are daily, every day is resolved only once: from the price history
+    on disk, missing days are fetched in bulk if the provider supports it.
+    """
+    timestamps = {timestamp for timestamp in timestamps if timestamp is not None}
+    prices = {timestamp: (False, 0, "") for timestamp in timestamps}
+    if not specter.price_check or not timestamps:
+        return prices
+    currency, currency_symbol, weight_unit_convertible = get_currency(
+        specter.price_provider
+    )
+    if specter.price_provider.startswith("bitstamp"):
+        provider = "bitstamp"
+    elif specter.price_provider.startswith("spotbit"):
+        exchange = specter.price_provider.split("spotbit_")[1].split("_")[0]
+        provider = f"spotbit_{exchange}"
+    else:
+        # coindesk doesn't provide historical prices
+        return prices
+    history = specter.price_history
+    days = {int(timestamp) // DAY for timestamp in timestamps}
+    missing = sorted(
+        day for day in days if history.get(provider, currency, day) is None
+    )
+    fetched = {}
+    if missing:
+        requests_session = specter.requests_session(
+            force_tor=provider.startswith("spotbit")
+        )
+        if provider == "bitstamp":
+            fetched = _fetch_bitstamp_days(requests_session, currency, missing)
+        else:
+            fetched = _fetch_spotbit_days(requests_session, exchange, currency, missing)
+        history.add(provider, currency, fetched)
+    for timestamp in timestamps:
+        day = int(timestamp) // DAY
+        price = fetched.get(day, history.get(provider, currency, day))
+        if price is None:
+            continue
+        symbol = currency_symbol
+        if weight_unit_convertible:
+            price, symbol = convert_weight_unit(specter, price)
+        prices[timestamp] = (True, price, symbol)
+    return prices
+
+
+def _fetch_bitstamp_days(requests_session, currency, days):
+    """Fetches daily close prices, up to BITSTAMP_MAX_CANDLES days per request"""
+    prices = {}
+    i = 0
+    while i < len(days):
+        start = days[i]
+        limit = min(BITSTAMP_MAX_CANDLES, days[-1] - start + 1)
+        try:
+            candles = requests_session.get(
+                "https://www.bitstamp.net/api/v2/ohlc/btc{}/?step={}&limit={}&start={}".format(
+                    currency, DAY, limit, start * DAY
+                )
+            ).json()["data"]["ohlc"]
+            for candle in candles:
+                prices[int(candle["timestamp"]) // DAY] = float(candle["close"])
+        except Exception as e:
+            logger.warning(f"Failed to get price history from bitstamp: {e}")
+        while i < len(days) and days[i] < start + limit:
+            i += 1
+    return prices
+
+
+def _fetch_spotbit_days(requests_session, exchange, currency, days):
+    """Spotbit has no daily candles, so we need one request per day"""
+    prices = {}
+    for day in days:
+        try:
+            prices[day] = float(
+                requests_session.get(
+                    "{}/hist/{}/{}/{}/{}".format(
+                        SPOTBIT_URL,
+                        currency,
+                        exchange,
+                        day * DAY * 1000,
+                        (day * DAY + 121) * 1000,
+                    )
+                ).json()["data"][0][7]
+            )
+        except Exception as e:
+            logger.warning(f"Failed to get price history from spotbit: {e}")
+    return prices
+
+
+class DailyPrice(dict):
+    columns = ["key", "provider", "currency", "day", "price"]
+
+
+class PriceHistory:
+    """
+    Persistent cache of daily BTC prices keyed by (provider, currency, day),
+    day is the unix timestamp // 86400.
+    Prices of past days don't change, so we fetch them only once.
+    """
+
+    def __init__(self, path):
+        self.store = SqliteStore(path, "daily_prices", DailyPrice, "key")
+        self.lock = threading.Lock()
+        self._prices = None
+
+    @property
+    def prices(self):
+        with self.lock:
+            if self._prices is None:
+                self._prices = {
+                    (row["provider"], row["currency"], row["day"]): row["price"]
+                    for row in self.store.load()
+                }
+            return self._prices
+
+    def get(self, provider, currency, day):
+        return self.prices.get((provider, currency, day))
+
+    def add(self, provider, currency, prices):
+        """Adds {day: price}, the current day is not finished and not stored"""
+        today = int(time.time()) // DAY
+        rows = [
+            DailyPrice(
+                key=f"{provider}:{currency}:{day}",
+                provider=provider,
+                currency=currency,
+                day=day,
+                price=price,
+            )
+            for day, price in prices.items()
+            if day < today
+        ]
+        if not rows:
+            return
+        self.store.save(rows, changed=rows)
+        for row in rows:
+            self.prices[(provider, currency, row["day"])] = row["price"]
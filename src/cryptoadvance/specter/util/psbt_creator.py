@@ -1,16 +1,75 @@
+import csv
 import json
+from collections import deque
 from json.decoder import JSONDecodeError
 import logging
+import os
 from math import isnan
 
 import requests
 from cryptoadvance.specter.specter_error import SpecterError
+from embit import script
+from embit.liquid.networks import get_network
 
 from ..helpers import is_testnet
+from .coin_selection import INPUT_BASE_VSIZE, TX_OVERHEAD_VSIZE
 from .descriptor import AddChecksum, Descriptor
 
 logger = logging.getLogger(__name__)
 
+# max vsize of a batch payout transaction, standard transactions are below 100k vbytes
+BATCH_MAX_VSIZE = int(os.getenv("SPECTER_BATCH_MAX_VSIZE", "90000"))
+# inputs a batch leaves room for before the coins are selected
+BATCH_INPUTS_RESERVE = 20
+# max number of errors listed when recipients are invalid
+MAX_REPORTED_ERRORS = 10
+
+
+def normalize_address(address):
+    """bech32 addresses can be uppercase (e.g. in QR codes)"""
+    if address.startswith(("BC1", "TB1", "BCRT1", "EL1", "ERT1", "EX1", "LQ1")):
+        return address.lower()
+    return address
+
+
+def validate_addresses(addresses, chain):
+    """
+    Checks all addresses at once, every distinct address is decoded only once.
+    Returns a list of (index, error) of invalid addresses.
+    """
+    network = get_network(chain)
+    checked = {}
+    invalid = []
+    for i, address in enumerate(addresses):
+        if address not in checked:
+            try:
+                if script.address_to_scriptpubkey(address).address(network) == address:
+                    checked[address] = None
+                else:
+                    checked[address] = f"{address} is not a {chain} address"
+            except Exception:
+                checked[address] = f"{address} is not a valid address"
+        if checked[address] is not None:
+            invalid.append((i, checked[address]))
+    return invalid
+
+
+def split_batches(sizes, max_size):
+    """Splits indexes of sizes into consecutive batches with sum(sizes) <= max_size"""
+    batches = []
+    batch = []
+    batch_size = 0
+    for i, size in enumerate(sizes):
+        if batch and batch_size + size > max_size:
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(i)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
 
 class PsbtCreator:
     """A class to create PSBTs easily out of stuff coming from the frontend"""
@@ -24,6 +83,7 @@ class PsbtCreator:
         recipients_txt=None,
         recipients_amount_unit=None,
         request_json=None,
+        recipients_csv=None,
     ):
         """
         * depending of ui_option = (ui|text) Fill the payment-details in either of these:
@@ -31,6 +91,8 @@ class PsbtCreator:
              { "address_1":"bc1...","btc_amount_1":"0.2", "amount_unit_1":"btc", "label_1":"someLabel","address_2": ...}
           * recipients_txt: expects the payment-details in textblock "recipients" and recipients_amount_unit for all
             amounts in recipients_txt either "sats" or "btc"
+          * recipients_csv (ui_option = csv): lines of "address,amount[,label]" (e.g. a file) for batch payouts,
+            amounts in recipients_amount_unit
         * in both cases, the request_form also contains:
           * "substract": optional (default: False), Boolean whether to substract the fee from the amounts, otherwise additional input gets created
           * "substract_from": index on which address to substract the fee from
@@ -76,19 +138,32 @@ class PsbtCreator:
             ) = PsbtCreator.paymentinfo_from_json(
                 specter, wallet, request_json=request_json
             )
+        elif ui_option == "csv":
+            if specter.is_liquid:
+                raise SpecterError("Batch payouts are not supported on Liquid")
+            if recipients_csv is None or recipients_amount_unit is None:
+                raise SpecterError(
+                    "recipients_csv and recipients_amount_unit is mandatory"
+                )
+            (
+                self.addresses,
+                self.labels,
+                self.amounts,
+                self.amount_units,
+            ) = PsbtCreator.paymentinfo_from_csv(
+                specter,
+                wallet,
+                recipients_csv=recipients_csv,
+                recipients_amount_unit=recipients_amount_unit,
+            )
         else:
             raise SpecterError(
-                f"Unknown ui_option: {ui_option}. Valid ones are ui|text|json"
+                f"Unknown ui_option: {ui_option}. Valid ones are ui|text|json|csv"
             )
         # normalizing
-        self.addresses = [
-            address.lower()
-            if address.startswith(("BC1", "TB1", "BCRT1", "EL1", "ERT1", "EX1", "LQ1"))
-            else address
-            for address in self.addresses
-        ]
+        self.addresses = [normalize_address(address) for address in self.addresses]
         # get kwargs
-        if ui_option == "ui" or ui_option == "text":
+        if ui_option in ["ui", "text", "csv"]:
             self.kwargs = PsbtCreator.kwargs_from_request_form(request_form)
         elif ui_option == "json":
             self.kwargs = PsbtCreator.kwargs_from_request_json(request_json)
@@ -114,6 +189,71 @@ class PsbtCreator:
                         self.amounts[0] = v["value"]
         return self.psbt
 
+    def create_batch_psbts(self, wallet, max_vsize=BATCH_MAX_VSIZE):
+        """Batch payout: creates as many PSBTs below max_vsize vbytes as needed
+        to pay all recipients. Coins are selected locally for all batches so they
+        don't spend the same inputs. The PSBTs are in self.psbts,
+        returns a list with recipients, amount, fee and vsize of every batch.
+        """
+        fee_rate = self.kwargs.get("fee_rate")
+        if not fee_rate:
+            raise SpecterError("Batch payouts need a fee rate")
+        fee_rate = max(fee_rate, wallet.MIN_FEE_RATE)
+        input_vsize = INPUT_BASE_VSIZE + wallet.weight_per_input / 4
+        # everything but recipients and inputs
+        fixed_vsize = TX_OVERHEAD_VSIZE + wallet.output_vsize(wallet.change_address)
+        output_sizes = [wallet.output_vsize(address) for address in self.addresses]
+        batches = deque(
+            split_batches(
+                output_sizes,
+                max_vsize - fixed_vsize - BATCH_INPUTS_RESERVE * input_vsize,
+            )
+        )
+        used = set()
+        self.psbts = []
+        self.batches = []
+        while batches:
+            batch = batches.popleft()
+            addresses = [self.addresses[i] for i in batch]
+            amounts = [self.amounts[i] for i in batch]
+            selection = wallet.select_coins(addresses, amounts, fee_rate, exclude=used)
+            if selection is None:
+                raise SpecterError(
+                    f"Wallet {wallet.name} does not have sufficient funds for batch {len(self.batches) + 1}"
+                )
+            vsize = (
+                fixed_vsize
+                + sum(output_sizes[i] for i in batch)
+                + len(selection.coins) * input_vsize
+            )
+            if vsize > max_vsize and len(batch) > 1:
+                # too many inputs - pay half of the recipients at a time
+                half = len(batch) // 2
+                batches.extendleft([batch[half:], batch[:half]])
+                continue
+            used.update(f"{coin.txid}:{coin.vout}" for coin in selection.coins)
+            psbt = wallet.createpsbt(
+                addresses,
+                amounts,
+                fee_rate=fee_rate,
+                rbf=self.kwargs["rbf"],
+                readonly=self.kwargs["readonly"],
+                inputs=selection.inputs,
+            )
+            self.psbts.append(psbt)
+            self.batches.append(
+                {
+                    "batch": len(self.batches) + 1,
+                    "txid": psbt["tx"]["txid"],
+                    "recipients": len(batch),
+                    "amount": round(sum(amounts), 8),
+                    "inputs": len(selection.coins),
+                    "fee": psbt.get("fee"),
+                    "vsize": psbt["tx_full_size"],
+                }
+            )
+        return self.batches
+
     @classmethod
     def paymentinfo_from_ui(cls, specter, wallet, request_form):
         """calculates the correct format needed by wallet.createpsbt() out of a request-form
@@ -175,6 +315,66 @@ class PsbtCreator:
                 logger.error(f"line does not match expected pattern: '{output}'")
         return addresses, labels, amounts, amount_units
 
+    @classmethod
+    def paymentinfo_from_csv(
+        cls, specter, wallet, recipients_csv, recipients_amount_unit
+    ):
+        """calculates the correct format needed by wallet.createpsbt() out of csv lines
+        "address,amount[,label]", recipients_csv can be a string or any iterable of lines
+        (e.g. a file), an optional header line is skipped.
+        All lines are checked before an error with the invalid lines is raised.
+        """
+        if recipients_amount_unit not in ["sat", "btc"]:
+            raise SpecterError(
+                f"Unknown recipients_amount_unit: {recipients_amount_unit}"
+            )
+        if isinstance(recipients_csv, str):
+            recipients_csv = recipients_csv.splitlines()
+        addresses = []
+        labels = []
+        amounts = []
+        amount_units = []
+        line_numbers = []
+        errors = []
+        for line_number, row in enumerate(csv.reader(recipients_csv), start=1):
+            if not any(cell.strip() for cell in row):
+                continue
+            try:
+                amount = float(row[1].strip())
+            except (IndexError, ValueError):
+                if line_number > 1:
+                    errors.append((line_number, "can't parse the amount"))
+                continue
+            if recipients_amount_unit == "sat":
+                amount = round(amount / 1e8, 8)
+            if isnan(amount) or amount <= 0:
+                errors.append((line_number, "amount must be positive"))
+                continue
+            addresses.append(normalize_address(row[0].strip()))
+            amounts.append(amount)
+            labels.append(row[2].strip() if len(row) > 2 else "")
+            amount_units.append(recipients_amount_unit)
+            line_numbers.append(line_number)
+        for i, error in validate_addresses(addresses, specter.chain):
+            errors.append((line_numbers[i], error))
+        if errors:
+            errors.sort()
+            more = len(errors) - MAX_REPORTED_ERRORS
+            raise SpecterError(
+                "Invalid recipients: "
+                + ", ".join(
+                    f"line {line}: {error}"
+                    for line, error in errors[:MAX_REPORTED_ERRORS]
+                )
+                + (f" and {more} more" if more > 0 else "")
+            )
+        if not addresses:
+            raise SpecterError("No recipients found")
+        wallet.setlabels(
+            {address: label for address, label in zip(addresses, labels) if label}
+        )
+        return addresses, labels, amounts, amount_units
+
     @classmethod
     def paymentinfo_from_json(cls, specter, wallet, request_json):
         """calculates the correct format needed by wallet.createpsbt() out of a json
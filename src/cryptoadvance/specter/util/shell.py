@@ -41,14 +41,16 @@ def which(program):
 
 
 # should work in all python versions
-def run_shell(cmd):
+def run_shell(cmd, env=None):
     """
     Runs a shell command.
     Example: run(["ls", "-a"])
     Returns: dict({"code": returncode, "out": stdout, "err": stderr})
     """
     try:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env
+        )
         stdout, stderr = proc.communicate()
         return {"code": proc.returncode, "out": stdout, "err": stderr}
     except Exception as e:
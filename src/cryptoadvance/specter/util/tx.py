@@ -1,9 +1,33 @@
-from embit.transaction import Transaction
-from embit.networks import NETWORKS
+from embit import bip32
+from embit.psbt import PSBT
+from embit.liquid.networks import get_network
+from embit.script import Script
+from collections.abc import Mapping
 from hashlib import sha256
-import math
+import os
+from .lru import LRUCache
 
-TYPES_MAP = {"p2wpkh": "witness_v0_keyhash"}
+# max number of scriptPubKey -> address conversions kept in memory
+ADDRESS_CACHE_SIZE = int(os.getenv("SPECTER_ADDRESS_CACHE_SIZE", "10000"))
+_address_cache = LRUCache(ADDRESS_CACHE_SIZE)
+_NO_ADDRESS = object()
+
+TYPES_MAP = {
+    "p2pkh": "pubkeyhash",
+    "p2sh": "scripthash",
+    "p2wpkh": "witness_v0_keyhash",
+    "p2wsh": "witness_v0_scripthash",
+    "p2tr": "witness_v1_taproot",
+}
+
+SIGHASH_MAP = {
+    0x01: "ALL",
+    0x02: "NONE",
+    0x03: "SINGLE",
+    0x81: "ALL|ANYONECANPAY",
+    0x82: "NONE|ANYONECANPAY",
+    0x83: "SINGLE|ANYONECANPAY",
+}
 
 
 def decoderawinput(vin):
@@ -22,6 +46,21 @@ def decoderawinput(vin):
     return result
 
 
+def decodescript(script, chain):
+    result = {
+        # TODO: asm
+        # "asm": "0 f81b3e69f5cafc2f1e69ed5625d07876e3558e69",
+        "hex": script.data.hex(),
+        "type": TYPES_MAP.get(script.script_type(), "nonstandard"),
+    }
+    if script.data[:1] == b"\x6a":
+        result["type"] = "nulldata"
+    address = script_to_address(script.data, chain)
+    if address is not None:
+        result["address"] = address
+    return result
+
+
 def decoderawoutput(vout, chain):
     result = {
         "value": vout.value * 1e-8,
@@ -34,40 +73,238 @@ def decoderawoutput(vout, chain):
             # "type": "witness_v0_keyhash",
         },
     }
-    try:
-        result["address"] = vout.script_pubkey.address(NETWORKS[chain])
-    except:
-        pass
+    address = script_to_address(vout.script_pubkey.data, chain)
+    if address is not None:
+        result["address"] = address
     return result
 
 
+def script_to_address(data, chain):
+    """Memoized address of a scriptPubKey (bytes), None if it has no address"""
+    key = (bytes(data), chain)
+    address = _address_cache.get(key, _NO_ADDRESS)
+    if address is _NO_ADDRESS:
+        try:
+            address = Script(key[0]).address(get_network(chain))
+        except:
+            address = None
+        _address_cache[key] = address
+    return address
+
+
+def _read_varint(raw, pos):
+    """Returns the varint at pos and the position after it"""
+    i = raw[pos]
+    if i < 0xFD:
+        return i, pos + 1
+    length = {0xFD: 2, 0xFE: 4, 0xFF: 8}[i]
+    return int.from_bytes(raw[pos + 1 : pos + 1 + length], "little"), pos + 1 + length
+
+
+def _hash256(data):
+    return sha256(sha256(data).digest()).digest()
+
+
+class RawTransaction(Mapping):
+    """
+    decoderawtransaction result computed in one pass over the raw bytes:
+    txid, wtxid and sizes come from the offsets of the parts of the transaction,
+    the vin and vout dicts are only built when they are accessed.
+    Read-only, use dict(tx) for a copy that can be changed.
+    """
+
+    KEYS = [
+        "txid",
+        "hash",
+        "version",
+        "size",
+        "vsize",
+        "weight",
+        "locktime",
+        "vin",
+        "vout",
+    ]
+
+    def __init__(self, raw, chain="main"):
+        raw = bytes(raw)
+        self.raw = raw
+        self.chain = chain
+        # marker and flag
+        segwit = len(raw) > 5 and raw[4] == 0 and raw[5] != 0
+        pos = 6 if segwit else 4
+        # offsets of (input, scriptSig, end of scriptSig)
+        self._inputs = []
+        count, pos = _read_varint(raw, pos)
+        for _ in range(count):
+            start = pos
+            length, pos = _read_varint(raw, pos + 36)
+            self._inputs.append((start, pos, pos + length))
+            pos += length + 4
+        # offsets of (output, scriptPubKey, end of scriptPubKey)
+        self._outputs = []
+        count, pos = _read_varint(raw, pos)
+        for _ in range(count):
+            start = pos
+            length, pos = _read_varint(raw, pos + 8)
+            self._outputs.append((start, pos, pos + length))
+            pos += length
+        outputs_end = pos
+        # offsets of witness items per input
+        self._witnesses = []
+        if segwit:
+            for _ in self._inputs:
+                items = []
+                count, pos = _read_varint(raw, pos)
+                for _ in range(count):
+                    length, pos = _read_varint(raw, pos)
+                    items.append((pos, pos + length))
+                    pos += length
+                self._witnesses.append(items)
+        if pos + 4 != len(raw):
+            raise ValueError("Invalid transaction length")
+        self._data = {
+            "version": int.from_bytes(raw[:4], "little"),
+            "size": len(raw),
+            "locktime": int.from_bytes(raw[pos:], "little"),
+            "hash": _hash256(raw)[::-1].hex(),
+        }
+        if segwit:
+            # without marker, flag and witness
+            stripped = raw[:4] + raw[6:outputs_end] + raw[pos:]
+            self._data["txid"] = _hash256(stripped)[::-1].hex()
+        else:
+            stripped = raw
+            self._data["txid"] = self._data["hash"]
+        weight = len(stripped) * 3 + len(raw)
+        self._data["weight"] = weight
+        self._data["vsize"] = (weight + 3) // 4
+
+    @classmethod
+    def from_string(cls, hextx, chain="main"):
+        return cls(bytes.fromhex(hextx), chain)
+
+    def _vin(self):
+        raw = self.raw
+        result = []
+        for i, (start, script_start, script_end) in enumerate(self._inputs):
+            vin = {
+                "txid": raw[start : start + 32][::-1].hex(),
+                "vout": int.from_bytes(raw[start + 32 : start + 36], "little"),
+                "scriptSig": {"hex": raw[script_start:script_end].hex()},
+                "sequence": int.from_bytes(raw[script_end : script_end + 4], "little"),
+            }
+            if self._witnesses and self._witnesses[i]:
+                vin["txinwitness"] = [raw[a:b].hex() for a, b in self._witnesses[i]]
+            result.append(vin)
+        return result
+
+    def _vout(self):
+        raw = self.raw
+        result = []
+        for n, (start, script_start, script_end) in enumerate(self._outputs):
+            script = raw[script_start:script_end]
+            vout = {
+                "value": int.from_bytes(raw[start : start + 8], "little") * 1e-8,
+                "scriptPubKey": {"hex": script.hex()},
+            }
+            address = script_to_address(script, self.chain)
+            if address is not None:
+                vout["address"] = address
+            vout["n"] = n
+            result.append(vout)
+        return result
+
+    def __getitem__(self, key):
+        if key not in self._data:
+            if key == "vin":
+                self._data[key] = self._vin()
+            elif key == "vout":
+                self._data[key] = self._vout()
+            else:
+                raise KeyError(key)
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+
 def decoderawtransaction(hextx, chain="main"):
-    raw = bytes.fromhex(hextx)
-    tx = Transaction.parse(raw)
-    txhash = sha256(sha256(raw).digest()).digest()[::-1].hex()
-    txsize = len(raw)
-    if tx.is_segwit:
-        # tx size - flag - marker - witness
-        non_witness_size = (
-            txsize - 2 - sum([len(inp.witness.serialize()) for inp in tx.vin])
+    return dict(RawTransaction.from_string(hextx, chain))
+
+
+def _decodederivations(derivations):
+    return [
+        {
+            "pubkey": pub.sec().hex(),
+            "master_fingerprint": der.fingerprint.hex(),
+            "path": bip32.path_to_str(der.derivation).replace("h", "'"),
+        }
+        for pub, der in derivations.items()
+    ]
+
+
+def decodepsbtscope(scope, chain):
+    """Fields shared by inputs and outputs of the PSBT"""
+    result = {}
+    if scope.redeem_script is not None:
+        result["redeem_script"] = decodescript(scope.redeem_script, chain)
+    if scope.witness_script is not None:
+        result["witness_script"] = decodescript(scope.witness_script, chain)
+    if scope.bip32_derivations:
+        result["bip32_derivs"] = _decodederivations(scope.bip32_derivations)
+    if scope.unknown:
+        result["unknown"] = {k.hex(): v.hex() for k, v in scope.unknown.items()}
+    return result
+
+
+def decodepsbtinput(inp, chain):
+    result = {}
+    if inp.non_witness_utxo is not None:
+        result["non_witness_utxo"] = decoderawtransaction(
+            inp.non_witness_utxo.serialize().hex(), chain
         )
-        witness_size = txsize - non_witness_size
-        weight = non_witness_size * 4 + witness_size
-        vsize = math.ceil(weight / 4)
-    else:
-        vsize = txsize
-        weight = txsize * 4
+    if inp.witness_utxo is not None:
+        result["witness_utxo"] = {
+            "amount": round(inp.witness_utxo.value * 1e-8, 8),
+            "scriptPubKey": decodescript(inp.witness_utxo.script_pubkey, chain),
+        }
+    if inp.partial_sigs:
+        result["partial_signatures"] = {
+            pub.sec().hex(): sig.hex() for pub, sig in inp.partial_sigs.items()
+        }
+    if inp.sighash_type is not None:
+        result["sighash"] = SIGHASH_MAP.get(inp.sighash_type, str(inp.sighash_type))
+    result.update(decodepsbtscope(inp, chain))
+    if inp.final_scriptsig is not None:
+        result["final_scriptSig"] = {"hex": inp.final_scriptsig.data.hex()}
+    if inp.final_scriptwitness is not None:
+        result["final_scriptwitness"] = [
+            item.hex() for item in inp.final_scriptwitness.items
+        ]
+    return result
+
+
+def decodepsbt(b64psbt, chain="main"):
+    """
+    Decodes a base64 PSBT without Bitcoin Core.
+    The result has the structure of Core's decodepsbt (without asm),
+    "fee" is only set if amounts of all inputs are known.
+    """
+    psbt = PSBT.from_string(b64psbt)
     result = {
-        "txid": tx.txid().hex(),
-        "hash": txhash,
-        "version": tx.version,
-        "size": txsize,
-        "vsize": vsize,
-        "weight": weight,
-        "locktime": tx.locktime,
-        "vin": [decoderawinput(vin) for vin in tx.vin],
-        "vout": [
-            dict(decoderawoutput(vout, chain), n=i) for i, vout in enumerate(tx.vout)
-        ],
+        "tx": decoderawtransaction(psbt.tx.serialize().hex(), chain),
+        "unknown": {k.hex(): v.hex() for k, v in psbt.unknown.items()},
+        "inputs": [decodepsbtinput(inp, chain) for inp in psbt.inputs],
+        "outputs": [decodepsbtscope(out, chain) for out in psbt.outputs],
     }
+    for vout, out in zip(result["tx"]["vout"], psbt.outputs):
+        vout["value"] = round(out.value * 1e-8, 8)
+        vout["scriptPubKey"] = decodescript(out.script_pubkey, chain)
+    try:
+        result["fee"] = round(psbt.fee() * 1e-8, 8)
+    except Exception:
+        pass
     return result
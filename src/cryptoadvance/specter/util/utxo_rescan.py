@@ -0,0 +1,231 @@
+""" Pipelined UTXO rescan: scantxoutset and import of the found transactions """
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from ..persistence import delete_file, read_json_file, write_json_file
+
+logger = logging.getLogger(__name__)
+
+# transactions per rpc batch and importprunedfunds batch
+RESCAN_CHUNK_SIZE = int(os.getenv("SPECTER_RESCAN_CHUNK_SIZE", "100"))
+# concurrent requests to the block explorer
+RESCAN_EXPLORER_WORKERS = int(os.getenv("SPECTER_RESCAN_EXPLORER_WORKERS", "4"))
+# timeout of a single request to the block explorer
+RESCAN_EXPLORER_TIMEOUT = 30
+
+
+def rescan_state_path(wallet_path):
+    """State file of the wallet's rescan, hidden so it's not loaded as a wallet"""
+    folder, fname = os.path.split(wallet_path)
+    return os.path.join(folder, "." + fname.replace(".json", "_rescan.json"))
+
+
+def chunks(lst, size):
+    return [lst[i : i + size] for i in range(0, len(lst), size)]
+
+
+class UtxoRescan:
+    """
+    Imports the unspents found by scantxoutset with importprunedfunds.
+    Work is done in chunks: proofs and raw transactions of the next chunk
+    are requested from Core while the current chunk is imported.
+    Transactions Core doesn't have (pruned blocks) are fetched from
+    the block explorer by a pool of workers and imported as they arrive.
+    Imported txids are stored in state_path so a rescan
+    of the same descriptors continues where the previous one stopped.
+    """
+
+    def __init__(
+        self,
+        rpc,
+        state_path,
+        explorer=None,
+        requests_session=None,
+        only_tor=False,
+        chunk_size=RESCAN_CHUNK_SIZE,
+        workers=RESCAN_EXPLORER_WORKERS,
+    ):
+        self.rpc = rpc
+        self.state_path = state_path
+        # make sure there is no trailing /
+        self.explorer = explorer.rstrip("/") if explorer else None
+        self.requests_session = requests_session
+        self.only_tor = only_tor
+        self.chunk_size = max(chunk_size, 1)
+        self.workers = max(workers, 1)
+        self.descriptors = []
+        self.imported = set()
+        self.lock = threading.Lock()
+        self.progress = {
+            "stage": "scan",
+            "total": 0,
+            "imported": 0,
+            "missing": 0,
+            "failed": 0,
+        }
+
+    @property
+    def active(self):
+        return self.progress["stage"] != "done"
+
+    @property
+    def percent(self):
+        """Import progress in %, scantxoutset reports its own progress"""
+        if self.progress["stage"] == "scan":
+            return 0
+        if not self.progress["total"]:
+            return 100
+        done = self.progress["imported"] + self.progress["failed"]
+        return 100 * done / self.progress["total"]
+
+    def load_state(self, descriptors):
+        """Restores imported txids of an unfinished rescan of the same descriptors"""
+        if not os.path.isfile(self.state_path):
+            return
+        try:
+            state = read_json_file(self.state_path)
+        except Exception as e:
+            logger.warning(f"Failed to read rescan state {self.state_path}: {e}")
+            return
+        if state.get("descriptors") == descriptors:
+            self.imported = set(state.get("imported", []))
+            logger.info(f"Resuming utxo rescan, {len(self.imported)} txs imported")
+
+    def save_state(self):
+        with self.lock:
+            state = {"descriptors": self.descriptors, "imported": list(self.imported)}
+        write_json_file(state, self.state_path)
+
+    def scan(self, scan_objects):
+        """Runs scantxoutset and returns the unspents"""
+        self.descriptors = [obj["desc"] for obj in scan_objects]
+        self.load_state(self.descriptors)
+        self.progress["stage"] = "scan"
+        return self.rpc.scantxoutset("start", scan_objects)["unspents"]
+
+    def run(self, unspents):
+        """Imports the transactions of the unspents"""
+        heights = {}
+        for tx in unspents:
+            heights[tx["txid"]] = tx["height"]
+        txids = list(heights)
+        self.progress.update(
+            {
+                "stage": "import",
+                "total": len(txids),
+                "imported": len([txid for txid in txids if txid in self.imported]),
+            }
+        )
+        pending = [txid for txid in txids if txid not in self.imported]
+        missing = []
+        batches = chunks(pending, self.chunk_size)
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            future = (
+                prefetch.submit(self.fetch_chunk, batches[0], heights)
+                if batches
+                else None
+            )
+            for i in range(len(batches)):
+                found, not_found = future.result()
+                if i + 1 < len(batches):
+                    future = prefetch.submit(self.fetch_chunk, batches[i + 1], heights)
+                missing += not_found
+                self.progress["missing"] = len(missing)
+                self.import_funds(found)
+        if missing:
+            self.progress["stage"] = "explorer"
+            self.fetch_from_explorer(missing)
+        self.progress["stage"] = "done"
+        if self.progress["failed"]:
+            # keep the state so the next rescan only retries the failed txs
+            self.save_state()
+        else:
+            delete_file(self.state_path)
+
+    def fetch_chunk(self, txids, heights):
+        """
+        Gets proofs and raw transactions of txids from Core.
+        Returns a list of (txid, raw, proof) and a list of txids Core doesn't have.
+        """
+        unique_heights = sorted({heights[txid] for txid in txids})
+        res = self.rpc.multi([("getblockhash", h) for h in unique_heights])
+        blockhashes = {h: r["result"] for h, r in zip(unique_heights, res)}
+        calls = []
+        for txid in txids:
+            blockhash = blockhashes[heights[txid]]
+            calls.append(("gettxoutproof", [txid], blockhash))
+            calls.append(("getrawtransaction", txid, False, blockhash))
+        res = self.rpc.multi(calls)
+        found = []
+        missing = []
+        for i, txid in enumerate(txids):
+            proof = res[2 * i]["result"]
+            raw = res[2 * i + 1]["result"]
+            if proof is None or raw is None:
+                missing.append(txid)
+            else:
+                found.append((txid, raw, proof))
+        return found, missing
+
+    def import_funds(self, txs):
+        """Imports a list of (txid, raw, proof)"""
+        if not txs:
+            return
+        res = self.rpc.multi(
+            [("importprunedfunds", raw, proof) for _, raw, proof in txs]
+        )
+        with self.lock:
+            for (txid, _, _), r in zip(txs, res):
+                if r["error"] is None:
+                    self.imported.add(txid)
+                    self.progress["imported"] += 1
+                else:
+                    logger.warning(f"Failed to import {txid}: {r['error']}")
+                    self.progress["failed"] += 1
+        self.save_state()
+
+    def _get(self, url):
+        try:
+            res = self.requests_session.get(url, timeout=RESCAN_EXPLORER_TIMEOUT)
+            res.raise_for_status()
+            return res.text
+        except Exception as e:
+            # retry if using requests_session failed
+            if self.only_tor:
+                raise e
+            logger.warning(f"Failed to fetch {url}, retrying without Tor: {e}")
+            res = requests.get(url, timeout=RESCAN_EXPLORER_TIMEOUT)
+            res.raise_for_status()
+            return res.text
+
+    def fetch_from_explorer_tx(self, txid):
+        raw = self._get(f"{self.explorer}/api/tx/{txid}/hex")
+        proof = self._get(f"{self.explorer}/api/tx/{txid}/merkleblock-proof")
+        return txid, raw, proof
+
+    def fetch_from_explorer(self, txids):
+        """Fetches txs from the block explorer and imports them in chunks as they arrive"""
+        if self.explorer is None or self.requests_session is None:
+            self.progress["failed"] += len(txids)
+            return
+        fetched = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self.fetch_from_explorer_tx, txid) for txid in txids
+            ]
+            for future in as_completed(futures):
+                try:
+                    fetched.append(future.result())
+                except Exception as e:
+                    logger.warning(f"Failed to fetch data from block explorer: {e}")
+                    with self.lock:
+                        self.progress["failed"] += 1
+                    continue
+                if len(fetched) >= self.chunk_size:
+                    self.import_funds(fetched)
+                    fetched = []
+        self.import_funds(fetched)
@@ -3,9 +3,9 @@ import time
 from collections import OrderedDict
 from .device import Device
 from .key import Key
-from .util.merkleblock import is_valid_merkle_proof
+from .util.merkleblock import verify_merkle_proofs
 from .helpers import der_to_bytes, get_address_from_dict
-from embit import base58, bip32
+from embit import base58, bip32, script
 from .util.descriptor import Descriptor, sort_descriptor, AddChecksum
 from embit.liquid.descriptor import LDescriptor
 from embit.descriptor.checksum import add_checksum
@@ -14,12 +14,22 @@ from embit.psbt import PSBT, DerivationPath
 from embit.transaction import Transaction
 
 from .util.xpub import get_xpub_fingerprint
-from .util.tx import decoderawtransaction
+from .util.derivation import get_address_deriver
+from .util.tx import decoderawtransaction, decodepsbt
+from .util.utxo_rescan import UtxoRescan, rescan_state_path
+from .util.coin_selection import (
+    COIN_SELECTION,
+    INPUT_BASE_VSIZE,
+    LONG_TERM_FEE_RATE,
+    TX_OVERHEAD_VSIZE,
+    Coin,
+    select_coins,
+)
 from .persistence import write_json_file, delete_file, delete_folder
 from io import BytesIO
+from .rpc import RpcError
 from .specter_error import SpecterError
 import threading
-import requests
 from math import ceil
 from .addresslist import AddressList
 from .txlist import TxList
@@ -57,6 +67,8 @@ class Wallet:
     # minimal fee rate is slightly above 1 sat/vbyte
     # to avoid rounding errors
     MIN_FEE_RATE = 1.01
+    # minimal value of the output the missing fee is taken from, in sats
+    DUST_LIMIT = 546
     # for inheritance (to simplify LWallet logic)
     AddressListCls = AddressList
     TxListCls = TxList
@@ -85,6 +97,7 @@ class Wallet:
         manager,
         old_format_detected=False,
         last_block=None,
+        sync_block=None,
     ):
         self.name = name
         self.alias = alias
@@ -118,11 +131,24 @@ class Wallet:
             os.path.join(self.manager.rpc_path, self.alias)
         )
         self.last_block = last_block
+        # block cursor of the transactions cache, see fetch_transactions
+        self.sync_block = sync_block
+        self._synced_txcount = None
+        # outpoint -> utxo, see check_utxo
+        self._utxo = {}
+        self._utxo_state_key = None
+        self.full_utxo = []
+        # address -> {"utxo": count, "amount": sum}, updated with the utxo set
+        self._utxo_by_address = {}
+        self._locked_outpoints = set()
+        # utxo state the balance was calculated for, see get_balance
+        self._balance_state_key = None
 
         addr_path = self.fullpath.replace(".json", "_addr.csv")
         self._addresses = self.AddressListCls(addr_path, self.rpc)
         if not self._addresses.file_exists:
             self.fetch_labels()
+        self._addresses.observers.append(self._relabel_utxo)
 
         txs_path = self.fullpath.replace(".json", "_txs.csv")
         self._transactions = self.TxListCls(
@@ -135,7 +161,11 @@ class Wallet:
             self.getnewaddress(change=True)
 
         self.update()
-        if old_format_detected or self.last_block != last_block:
+        if (
+            old_format_detected
+            or self.last_block != last_block
+            or self.sync_block != sync_block
+        ):
             self.save_to_file()
 
     @classmethod
@@ -259,28 +289,59 @@ class Wallet:
     def fetch_labels(self):
         """Load addresses and labels to self._addresses"""
         recv = [
-            dict(
-                address=self.get_address(idx, change=False, check_keypool=False),
-                index=idx,
-                change=False,
+            dict(address=address, index=idx, change=False)
+            for idx, address in enumerate(
+                self.get_addresses(0, self.keypool, change=False, check_keypool=False)
             )
-            for idx in range(self.keypool)
         ]
         change = [
-            dict(
-                address=self.get_address(idx, change=True, check_keypool=False),
-                index=idx,
-                change=True,
+            dict(address=address, index=idx, change=True)
+            for idx, address in enumerate(
+                self.get_addresses(
+                    0, self.change_keypool, change=True, check_keypool=False
+                )
             )
-            for idx in range(self.change_keypool)
         ]
         # TODO: load addresses for all txs here as well
         self._addresses.add(recv + change, check_rpc=True)
 
     def fetch_transactions(self):
-        """Load transactions from Bitcoin Core"""
-        arr = []
-        idx = 0
+        """Load transactions from Bitcoin Core.
+        After the first full sync only the changes since the sync cursor (sync_block)
+        are requested with listsinceblock. We fall back to a full sync if the cursor
+        is unknown to the node or if transactions appeared outside of the cursor window
+        (rescans, imported funds).
+        """
+        res = None
+        if self.sync_block and self._transactions:
+            res = self._fetch_transactions_since(self.sync_block)
+        if res is None:
+            res = self._fetch_transactions_full()
+        arr, sync_block = res
+        self._add_transactions(arr)
+        # move the cursor only when transactions are stored
+        if sync_block is not None:
+            self.sync_block = sync_block
+            self._synced_txcount = self.info.get("txcount", 0)
+
+    def _tx_needs_update(self, tx):
+        """Checks if a listtransactions / listsinceblock entry is different from our cache"""
+        # transactions that we don't know about,
+        # or that it has a different blockhash (reorg / confirmed)
+        # or doesn't have an address(?)
+        # or has wallet conflicts
+        cached = self._transactions.get(tx["txid"], None)
+        return (
+            cached is None
+            or not cached.get("address", None)
+            or cached.get("blockhash", None) != tx.get("blockhash", None)
+            or (
+                cached.get("blockhash", None) and not cached.get("blockheight", None)
+            )  # Fix for Core v19 with Specter v1
+            or cached.get("conflicts", []) != tx.get("walletconflicts", [])
+        )
+
+    def _unconfirmed_selftransfers(self):
         # unconfirmed_selftransfers needed since Bitcoin Core does not properly list `selftransfer` txs in `listtransactions` command
         # Until v0.21, it listed there consolidations to a receive address, but not change address
         # Since v0.21, it does not list there consolidations at all
@@ -293,11 +354,56 @@ class Wallet:
             if self._transactions[txid].get("category", "") == "selftransfer"
             and not self._transactions[txid].get("blockhash", None)
         ]
-        unconfirmed_selftransfers_txs = []
-        if unconfirmed_selftransfers:
-            unconfirmed_selftransfers_txs = self.rpc.multi(
-                [("gettransaction", txid) for txid in unconfirmed_selftransfers]
+        if not unconfirmed_selftransfers:
+            return []
+        res = self.rpc.multi(
+            [("gettransaction", txid) for txid in unconfirmed_selftransfers]
+        )
+        return [r["result"] for r in res if r["result"]]
+
+    def _fetch_transactions_since(self, blockhash):
+        """
+        Returns changed transactions since blockhash and the new cursor
+        or None if a full sync is required.
+        listsinceblock also returns mempool transactions and handles reorgs:
+        transactions from blocks that are not in the main chain anymore are in "removed".
+        """
+        res = self.rpc.multi(
+            [("listsinceblock", blockhash, 1, True, True), ("getwalletinfo",)]
+        )
+        if any(r["error"] is not None for r in res):
+            logger.warning(
+                f"Failed to get transactions since block {blockhash}, doing full sync"
             )
+            return None
+        obj, self.info = res[0]["result"], res[1]["result"]
+        # reorged transactions still have the old blockhash, so we always refresh them
+        removed = obj.get("removed", [])
+        txlist = obj["transactions"] + self._unconfirmed_selftransfers()
+        new_txids = {
+            tx["txid"]
+            for tx in txlist + removed
+            if tx["txid"] not in self._transactions
+        }
+        # wallet got transactions that are not in the window - rescan or import
+        known_txcount = self._synced_txcount
+        if known_txcount is None:
+            known_txcount = len(self._transactions)
+        if self.info.get("scanning", False) or self.info.get(
+            "txcount", 0
+        ) > known_txcount + len(new_txids):
+            return None
+        return [tx for tx in txlist if self._tx_needs_update(tx)] + removed, obj[
+            "lastblock"
+        ]
+
+    def _fetch_transactions_full(self):
+        """Pages through listtransactions and returns changed transactions and the new cursor"""
+        # remember the tip before paging so we don't miss anything in between
+        res = self.rpc.multi([("getbestblockhash",), ("getwalletinfo",)])
+        arr = []
+        idx = 0
+        unconfirmed_selftransfers_txs = self._unconfirmed_selftransfers()
         while True:
             txlist = (
                 self.rpc.listtransactions(
@@ -306,36 +412,26 @@ class Wallet:
                     LISTTRANSACTIONS_BATCH_SIZE * idx,
                     True,
                 )
-                + [tx["result"] for tx in unconfirmed_selftransfers_txs]
+                + unconfirmed_selftransfers_txs
             )
-            # list of transactions that we don't know about,
-            # or that it has a different blockhash (reorg / confirmed)
-            # or doesn't have an address(?)
-            # or has wallet conflicts
-            res = [
-                tx
-                for tx in txlist
-                if tx["txid"] not in self._transactions
-                or not self._transactions[tx["txid"]].get("address", None)
-                or self._transactions[tx["txid"]].get("blockhash", None)
-                != tx.get("blockhash", None)
-                or (
-                    self._transactions[tx["txid"]].get("blockhash", None)
-                    and not self._transactions[tx["txid"]].get("blockheight", None)
-                )  # Fix for Core v19 with Specter v1
-                or self._transactions[tx["txid"]].get("conflicts", [])
-                != tx.get("walletconflicts", [])
-            ]
+            res_page = [tx for tx in txlist if self._tx_needs_update(tx)]
             # TODO: Looks like Core ignore a consolidation (self-transfer) going into the change address (in listtransactions)
             # This means it'll show unconfirmed for us forever...
-            arr.extend(res)
+            arr.extend(res_page)
             idx += 1
             # not sure if Core <20 returns last batch or empty array at the end
             if (
-                len(res) < LISTTRANSACTIONS_BATCH_SIZE
+                len(res_page) < LISTTRANSACTIONS_BATCH_SIZE
                 or len(arr) < LISTTRANSACTIONS_BATCH_SIZE * idx
             ):
                 break
+        if res[0]["error"] is not None or res[1]["error"] is not None:
+            return arr, None
+        self.info = res[1]["result"]
+        return arr, res[0]["result"]
+
+    def _add_transactions(self, arr):
+        """Gets full transactions for listtransactions entries and adds them to the cache"""
         txs = dict.fromkeys([a["txid"] for a in arr])
         txids = list(txs.keys())
         # get all raw transactions
@@ -375,28 +471,28 @@ class Wallet:
                 )
                 != 0
             ):
+                start = self._addresses.max_index(change=False)
                 addresses = [
-                    dict(
-                        address=self.get_address(
-                            idx, change=False, check_keypool=False
-                        ),
-                        index=idx,
-                        change=False,
-                    )
-                    for idx in range(
-                        self._addresses.max_index(change=False),
-                        self._addresses.max_index(change=False) + self.GAP_LIMIT,
+                    dict(address=address, index=start + i, change=False)
+                    for i, address in enumerate(
+                        self.get_addresses(
+                            start,
+                            start + self.GAP_LIMIT,
+                            change=False,
+                            check_keypool=False,
+                        )
                     )
                 ]
+                start = self._addresses.max_index(change=True)
                 change_addresses = [
-                    dict(
-                        address=self.get_address(idx, change=True, check_keypool=False),
-                        index=idx,
-                        change=True,
-                    )
-                    for idx in range(
-                        self._addresses.max_index(change=True),
-                        self._addresses.max_index(change=True) + self.GAP_LIMIT,
+                    dict(address=address, index=start + i, change=True)
+                    for i, address in enumerate(
+                        self.get_addresses(
+                            start,
+                            start + self.GAP_LIMIT,
+                            change=True,
+                            check_keypool=False,
+                        )
                     )
                 ]
                 self._addresses.add(addresses, check_rpc=False)
@@ -533,6 +629,7 @@ class Wallet:
         frozen_utxo = wallet_dict.get("frozen_utxo", [])
         fullpath = wallet_dict.get("fullpath", default_fullpath)
         last_block = wallet_dict.get("last_block", None)
+        sync_block = wallet_dict.get("sync_block", None)
 
         wallet_dict = Wallet.parse_old_format(wallet_dict, device_manager)
 
@@ -569,6 +666,7 @@ class Wallet:
             manager,
             old_format_detected=wallet_dict["old_format_detected"],
             last_block=last_block,
+            sync_block=sync_block,
         )
 
     def get_info(self):
@@ -578,41 +676,157 @@ class Wallet:
             raise SpecterError(e)
         return self.info
 
+    def _utxo_state(self):
+        """
+        Returns a snapshot of everything that changes the UTXO set
+        (chain tip, wallet transactions, mempool balance, locks)
+        and the set of locked outpoints.
+        """
+        res = self.rpc.multi(
+            [("getbestblockhash",), ("getwalletinfo",), ("listlockunspent",)]
+        )
+        for r in res:
+            if r["error"] is not None:
+                raise RpcError("Request error: %s" % r["error"]["message"], r)
+        tip, info, locked = [r["result"] for r in res]
+        locked = {f"{utxo['txid']}:{utxo['vout']}" for utxo in locked}
+        state = (
+            tip,
+            info.get("txcount"),
+            info.get("balance"),
+            info.get("unconfirmed_balance"),
+            info.get("immature_balance"),
+            frozenset(locked),
+        )
+        return state, locked
+
     def check_utxo(self):
+        """
+        Keeps the UTXO set (outpoint -> utxo) in sync with Bitcoin Core.
+        Nothing is requested from Core if the chain tip, wallet transactions
+        and locked outpoints didn't change since the last check.
+        """
         try:
-            locked_utxo = self.rpc.listlockunspent()
-            if locked_utxo:
-                self.rpc.lockunspent(True, locked_utxo)
-            utxo = self.rpc.listunspent(0)
-            if locked_utxo:
-                self.rpc.lockunspent(False, locked_utxo)
-                for tx in utxo:
-                    if [
-                        _tx
-                        for _tx in locked_utxo
-                        if _tx["txid"] == tx["txid"] and _tx["vout"] == tx["vout"]
-                    ]:
-                        tx["locked"] = True
-            # list only the ones we know (have descriptor for it)
-            utxo = [tx for tx in utxo if tx.get("desc", "")]
-            for tx in utxo:
-                tx_data = self.gettransaction(tx["txid"], 0, full=False)
-                tx["time"] = tx_data["time"]
-                tx["category"] = "send"
-                if "locked" not in tx:
-                    tx["locked"] = False
-                try:
-                    # get category from the descriptor - recv or change
-                    idx = tx["desc"].split("[")[1].split("]")[0].split("/")[-2]
-                    if idx == "0":
-                        tx["category"] = "receive"
-                except:
-                    pass
-            self.full_utxo = sorted(utxo, key=lambda utxo: utxo["time"], reverse=True)
+            state, locked = self._utxo_state()
+            if state == self._utxo_state_key:
+                return
+            self._update_utxo(locked)
+            self._locked_outpoints = locked
+            self._utxo_state_key = state
         except Exception as e:
+            self._utxo = {}
+            self._utxo_state_key = None
             self.full_utxo = []
+            self._utxo_by_address = {}
+            self._locked_outpoints = set()
             raise SpecterError(f"Failed to load utxos, {e}")
 
+    def _update_utxo(self, locked):
+        unspent = {
+            f"{utxo['txid']}:{utxo['vout']}": utxo for utxo in self.rpc.listunspent(0)
+        }
+        # locked outputs are not listed by listunspent,
+        # gettxout tells us if they are still unspent
+        locked_missing = [o for o in locked if o not in unspent]
+        res = []
+        if locked_missing:
+            res = self.rpc.multi(
+                [
+                    ("gettxout", o.split(":")[0], int(o.split(":")[1]))
+                    for o in locked_missing
+                ]
+            )
+        for outpoint, r in zip(locked_missing, res):
+            if r["error"] is not None or r["result"] is None:
+                continue
+            if outpoint in self._utxo:
+                utxo = dict(self._utxo[outpoint])
+                utxo["confirmations"] = r["result"]["confirmations"]
+            else:
+                # we've never seen it - never unlock to list it
+                utxo = self._locked_utxo(outpoint, r["result"])
+            if utxo is not None:
+                unspent[outpoint] = utxo
+        utxo_set = {}
+        for outpoint, utxo in unspent.items():
+            # list only the ones we know (have descriptor for it)
+            if not utxo.get("desc", ""):
+                continue
+            utxo["locked"] = outpoint in locked
+            utxo["time"] = self._utxo_time(utxo["txid"])
+            utxo["label"] = self.getlabel(utxo["address"])
+            utxo["category"] = self._utxo_category(utxo)
+            utxo_set[outpoint] = utxo
+        self._utxo = utxo_set
+        self.full_utxo = sorted(
+            utxo_set.values(), key=lambda utxo: utxo["time"], reverse=True
+        )
+        utxo_by_address = {}
+        for utxo in self.full_utxo:
+            info = utxo_by_address.setdefault(utxo["address"], {"utxo": 0, "amount": 0})
+            info["utxo"] += 1
+            info["amount"] += utxo["amount"]
+        self._utxo_by_address = utxo_by_address
+
+    def _locked_utxo(self, outpoint, txout):
+        """listunspent-like entry of a locked outpoint from the gettxout result"""
+        script = txout["scriptPubKey"]
+        address = script.get("address") or (script.get("addresses") or [None])[0]
+        addr = self._addresses.get(address) if address else None
+        # only our addresses, same as listunspent entries without desc
+        if addr is None or addr.is_external:
+            return None
+        txid, vout = outpoint.split(":")
+        amount = txout.get("value")
+        if amount is None:
+            # confidential output - take the value from the decoded tx
+            tx = self.gettransaction(txid, 0, decode=True, full=False)
+            if tx is None:
+                return None
+            amount = tx["vout"][int(vout)].get("value", 0)
+        return {
+            "txid": txid,
+            "vout": int(vout),
+            "address": addr.address,
+            "scriptPubKey": script["hex"],
+            "amount": amount,
+            "confirmations": txout["confirmations"],
+            "desc": self.get_descriptor(address=addr.address),
+        }
+
+    def utxo_on_address(self, address):
+        """Returns the number of utxos and the amount on the address"""
+        info = self._utxo_by_address.get(address)
+        if info is None:
+            return 0, 0
+        return info["utxo"], info["amount"]
+
+    def _utxo_time(self, txid):
+        tx = self._transactions.get(txid)
+        if tx is not None and tx.get("time", None) is not None:
+            return tx["time"]
+        return self.gettransaction(txid, 0, full=False)["time"]
+
+    def _utxo_category(self, utxo):
+        """receive for receiving addresses, send for change"""
+        address = self._addresses.get(utxo["address"])
+        if address is not None and address.change is not None:
+            return "send" if address.change else "receive"
+        try:
+            # get category from the descriptor - recv or change
+            idx = utxo["desc"].split("[")[1].split("]")[0].split("/")[-2]
+            if idx == "0":
+                return "receive"
+        except:
+            pass
+        return "send"
+
+    def _relabel_utxo(self, addresses=None):
+        """Keeps labels of full_utxo in sync with the address list"""
+        for tx in self.full_utxo:
+            if addresses is None or tx["address"] in addresses:
+                tx["label"] = self.getlabel(tx["address"])
+
     def getdata(self):
         self.fetch_transactions()
         self.check_utxo()
@@ -669,6 +883,7 @@ class Wallet:
             o["pending_psbts"] = self.pending_psbts
             o["frozen_utxo"] = self.frozen_utxo
             o["last_block"] = self.last_block
+            o["sync_block"] = self.sync_block
         return o
 
     def save_to_file(self):
@@ -678,13 +893,11 @@ class Wallet:
     def delete_files(self):
         delete_file(self.fullpath)
         delete_file(self.fullpath + ".bkp")
-        delete_file(self._addresses.path)
-        delete_file(self._transactions.path)
-        # the folder might not exist
-        try:
-            delete_folder(self._transactions.rawdir)
-        except:
-            pass
+        self._addresses.store.delete()
+        self._transactions.store.delete()
+        self._transactions.proofs_store.delete()
+        self._transactions.rawstore.delete()
+        delete_file(self.rescan_state_path)
 
     @property
     def use_descriptors(self):
@@ -779,18 +992,8 @@ class Wallet:
             )
         self.save_to_file()
 
-    def txlist(
-        self,
-        fetch_transactions=True,
-        validate_merkle_proofs=False,
-        current_blockheight=None,
-    ):
-        """Returns a list of all transactions in the wallet's CSV cache - processed with information to display in the UI in the transactions list
-        #Parameters:
-        #    fetch_transactions (bool): Update the TxList CSV caching by fetching transactions from the Bitcoin RPC
-        #    validate_merkle_proofs (bool): Return transactions with validated_blockhash
-        #    current_blockheight (int): Current blockheight for calculating confirmations number (None will fetch the block count from the RPC)
-        """
+    def _update_txlist(self, fetch_transactions=True):
+        """Fetches transactions if requested or if some of them are not processed yet"""
         if fetch_transactions or (
             self.use_descriptors
             and len(
@@ -804,88 +1007,158 @@ class Wallet:
             != 0
         ):
             self.fetch_transactions()
+
+    def txlist(
+        self,
+        fetch_transactions=True,
+        validate_merkle_proofs=False,
+        current_blockheight=None,
+    ):
+        """Returns a list of all transactions in the wallet's CSV cache - processed with information to display in the UI in the transactions list
+        #Parameters:
+        #    fetch_transactions (bool): Update the TxList CSV caching by fetching transactions from the Bitcoin RPC
+        #    validate_merkle_proofs (bool): Return transactions with validated_blockhash
+        #    current_blockheight (int): Current blockheight for calculating confirmations number (None will fetch the block count from the RPC)
+        """
+        return self.txlist_query(
+            fetch_transactions=fetch_transactions,
+            validate_merkle_proofs=validate_merkle_proofs,
+            current_blockheight=current_blockheight,
+        )[0]
+
+    def txlist_query(
+        self,
+        search=None,
+        sortby=None,
+        sortdir="asc",
+        idx=0,
+        limit=0,
+        fetch_transactions=True,
+        validate_merkle_proofs=False,
+        current_blockheight=None,
+    ):
+        """Returns a page of the transactions list and the total number of matching transactions.
+        Only transactions on the page are processed for the UI, see txlist for other parameters.
+        #Parameters:
+        #    search (str): Only transactions with search in txid, address, label, amount, time or confirmations
+        #    sortby (str): Field to sort by (txindex.SORT_FIELDS), newest first if None
+        #    sortdir (str): "asc" or "desc"
+        #    idx (int): Page number
+        #    limit (int): Page size, 0 for all transactions
+        """
+        self._update_txlist(fetch_transactions)
         try:
-            _transactions = [
-                tx.__dict__().copy()
-                for tx in self._transactions.values()
-                if tx["ismine"]
-            ]
-            transactions = sorted(
-                _transactions, key=lambda tx: tx["time"], reverse=True
-            )
-            transactions = [
-                tx
-                for tx in transactions
-                if (
-                    not tx["conflicts"]
-                    or max(
-                        [
-                            self.gettransaction(conflicting_tx, 0, full=False)["time"]
-                            for conflicting_tx in tx["conflicts"]
-                        ]
-                    )
-                    < tx["time"]
-                )
-            ]
             if not current_blockheight:
                 current_blockheight = self.rpc.getblockcount()
-            result = []
-            blocks = {}
-            for tx in transactions:
-                if not tx.get("blockheight", 0):
-                    tx["confirmations"] = 0
-                else:
-                    tx["confirmations"] = current_blockheight - tx["blockheight"] + 1
-
-                # coinbase tx
-                if tx["category"] == "generate":
-                    if tx["confirmations"] <= 100:
-                        category = "immature"
-
-                if (
-                    tx.get("confirmations") == 0
-                    and tx.get("bip125-replaceable", "no") == "yes"
-                ):
-                    rpc_tx = self.rpc.gettransaction(tx["txid"])
-                    tx["fee"] = rpc_tx.get("fee", 1)
-                    tx["confirmations"] = rpc_tx.get("confirmations", 0)
-
-                if isinstance(tx["address"], str):
-                    tx["label"] = self.getlabel(tx["address"])
-                elif isinstance(tx["address"], list):
-                    tx["label"] = [self.getlabel(address) for address in tx["address"]]
-                else:
-                    tx["label"] = None
-
-                # TODO: validate for unique txids only
-                tx["validated_blockhash"] = ""  # default is assume unvalidated
-                if validate_merkle_proofs is True and tx["confirmations"] > 0:
-                    proof_hex = self.rpc.gettxoutproof([tx["txid"]], tx["blockhash"])
-                    logger.debug(
-                        f"Attempting merkle proof validation of tx { tx['txid'] } in block { tx['blockhash'] }"
-                    )
-                    if is_valid_merkle_proof(
-                        proof_hex=proof_hex,
-                        target_tx_hex=tx["txid"],
-                        target_block_hash_hex=tx["blockhash"],
-                        target_merkle_root_hex=None,
-                    ):
-                        # NOTE: this does NOT guarantee this blockhash is actually in the real Bitcoin blockchain!
-                        # See merkletooltip.html for details
-                        logger.debug(
-                            f"Merkle proof of { tx['txid'] } validation success"
-                        )
-                        tx["validated_blockhash"] = tx["blockhash"]
-                    else:
-                        logger.warning(
-                            f"Attempted merkle proof validation on {tx['txid']} but failed. This is likely a configuration error but perhaps your node is compromised! Details: {proof_hex}"
-                        )
-
-                result.append(tx)
-            return result
+            txids, total = self._transactions.index.query(
+                search=search,
+                sortby=sortby,
+                sortdir=sortdir,
+                idx=idx,
+                limit=limit,
+                current_blockheight=current_blockheight,
+            )
+            result = self.process_txs(
+                txids, current_blockheight, validate_merkle_proofs
+            )
+            return result, total
         except Exception as e:
             logging.error("Exception while processing txlist: {}".format(e))
-            return []
+            return [], 0
+
+    def process_txs(self, txids, current_blockheight, validate_merkle_proofs=False):
+        """Returns transactions from the cache with information to display in the UI.
+        RPC calls for unconfirmed RBF transactions and merkle proofs are batched.
+        """
+        txs = []
+        for txid in txids:
+            # labels are joined in the index, confirmations depend on the current height
+            tx = dict(self._transactions.index.display_row(txid))
+            if not tx.get("blockheight", 0):
+                tx["confirmations"] = 0
+            else:
+                tx["confirmations"] = current_blockheight - tx["blockheight"] + 1
+
+            # coinbase tx
+            if tx["category"] == "generate":
+                if tx["confirmations"] <= 100:
+                    category = "immature"
+
+            # TODO: validate for unique txids only
+            tx["validated_blockhash"] = ""  # default is assume unvalidated
+            txs.append(tx)
+
+        rbf_txs = [
+            tx
+            for tx in txs
+            if tx["confirmations"] == 0 and tx.get("bip125-replaceable", "no") == "yes"
+        ]
+        if rbf_txs:
+            res = self.rpc.multi([("gettransaction", tx["txid"]) for tx in rbf_txs])
+            for tx, r in zip(rbf_txs, res):
+                rpc_tx = r["result"] or {}
+                tx["fee"] = rpc_tx.get("fee", 1)
+                tx["confirmations"] = rpc_tx.get("confirmations", 0)
+
+        if validate_merkle_proofs is True:
+            self._validate_merkle_proofs([tx for tx in txs if tx["confirmations"] > 0])
+        return txs
+
+    def _validate_merkle_proofs(self, txs):
+        """Sets validated_blockhash of confirmed txs, proofs are validated only once per blockhash"""
+        validated = self._transactions.validated_proofs
+        unknown = []
+        for tx in txs:
+            if validated.get(tx["txid"]) == tx["blockhash"]:
+                tx["validated_blockhash"] = tx["blockhash"]
+            else:
+                unknown.append(tx)
+        if not unknown:
+            return
+        # one proof for all txs of a block
+        blocks = {}
+        for tx in unknown:
+            blocks.setdefault(tx["blockhash"], {})[tx["txid"]] = None
+        blockhashes = list(blocks)
+        res = self.rpc.multi(
+            [("gettxoutproof", list(blocks[bh]), bh) for bh in blockhashes]
+        )
+        # (txid, blockhash): proof or error
+        proofs = {}
+        errors = {}
+        retry = []
+        for blockhash, r in zip(blockhashes, res):
+            # Core fails if any of the txids is not in the block
+            if r["result"] is None and len(blocks[blockhash]) > 1:
+                retry += [(txid, blockhash) for txid in blocks[blockhash]]
+                continue
+            for txid in blocks[blockhash]:
+                proofs[(txid, blockhash)] = r["result"]
+                errors[(txid, blockhash)] = r["error"]
+        if retry:
+            res = self.rpc.multi(
+                [("gettxoutproof", [txid], blockhash) for txid, blockhash in retry]
+            )
+            for key, r in zip(retry, res):
+                proofs[key] = r["result"]
+                errors[key] = r["error"]
+        items = [
+            (tx["txid"], tx["blockhash"], proofs[(tx["txid"], tx["blockhash"])])
+            for tx in unknown
+        ]
+        logger.debug(f"Attempting merkle proof validation of {len(items)} txs")
+        valid = []
+        for tx, item, is_valid in zip(unknown, items, verify_merkle_proofs(items)):
+            if is_valid:
+                # NOTE: this does NOT guarantee this blockhash is actually in the real Bitcoin blockchain!
+                # See merkletooltip.html for details
+                tx["validated_blockhash"] = tx["blockhash"]
+                valid.append(tx)
+            else:
+                logger.warning(
+                    f"Attempted merkle proof validation on {tx['txid']} but failed. This is likely a configuration error but perhaps your node is compromised! Details: {item[2] or errors[item[:2]]}"
+                )
+        self._transactions.set_validated(valid)
 
     def gettransaction(self, txid, blockheight=None, decode=False, full=True):
         """Gets transaction from cache
@@ -924,7 +1197,7 @@ class Wallet:
         self.rpc.abandontransaction(txid)
 
     def rescanutxo(self, explorer=None, requests_session=None, only_tor=False):
-        delete_file(self._transactions.path)
+        self._transactions.clear()
         self.fetch_transactions()
         t = threading.Thread(
             target=self._rescan_utxo_thread,
@@ -956,17 +1229,31 @@ class Wallet:
         # rescan utxo is pretty fast,
         # so we can check large range of addresses
         # and adjust keypool accordingly
-        args = [
-            "start",
-            [
-                {"desc": self.recv_descriptor, "range": max(self.keypool, 1000)},
-                {
-                    "desc": self.change_descriptor,
-                    "range": max(self.change_keypool, 1000),
-                },
-            ],
+        scan_objects = [
+            {"desc": self.recv_descriptor, "range": max(self.keypool, 1000)},
+            {
+                "desc": self.change_descriptor,
+                "range": max(self.change_keypool, 1000),
+            },
         ]
-        unspents = self.rpc.scantxoutset(*args)["unspents"]
+        rescan = UtxoRescan(
+            self.rpc,
+            self.rescan_state_path,
+            explorer=explorer,
+            requests_session=requests_session,
+            only_tor=only_tor,
+        )
+        self._utxo_rescan = rescan
+        try:
+            unspents = rescan.scan(scan_objects)
+            self._adjust_keypool_to_unspents(unspents)
+            rescan.run(unspents)
+        finally:
+            rescan.progress["stage"] = "done"
+        self.fetch_transactions()
+        self.check_addresses()
+
+    def _adjust_keypool_to_unspents(self, unspents):
         # if keypool adjustments fails - not a big deal
         try:
             # check derivation indexes in found unspents (last 2 indexes in [brackets])
@@ -999,84 +1286,19 @@ class Wallet:
         except Exception as e:
             logger.warning(f"Failed to get derivation path from utxo transaction: {e}")
 
-        # keep working with unspents
-        res = self.rpc.multi([("getblockhash", tx["height"]) for tx in unspents])
-        block_hashes = [r["result"] for r in res]
-        for i, tx in enumerate(unspents):
-            tx["blockhash"] = block_hashes[i]
-        res = self.rpc.multi(
-            [("gettxoutproof", [tx["txid"]], tx["blockhash"]) for tx in unspents]
-        )
-        proofs = [r["result"] for r in res]
-        for i, tx in enumerate(unspents):
-            tx["proof"] = proofs[i]
-        res = self.rpc.multi(
-            [
-                ("getrawtransaction", tx["txid"], False, tx["blockhash"])
-                for tx in unspents
-            ]
-        )
-        raws = [r["result"] for r in res]
-        for i, tx in enumerate(unspents):
-            tx["raw"] = raws[i]
-        missing = [tx for tx in unspents if tx["raw"] is None]
-        existing = [tx for tx in unspents if tx["raw"] is not None]
-        self.rpc.multi(
-            [("importprunedfunds", tx["raw"], tx["proof"]) for tx in existing]
-        )
-        # handle missing transactions now
-        # if Tor is running, requests will be sent over Tor
-        if explorer is not None:
-            # make sure there is no trailing /
-            explorer = explorer.rstrip("/")
-            try:
-                # get raw transactions
-                raws = [
-                    requests_session.get(f"{explorer}/api/tx/{tx['txid']}/hex").text
-                    for tx in missing
-                ]
-                # get proofs
-                proofs = [
-                    requests_session.get(
-                        f"{explorer}/api/tx/{tx['txid']}/merkleblock-proof"
-                    ).text
-                    for tx in missing
-                ]
-                # import funds
-                self.rpc.multi(
-                    [
-                        ("importprunedfunds", raws[i], proofs[i])
-                        for i in range(len(raws))
-                    ]
-                )
-            except Exception as e:
-                logger.warning(f"Failed to fetch data from block explorer: {e}")
-                # retry if using requests_session failed
-                if not only_tor:
-                    try:
-                        # get raw transactions
-                        raws = [
-                            requests.get(f"{explorer}/api/tx/{tx['txid']}/hex").text
-                            for tx in missing
-                        ]
-                        # get proofs
-                        proofs = [
-                            requests.get(
-                                f"{explorer}/api/tx/{tx['txid']}/merkleblock-proof"
-                            ).text
-                            for tx in missing
-                        ]
-                        # import funds
-                        self.rpc.multi(
-                            [
-                                ("importprunedfunds", raws[i], proofs[i])
-                                for i in range(len(raws))
-                            ]
-                        )
-                    except:
-                        logger.warning(f"Failed to fetch data from block explorer: {e}")
-        self.fetch_transactions()
-        self.check_addresses()
+    @property
+    def rescan_state_path(self):
+        return rescan_state_path(self.fullpath)
+
+    @property
+    def utxo_rescan_progress(self):
+        """Returns None if no utxo rescan is running,
+        stage, progress in % and counts of transactions otherwise
+        """
+        rescan = getattr(self, "_utxo_rescan", None)
+        if rescan is None or not rescan.active:
+            return None
+        return dict(rescan.progress, progress=rescan.percent)
 
     @property
     def rescan_progress(self):
@@ -1135,16 +1357,32 @@ class Wallet:
         return address
 
     def get_address(self, index, change=False, check_keypool=True):
+        return self.get_addresses(
+            index, index + 1, change=change, check_keypool=check_keypool
+        )[0]
+
+    def get_addresses(self, start, end, change=False, check_keypool=True):
+        """Returns addresses with indexes in range(start, end).
+        Addresses from the address list are used as is, others are derived
+        with a cached deriver of the wallet descriptor.
+        """
+        if end <= start:
+            return []
         if check_keypool:
             pool = self.change_keypool if change else self.keypool
-            if pool < index + self.GAP_LIMIT:
-                self.keypoolrefill(pool, index + self.GAP_LIMIT, change=change)
-        desc = self.change_descriptor if change else self.recv_descriptor
-        return (
-            LDescriptor.from_string(desc)
-            .derive(index)
-            .address(get_network(self.manager.chain))
-        )
+            if pool < end - 1 + self.GAP_LIMIT:
+                self.keypoolrefill(pool, end - 1 + self.GAP_LIMIT, change=change)
+        addresses = [
+            self._addresses.get_by_index(idx, change) for idx in range(start, end)
+        ]
+        if None in addresses:
+            desc = self.change_descriptor if change else self.recv_descriptor
+            deriver = get_address_deriver(desc, self.manager.chain)
+            addresses = [
+                address or deriver.address(start + i)
+                for i, address in enumerate(addresses)
+            ]
+        return addresses
 
     def get_descriptor(self, index=None, change=False, address=None):
         """
@@ -1254,32 +1492,84 @@ class Wallet:
         return to_return
 
     def get_balance(self):
+        """
+        Returns the balance of the wallet with the available (not locked) part.
+        The balance is recalculated only if the utxo state (chain tip,
+        wallet transactions and balances, locked outpoints) changed.
+        """
         try:
+            self.check_utxo()
+            if (
+                self._balance_state_key is not None
+                and self._balance_state_key == self._utxo_state_key
+            ):
+                return self.balance
+            state = self._utxo_state_key
             balance = (
                 self.rpc.getbalances()["mine"]
                 if self.use_descriptors
                 else self.rpc.getbalances()["watchonly"]
             )
             # calculate available balance
-            locked_utxo = self.rpc.listlockunspent()
             available = {}
             available.update(balance)
-            for tx in locked_utxo:
-                tx_data = self.gettransaction(tx["txid"])
-                raw_tx = decoderawtransaction(tx_data["hex"], self.manager.chain)
-                delta = raw_tx["vout"][tx["vout"]]["value"]
-                if "confirmations" not in tx_data or tx_data["confirmations"] == 0:
-                    available["untrusted_pending"] -= delta
+            for value, confirmed in self._locked_values().values():
+                if confirmed:
+                    available["trusted"] -= value
                 else:
-                    available["trusted"] -= delta
-                    available["trusted"] = round(available["trusted"], 8)
+                    available["untrusted_pending"] -= value
+            available["trusted"] = round(available["trusted"], 8)
             available["untrusted_pending"] = round(available["untrusted_pending"], 8)
             balance["available"] = available
         except Exception as e:
+            self._balance_state_key = None
             raise SpecterError(f"was not able to get wallet_balance because {e}")
         self.balance = balance
+        self._balance_state_key = state
         return self.balance
 
+    def _psbt_input_values(self):
+        """outpoint -> value of inputs of pending PSBTs"""
+        values = {}
+        for psbt in self.pending_psbts.values():
+            for vin, inp in zip(psbt["tx"]["vin"], psbt.get("inputs", [])):
+                value = inp.get("witness_utxo", {}).get("amount", 0) or inp.get(
+                    "value", 0
+                )
+                if value:
+                    values[f"{vin['txid']}:{vin['vout']}"] = value
+        return values
+
+    def _locked_values(self):
+        """
+        outpoint -> (value, confirmed) of locked outpoints.
+        Values come from the utxo set or inputs of pending PSBTs,
+        the transaction is only requested for outpoints missing in both.
+        """
+        values = {}
+        psbt_values = None
+        for outpoint in self._locked_outpoints:
+            utxo = self._utxo.get(outpoint)
+            if utxo is not None:
+                values[outpoint] = (utxo["amount"], utxo["confirmations"] > 0)
+                continue
+            if psbt_values is None:
+                psbt_values = self._psbt_input_values()
+            txid, vout = outpoint.split(":")
+            tx_data = self.gettransaction(
+                txid, 0, full=False, decode=outpoint not in psbt_values
+            )
+            if tx_data is None:
+                # unknown transaction, already logged by gettransaction
+                continue
+            value = psbt_values.get(outpoint)
+            if value is None:
+                value = tx_data["vout"][int(vout)]["value"]
+            # cached transactions have no confirmations, only the block
+            confirmed = bool(tx_data.get("blockhash") or tx_data.get("blockheight"))
+            values[outpoint] = (value, confirmed)
+        return values
+
     def keypoolrefill(self, start, end=None, change=False):
         if end is None:
             # end is ignored for descriptor wallets
@@ -1302,12 +1592,10 @@ class Wallet:
 
         try:
             addresses = [
-                dict(
-                    address=self.get_address(idx, change=change, check_keypool=False),
-                    index=idx,
-                    change=change,
+                dict(address=address, index=start + i, change=change)
+                for i, address in enumerate(
+                    self.get_addresses(start, end, change=change, check_keypool=False)
                 )
-                for idx in range(start, end)
             ]
             self._addresses.add(addresses, check_rpc=False)
         except Exception as e:
@@ -1330,6 +1618,9 @@ class Wallet:
     def setlabel(self, address, label):
         self._addresses.set_label(address, label)
 
+    def setlabels(self, labels):
+        self._addresses.set_labels(labels)
+
     def getlabel(self, address):
         if address in self._addresses:
             return self._addresses[address].label
@@ -1360,16 +1651,18 @@ class Wallet:
         balance = self.available_balance
         return balance["trusted"] + balance["untrusted_pending"]
 
+    @property
+    def cache_stats(self):
+        """Hit/miss counters of the in-memory transaction caches"""
+        return self._transactions.cache_stats
+
     @property
     def addresses(self):
-        return [self.get_address(idx) for idx in range(0, self.address_index + 1)]
+        return self.get_addresses(0, self.address_index + 1)
 
     @property
     def change_addresses(self):
-        return [
-            self.get_address(idx, change=True)
-            for idx in range(0, self.change_index + 1)
-        ]
+        return self.get_addresses(0, self.change_index + 1, change=True)
 
     @property
     def wallet_addresses(self):
@@ -1387,15 +1680,19 @@ class Wallet:
         rbf=True,
         existing_psbt=None,
         rbf_edit_mode=False,
+        inputs=None,
     ):
         """
         fee_rate: in sat/B or BTC/kB. If set to 0 Bitcoin Core sets feeRate automatically.
+        inputs: already selected inputs ({"txid", "vout"}), Core doesn't add more.
         """
         if fee_rate > 0 and fee_rate < self.MIN_FEE_RATE:
             fee_rate = self.MIN_FEE_RATE
 
         options = {"includeWatching": True, "replaceable": rbf}
         extra_inputs = []
+        local_selection = False
+        selection = None
 
         if not existing_psbt:
             if not rbf_edit_mode:
@@ -1404,14 +1701,22 @@ class Wallet:
                         f"Wallet {self.name} does not have sufficient funds to make the transaction."
                     )
 
-            if selected_coins != []:
+            if inputs:
+                extra_inputs = inputs
+                local_selection = True
+            elif selected_coins != []:
                 still_needed = sum(amounts)
                 for coin in selected_coins:
                     coin_txid = coin.split(",")[0]
                     coin_vout = int(coin.split(",")[1])
-                    coin_amount = self.gettransaction(coin_txid, decode=True)["vout"][
-                        coin_vout
-                    ]["value"]
+                    utxo = self._utxo.get(f"{coin_txid}:{coin_vout}")
+                    if utxo is not None:
+                        coin_amount = utxo["amount"]
+                    else:
+                        # not in the utxo set, i.e. spent by the tx we replace
+                        coin_amount = self.gettransaction(coin_txid, decode=True)[
+                            "vout"
+                        ][coin_vout]["value"]
                     extra_inputs.append({"txid": coin_txid, "vout": coin_vout})
                     still_needed -= coin_amount
                     if still_needed < 0:
@@ -1421,13 +1726,20 @@ class Wallet:
                         "Selected coins does not cover Full amount! Please select more coins!"
                     )
             elif self.available_balance["trusted"] <= sum(amounts):
-                txlist = self.rpc.listunspent(0, 0)
+                self.check_utxo()
+                txlist = [utxo for utxo in self.utxo if utxo["confirmations"] == 0]
                 b = sum(amounts) - self.available_balance["trusted"]
                 for tx in txlist:
                     extra_inputs.append({"txid": tx["txid"], "vout": tx["vout"]})
                     b -= tx["amount"]
                     if b < 0:
                         break
+            elif COIN_SELECTION != "core" and fee_rate > 0 and not subtract:
+                selection = self.select_coins(addresses, amounts, fee_rate)
+                if selection is not None:
+                    logger.debug(f"Selected coins locally: {selection}")
+                    extra_inputs = selection.inputs
+                    local_selection = True
 
             # subtract fee from amount of this output:
             # currently only one address is supported, so either
@@ -1442,7 +1754,7 @@ class Wallet:
             }
 
             if self.manager.bitcoin_core_version_raw >= 210000:
-                options["add_inputs"] = selected_coins == []
+                options["add_inputs"] = selected_coins == [] and not local_selection
 
             if fee_rate > 0:
                 # bitcoin core needs us to convert sat/B to BTC/kB
@@ -1457,7 +1769,7 @@ class Wallet:
             )
 
             b64psbt = r["psbt"]
-            psbt = self.rpc.decodepsbt(b64psbt)
+            psbt = self.decodepsbt(b64psbt)
         else:
             psbt = existing_psbt
             extra_inputs = [
@@ -1468,14 +1780,24 @@ class Wallet:
             if "base64" in psbt:
                 b64psbt = psbt["base64"]
 
-        if fee_rate > 0.0:
+        adjusted_b64psbt = None
+        if fee_rate > 0.0 and not existing_psbt:
+            adjusted_b64psbt = self._add_missing_fee(
+                b64psbt,
+                psbt,
+                fee_rate,
+                addresses[subtract_from] if subtract else options["changeAddress"],
+                drop_change=local_selection and not subtract,
+            )
+        if adjusted_b64psbt is not None:
+            if adjusted_b64psbt != b64psbt:
+                b64psbt = adjusted_b64psbt
+                psbt = self.decodepsbt(b64psbt)
+            psbt["fee_rate"] = "%.8f" % round((fee_rate * 1000) / 1e8, 8)
+        elif fee_rate > 0.0:
             if not existing_psbt:
                 psbt_fees_sats = int(psbt["fee"] * 1e8)
-                # estimate final size: add weight of inputs
-                tx_full_size = ceil(
-                    psbt["tx"]["vsize"]
-                    + len(psbt["inputs"]) * self.weight_per_input / 4
-                )
+                tx_full_size = self.estimate_full_size(psbt)
                 adjusted_fee_rate = (
                     fee_rate
                     * (fee_rate / (psbt_fees_sats / psbt["tx"]["vsize"]))
@@ -1484,6 +1806,9 @@ class Wallet:
                 options["feeRate"] = "%.8f" % round((adjusted_fee_rate * 1000) / 1e8, 8)
             else:
                 options["feeRate"] = "%.8f" % round((fee_rate * 1000) / 1e8, 8)
+            if selection is not None and "add_inputs" in options:
+                # the higher fee rate may need more than the coins we selected
+                options["add_inputs"] = True
             r = self.rpc.walletcreatefundedpsbt(
                 extra_inputs,  # inputs
                 [{addresses[i]: amounts[i]} for i in range(len(addresses))],  # output
@@ -1493,13 +1818,9 @@ class Wallet:
             )
 
             b64psbt = r["psbt"]
-            psbt = self.rpc.decodepsbt(b64psbt)
+            psbt = self.decodepsbt(b64psbt)
             psbt["fee_rate"] = options["feeRate"]
-        # estimate full size
-        tx_full_size = ceil(
-            psbt["tx"]["vsize"] + len(psbt["inputs"]) * self.weight_per_input / 4
-        )
-        psbt["tx_full_size"] = tx_full_size
+        psbt["tx_full_size"] = self.estimate_full_size(psbt)
 
         psbt["base64"] = b64psbt
         psbt["amount"] = amounts
@@ -1511,6 +1832,91 @@ class Wallet:
 
         return psbt
 
+    def select_coins(self, addresses, amounts, fee_rate, algorithm=None, exclude=()):
+        """
+        Selects confirmed coins of the utxo set for the outputs locally,
+        see util/coin_selection.py. Outpoints ("txid:vout") in exclude are skipped.
+        Returns a Selection or None.
+        """
+        self.check_utxo()
+        algorithm = algorithm or COIN_SELECTION
+        if algorithm == "core":
+            algorithm = "auto"
+        input_vsize = INPUT_BASE_VSIZE + self.weight_per_input / 4
+        coins = [
+            Coin.from_utxo(utxo, input_vsize)
+            for utxo in self.utxo
+            if utxo["confirmations"] > 0
+            and f"{utxo['txid']}:{utxo['vout']}" not in exclude
+        ]
+        outputs_vsize = sum(self.output_vsize(address) for address in addresses)
+        # coins and the target are sized for the signed transaction,
+        # so the fee covers estimate_full_size of the PSBT even without change
+        target = round(sum(amounts) * 1e8) + ceil(
+            fee_rate * (TX_OVERHEAD_VSIZE + outputs_vsize)
+        )
+        # creating the change output now and spending it later
+        cost_of_change = ceil(fee_rate * self.output_vsize(self.change_address)) + ceil(
+            LONG_TERM_FEE_RATE * input_vsize
+        )
+        return select_coins(coins, target, fee_rate, cost_of_change, algorithm)
+
+    @staticmethod
+    def output_vsize(address):
+        """vsize of an output to the address: value, script length and script"""
+        return 9 + len(script.address_to_scriptpubkey(address).data)
+
+    def decodepsbt(self, b64psbt):
+        """Decodes the PSBT locally, falls back to Bitcoin Core"""
+        try:
+            return decodepsbt(b64psbt, self.manager.chain)
+        except Exception as e:
+            logger.warning(f"Failed to decode PSBT locally, asking Core. Error: {e}")
+            return self.rpc.decodepsbt(b64psbt)
+
+    def estimate_full_size(self, psbt):
+        """Estimates vsize of the signed transaction of the decoded PSBT"""
+        return ceil(
+            psbt["tx"]["vsize"] + len(psbt["inputs"]) * self.weight_per_input / 4
+        )
+
+    def _add_missing_fee(self, b64psbt, psbt, fee_rate, address, drop_change=False):
+        """
+        Core doesn't always account for signatures of watch-only inputs.
+        Takes the missing fee for the full size from the output to address
+        (change or the output fees are subtracted from) so no second
+        walletcreatefundedpsbt call is needed.
+        With drop_change the output to address is removed if it would become dust,
+        i.e. inputs were selected locally for the full size without change.
+        Returns the base64 PSBT or None if the fee can't be adjusted locally.
+        """
+        if "fee" not in psbt:
+            return None
+        full_size = self.estimate_full_size(psbt)
+        fee = round(psbt["fee"] * 1e8)
+        missing = ceil(fee_rate * full_size) - fee
+        if missing <= 0:
+            return b64psbt
+        for i, vout in enumerate(psbt["tx"]["vout"]):
+            spk = vout["scriptPubKey"]
+            if address == spk.get("address") or address in spk.get("addresses", []):
+                break
+        else:
+            return None
+        embit_psbt = PSBT.from_string(b64psbt)
+        output = embit_psbt.outputs[i]
+        if output.value - missing >= self.DUST_LIMIT:
+            output.value -= missing
+            return embit_psbt.to_string()
+        if not drop_change:
+            return None
+        # the change goes to the fee, the transaction gets smaller without it
+        size = full_size - 9 - len(output.script_pubkey.data)
+        if fee + output.value < ceil(fee_rate * size):
+            return None
+        embit_psbt.outputs.pop(i)
+        return embit_psbt.to_string()
+
     def get_rbf_utxo(self, rbf_tx_id):
         decoded_tx = self.decode_tx(rbf_tx_id)
         selected_coins = [
@@ -1657,8 +2063,9 @@ class Wallet:
                     continue
                 txid = inp.txid.hex()
                 try:
-                    res = self.gettransaction(txid)
-                    inp.non_witness_utxo = Transaction.from_string(res["hex"])
+                    # blockheight=0 - we only need the transaction, not confirmations
+                    self._transactions.gettransaction(txid, 0, full=False)
+                    inp.non_witness_utxo = self._transactions.get_tx(txid)
                 except Exception as e:
                     logger.error(
                         f"Can't find previous transaction in the wallet. Signing might not be possible for certain devices... Txid: {txid}, Exception: {e}"
@@ -1783,14 +2190,7 @@ class Wallet:
 
         for addr in addresses_cache:
 
-            addr_utxo = 0
-            addr_amount = 0
-
-            for utxo in [
-                utxo for utxo in self.full_utxo if utxo["address"] == addr.address
-            ]:
-                addr_amount = addr_amount + utxo["amount"]
-                addr_utxo = addr_utxo + 1
+            addr_utxo, addr_amount = self.utxo_on_address(addr.address)
 
             addresses_info.append(
                 {
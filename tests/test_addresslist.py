@@ -0,0 +1,57 @@
+import os
+
+from embit.liquid.addresses import address
+from embit.liquid.networks import NETWORKS
+from embit.ec import PrivateKey
+from embit.script import Script
+
+from cryptoadvance.specter.addresslist import AddressList
+from cryptoadvance.specter.liquid.addresslist import LAddressList
+
+SCRIPT = Script(bytes.fromhex("0014" + "11" * 20))
+BLINDING_KEY = PrivateKey(b"\x22" * 32).get_public_key()
+
+
+def test_addresslist_by_script(tmp_path):
+    path = os.path.join(tmp_path, "wallet_addr.csv")
+    addresses = AddressList(path, None)
+    addr = SCRIPT.address(NETWORKS["regtest"])
+    addresses.add([{"address": addr, "index": 0, "change": False}])
+    assert addresses.get_by_script(SCRIPT.data).address == addr
+    assert addresses.get_by_address(addr).index == 0
+    assert addresses.get("bcrt1invalid") is None
+    assert "bcrt1invalid" not in addresses
+    # new addresses are added to the index
+    other = Script(bytes.fromhex("0014" + "22" * 20))
+    addresses.add([{"address": other.address(NETWORKS["regtest"]), "index": 1}])
+    assert addresses.get_by_script(other.data).index == 1
+    # loaded from storage
+    addresses = AddressList(path, None)
+    assert addresses.get_by_script(SCRIPT.data).address == addr
+
+
+class FakeRPC:
+    def __init__(self):
+        self.calls = []
+
+    def multi(self, calls):
+        self.calls.append(calls)
+
+
+def test_laddresslist(tmp_path):
+    addresses = LAddressList(os.path.join(tmp_path, "wallet_addr.csv"), FakeRPC())
+    net = NETWORKS["elementsregtest"]
+    conf = address(SCRIPT, BLINDING_KEY, net)
+    unconf = address(SCRIPT, None, net)
+    addresses.add([{"address": conf, "index": 0, "change": False}])
+    assert addresses[conf].unconfidential == unconf
+    assert addresses[conf].is_confidential
+    # unconfidential lookups find the confidential address
+    assert unconf in addresses
+    assert addresses[unconf].address == conf
+    assert addresses.get(unconf).index == 0
+    assert "Fee" not in addresses
+    # labels set by unconfidential address are saved for the stored address
+    addresses.set_labels({unconf: "Savings"})
+    assert addresses[conf].label == "Savings"
+    assert addresses.rpc.calls == [[("setlabel", conf, "Savings")]]
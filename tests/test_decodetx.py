@@ -1,4 +1,11 @@
+from embit.networks import NETWORKS
+from embit.script import Script
+from embit.transaction import Transaction
+
 from cryptoadvance.specter.util.tx import *
+from cryptoadvance.specter.util.tx import _address_cache
+
+LEGACY_TX = "020000000191f381c648c70f2388cce607f5955fe6b9f0b50a49c9bfa618413f931e55cf16000000006a4730440220543b92a31ed7cd00781cdce8cac4ef37fbfdce30a9dfc1f8e00a77f2dd35a2ec02201eb21ec97126f0dad8f0f066e0ae1cf44de8a3027caa99b819511ec57ba632c70121020f9c0041942551b00abcf1ba8d00f6ac93e67ddb378eecd0fb240a9ef3ddc9c0ffffffff0182480a010000000017a9143524696d526f50ab583c829bcca02553af9c64fa8700000000"
 
 
 def test_decoderawtransaction():
@@ -21,3 +28,99 @@ def test_decoderawtransaction():
     assert res["size"] == 189
     assert res["vsize"] == 189
     assert res["weight"] == 756
+
+
+def test_raw_transaction():
+    hextx = "02000000000101902666609a245e45e426ead256ad47dca8a2b4dd65d1a634ad35b4a1c0603c0e0000000017160014c08fd0c4658b89678b9e0726838c2c2c2f41c3dffeffffff02b44d5a0300000000160014f81b3e69f5cafc2f1e69ed5625d07876e3558e6900e1f50500000000160014255fe80139657184c1de8e04f71c74c667dd7c3f02473044022038a29d1958d295a9739798c1a5f138404711d824f3bf103221d31bcbc11ff0010220635b4996de17290980c78e3de2547717de119e8312a52eb54fce73c27728c5e00121020356c34dd0931251a6e306704a912dbfeedb0f550a30a89689a1c8434cefa91000000000"
+    tx = RawTransaction.from_string(hextx, "regtest")
+    assert tx["txid"] == Transaction.from_string(hextx).txid().hex()
+    assert tx["hash"] != tx["txid"]
+    assert tx["locktime"] == 0
+    # inputs and outputs are decoded on first access
+    assert "vout" not in tx._data
+    assert tx["vin"][0]["sequence"] == 0xFFFFFFFE
+    assert tx["vin"][0]["txinwitness"][1].startswith("020356c3")
+    assert tx["vout"][1] == {
+        "value": 1.0,
+        "scriptPubKey": {"hex": "0014255fe80139657184c1de8e04f71c74c667dd7c3f"},
+        "address": "bcrt1qy407sqfev4ccfsw73cz0w8r5cena6lplsfywgq",
+        "n": 1,
+    }
+    assert list(dict(tx)) == list(decoderawtransaction(hextx, "regtest"))
+    # legacy tx - txid is the hash
+    tx = RawTransaction.from_string(LEGACY_TX)
+    assert tx["txid"] == tx["hash"]
+    assert "txinwitness" not in tx["vin"][0]
+    try:
+        RawTransaction.from_string(LEGACY_TX + "00")
+        assert False, "trailing data"
+    except ValueError:
+        pass
+
+
+def test_script_to_address():
+    script = bytes.fromhex("a9143524696d526f50ab583c829bcca02553af9c64fa87")
+    address = Script(script).address(NETWORKS["main"])
+    assert script_to_address(script, "main") == address
+    assert script_to_address(script, "regtest").startswith("2")
+    # OP_RETURN has no address
+    assert script_to_address(b"\x6a\x01\x00", "main") is None
+    hits = _address_cache.hits
+    assert script_to_address(script, "main") == address
+    assert _address_cache.hits == hits + 1
+
+
+# one p2wpkh input with derivation, p2wpkh and OP_RETURN outputs, 10000 sat fee
+B64PSBT = "cHNidP8BAF4CAAAAAQAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAD/////ApBfAQAAAAAAFgAUxPfiZuLD/MzSJDuRbyo5pgQIn50AAAAAAAAAAANqAQAAAAAAAAEBH6CGAQAAAAAAFgAUxPfiZuLD/MzSJDuRbyo5pgQIn50iBgPm1aRSF/d1QTnKKwhy+ZT1dEW8dmKeBqnLIzgaFmtlUxhynA2FVAAAgAEAAIAAAACAAAAAAAEAAAAAAAA="
+
+
+def test_decodepsbt():
+    res = decodepsbt(B64PSBT, "regtest")
+    assert res["fee"] == 0.0001
+    assert res["tx"]["vsize"] == 94
+    assert len(res["tx"]["vin"]) == 1
+    out = res["tx"]["vout"][0]
+    assert out["value"] == 0.0009
+    assert out["scriptPubKey"]["type"] == "witness_v0_keyhash"
+    assert (
+        out["scriptPubKey"]["address"] == "bcrt1qcnm7yehzc07ve53y8wgk723e5czq38uav6qr2t"
+    )
+    assert res["tx"]["vout"][1]["scriptPubKey"]["type"] == "nulldata"
+    inp = res["inputs"][0]
+    assert inp["witness_utxo"]["amount"] == 0.001
+    assert inp["bip32_derivs"] == [
+        {
+            "pubkey": "03e6d5a45217f7754139ca2b0872f994f57445bc76629e06a9cb23381a166b6553",
+            "master_fingerprint": "729c0d85",
+            "path": "m/84'/1'/0'/0/1",
+        }
+    ]
+    assert res["outputs"] == [{}, {}]
+
+
+def test_add_missing_fee():
+    from cryptoadvance.specter.wallet import Wallet
+
+    wallet = Wallet.__new__(Wallet)
+    wallet.keys = [None]
+    wallet.recv_descriptor = "wpkh(...)"
+    psbt = decodepsbt(B64PSBT, "regtest")
+    change = "bcrt1qcnm7yehzc07ve53y8wgk723e5czq38uav6qr2t"
+    # 94 vbytes + 109 / 4 for the signature
+    assert wallet.estimate_full_size(psbt) == 122
+    # Core already paid enough
+    assert wallet._add_missing_fee(B64PSBT, psbt, 5, change) == B64PSBT
+    # the missing fee is taken from the change output
+    res = decodepsbt(wallet._add_missing_fee(B64PSBT, psbt, 100, change), "regtest")
+    assert res["fee"] == 0.000122
+    assert res["tx"]["vout"][0]["value"] == 0.000878
+    # no such output or it would become dust
+    assert wallet._add_missing_fee(B64PSBT, psbt, 100, "bcrt1qother") is None
+    assert wallet._add_missing_fee(B64PSBT, psbt, 1000, change) is None
+    # inputs selected for the full size without change - dust change goes to the fee
+    res = wallet._add_missing_fee(B64PSBT, psbt, 1000, change, drop_change=True)
+    res = decodepsbt(res, "regtest")
+    assert res["fee"] == 0.001
+    assert [out["scriptPubKey"]["type"] for out in res["tx"]["vout"]] == ["nulldata"]
+    # not even enough without the change output
+    assert wallet._add_missing_fee(B64PSBT, psbt, 1200, change, True) is None
@@ -0,0 +1,91 @@
+import os
+
+from embit.liquid.transaction import (
+    LTransaction,
+    LTransactionInput,
+    LTransactionOutput,
+)
+from embit.script import Script
+
+from cryptoadvance.specter.addresslist import AddressList
+from cryptoadvance.specter.liquid.rpc import UNBLINDED_CACHE_SIZE, LiquidRPC
+from cryptoadvance.specter.liquid.txlist import LTxList
+
+ASSET = bytes(33)
+# explicit output and fee
+TX = LTransaction(
+    vin=[LTransactionInput(bytes(32), 0)],
+    vout=[
+        LTransactionOutput(ASSET, 1000, Script(bytes.fromhex("0014" + "11" * 20))),
+        LTransactionOutput(ASSET, 100, Script(b"")),
+    ],
+)
+TXID = TX.txid().hex()
+
+
+class FakeLiquidRPC(LiquidRPC):
+    def __init__(self, port):
+        super().__init__(host="elements", port=port)
+        self.calls = []
+        self.unblinded_txs = 0
+
+    def multi(self, calls, **kwargs):
+        res = []
+        for method, *args in calls:
+            self.calls.append(method)
+            result = None
+            if method == "getblockchaininfo":
+                result = {"chain": "liquidregtest"}
+            elif method == "decoderawtransaction":
+                result = {
+                    "txid": TXID,
+                    "vout": [{"scriptPubKey": {}}, {"scriptPubKey": {}}],
+                }
+            elif method == "unblindrawtransaction":
+                result = {"hex": args[0]}
+            elif method == "dumpmasterblindingkey":
+                result = "11" * 32
+            res.append({"result": result, "error": None})
+        return res
+
+    def _unblind_outputs(self, b):
+        self.unblinded_txs += 1
+        return super()._unblind_outputs(b)
+
+
+def test_decoderawtransaction_cache():
+    rpc = FakeLiquidRPC(port=17041)
+    obj = rpc.decoderawtransaction(str(TX))
+    assert obj["vout"][0]["value"] == 0.00001
+    assert obj["vout"][0]["asset"] == "00" * 32
+    assert obj["fee"] == 0.000001
+    obj = rpc.decoderawtransaction(str(TX))
+    assert obj["vout"][0]["value"] == 0.00001
+    assert rpc.unblinded_txs == 1
+    # the fallback cache is bounded
+    assert len(rpc._unblinded) == 2
+    assert rpc._unblinded.maxsize == UNBLINDED_CACHE_SIZE
+    # network is requested once per node
+    wallet_rpc = FakeLiquidRPC(port=17041)
+    wallet_rpc.decoderawtransaction(str(TX))
+    assert rpc.calls.count("getblockchaininfo") == 1
+    assert "getblockchaininfo" not in wallet_rpc.calls
+    # blinding keys are derived once per scriptPubKey
+    script = TX.vout[0].script_pubkey
+    assert rpc.blinding_key(script) is rpc.blinding_key(script)
+
+
+def test_unblinded_outputs(tmp_path):
+    addresses = AddressList(os.path.join(tmp_path, "wallet_addr.csv"), None)
+    path = os.path.join(tmp_path, "wallet_txs.csv")
+    rpc = FakeLiquidRPC(port=17042)
+    txlist = LTxList(path, rpc, addresses, "liquidregtest")
+    assert txlist.decoderawtransaction(str(TX))["vout"][0]["value"] == 0.00001
+    # results are persisted and loaded by a new instance
+    rpc = FakeLiquidRPC(port=17042)
+    txlist = LTxList(path, rpc, addresses, "liquidregtest")
+    assert txlist.unblinded_outputs[(TXID, 0)]["value"] == 0.00001
+    assert txlist.unblinded_outputs[(TXID, 0)]["addresses"][0].startswith("ert1")
+    assert txlist.unblinded_outputs[(TXID, 1)]["addresses"] == ["Fee"]
+    assert txlist.decoderawtransaction(str(TX))["vout"][0]["value"] == 0.00001
+    assert rpc.unblinded_txs == 0
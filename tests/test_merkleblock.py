@@ -6,7 +6,12 @@ from cryptoadvance.specter.util.merkleblock import (
     MerkleTree,
     Block,
     MerkleBlock,
+    MerkleProofVerifier,
+    build_merkle_proof,
+    hash256,
+    is_valid_merkle_proof,
     little_endian_to_int,
+    merkle_root,
 )
 
 
@@ -240,3 +245,55 @@ class MerkleTreeTest(TestCase):
         tree.populate_tree([1] * 11, hashes)
         root = "a8e8bd023169b81bc56854137a135b97ef47a6a7237f4c6e037baed16285a5ab"
         self.assertEqual(tree.root().hex(), root)
+
+
+class MerkleProofVerifierTest(TestCase):
+    def make_block(self, count, seed=0):
+        txids = [
+            hash256(bytes([seed, i % 256, i // 256]))[::-1].hex() for i in range(count)
+        ]
+        root = merkle_root([bytes.fromhex(txid)[::-1] for txid in txids])
+        header = bytes(36) + root + bytes(12)
+        return header, hash256(header)[::-1].hex(), txids
+
+    def test_verify(self):
+        header, blockhash, txids = self.make_block(11)
+        verifier = MerkleProofVerifier()
+        items = []
+        for txid in txids[:3]:
+            proof = build_merkle_proof(header, txids, [txid])
+            self.assertTrue(is_valid_merkle_proof(proof, txid, blockhash))
+            items.append((txid, blockhash, proof))
+        # one proof for several txs of the block
+        proof = build_merkle_proof(header, txids, txids[5:])
+        items += [(txid, blockhash, proof) for txid in txids[5:]]
+        # not in the proof, wrong block
+        items.append((txids[4], blockhash, proof))
+        items.append((txids[0], "00" * 32, items[0][2]))
+        self.assertEqual(verifier.verify(items), [True] * 9 + [False, False])
+        # valid results are cached
+        self.assertEqual(verifier.verify([(txids[1], blockhash, None)]), [True])
+
+    def test_verify_invalid(self):
+        header, blockhash, txids = self.make_block(11)
+        verifier = MerkleProofVerifier()
+        proof = build_merkle_proof(header, txids, [txids[0]])
+        self.assertEqual(verifier.verify([(txids[0], blockhash, proof)]), [True])
+        # a made up transaction can't reuse verified branches of the block
+        fake = list(txids)
+        fake[7] = "11" * 32
+        proof = build_merkle_proof(header, fake, [fake[7]])
+        self.assertEqual(verifier.verify([(fake[7], blockhash, proof)]), [False])
+        # tampered hash and truncated proof
+        proof = build_merkle_proof(header, txids, [txids[3]])
+        tampered = proof[:170] + ("1" if proof[170] == "0" else "0") + proof[171:]
+        items = [(txids[3], blockhash, tampered), (txids[3], blockhash, proof[:-2])]
+        self.assertEqual(MerkleProofVerifier().verify(items), [False, False])
+        # duplicated last transactions (CVE-2012-2459)
+        header, blockhash, txids = self.make_block(3)
+        txids = txids + txids[-1:]
+        root = merkle_root([bytes.fromhex(txid)[::-1] for txid in txids])
+        header = bytes(36) + root + bytes(12)
+        blockhash = hash256(header)[::-1].hex()
+        proof = build_merkle_proof(header, txids, [txids[3]])
+        self.assertEqual(verifier.verify([(txids[3], blockhash, proof)]), [False])
@@ -1,5 +1,12 @@
 import os
-from cryptoadvance.specter.persistence import write_devices, write_device, write_wallet
+from cryptoadvance.specter import persistence
+from cryptoadvance.specter.persistence import (
+    read_json_file,
+    write_devices,
+    write_device,
+    write_json_file,
+    write_wallet,
+)
 from cryptoadvance.specter.key import Key
 import json
 
@@ -34,6 +41,8 @@ def test_write_devices(app, monkeypatch, caplog):
     monkeypatch.setenv("SPECTER_PERSISTENCE_CALLBACK", "ThisWillFail")
     write_devices(devices_json)
     assert count_files_in(app.specter.device_manager.data_folder) == 5
+    # callbacks run in the background
+    persistence.flush()
     assert "callback failed stdout:" in caplog.text
 
 
@@ -54,6 +63,7 @@ def test_write_wallet(app, monkeypatch, caplog):
     monkeypatch.setenv("SPECTER_PERSISTENCE_CALLBACK", "ThisWillFail")
     write_wallet(wallet_json)
     assert count_files_in(app.specter.wallet_manager.working_folder) == 1
+    persistence.flush()
     assert "callback failed stdout:" in caplog.text
 
 
@@ -79,3 +89,58 @@ def test_write_device(app):
         "/tmp/delete_me_test_file.json",
     )
     os.remove("/tmp/delete_me_test_file.json")
+
+
+def test_write_json_file_coalesced(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        persistence, "storage_callback", lambda paths=None: calls.append(paths)
+    )
+    path = os.path.join(tmp_path, "wallet.json")
+    # new files are written immediately
+    write_json_file({"blockheight": 0}, path)
+    assert len(calls) == 1
+    for i in range(1, 10):
+        write_json_file({"blockheight": i}, path)
+    # the file is not touched yet but reads get the latest content
+    with open(path) as f:
+        assert json.load(f) == {"blockheight": 0}
+    assert read_json_file(path) == {"blockheight": 9}
+    persistence.flush()
+    # one write and one callback for all updates
+    assert calls[-1] == [path]
+    with open(path) as f:
+        assert json.load(f) == {"blockheight": 9}
+    with open(path + ".bkp") as f:
+        assert json.load(f) == {"blockheight": 0}
+    assert not os.path.isfile(path + ".tmp")
+    # pending writes of deleted files are dropped
+    write_json_file({"blockheight": 10}, path)
+    persistence.delete_file(path)
+    persistence.flush()
+    assert not os.path.isfile(path)
+
+
+def test_storage_callback_debounced(tmp_path, monkeypatch):
+    out = os.path.join(tmp_path, "callback.out")
+    script = os.path.join(tmp_path, "callback.sh")
+    with open(script, "w") as f:
+        f.write(f'#!/bin/sh\necho "$SPECTER_CHANGED_PATHS" >> {out}\n')
+    os.chmod(script, 0o755)
+    monkeypatch.setenv("SPECTER_PERSISTENCE_CALLBACK", script)
+    runner = persistence.CallbackRunner(delay=60)
+    monkeypatch.setattr(persistence, "callback_runner", runner)
+    paths = [os.path.join(tmp_path, f"file{i}.csv") for i in range(3)]
+    for path in paths:
+        persistence.write_csv(path, [{"a": 1}])
+    persistence.delete_file(paths[0])
+    assert not os.path.isfile(out)
+    runner.run()
+    # one run with all changed paths
+    with open(out) as f:
+        assert f.read().split() == paths
+    assert runner.stats()["runs"] == 1
+    assert runner.stats()["failures"] == 0
+    # nothing changed - nothing to run
+    runner.run()
+    assert runner.stats()["runs"] == 1
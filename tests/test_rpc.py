@@ -23,3 +23,45 @@ def test_BitcoinRpc(bitcoin_regtest):
     except RpcError as rpce:
         assert rpce.error_code == -32601
         assert rpce.error_msg == "Method not found"
+
+
+def test_BitcoinRpc_retry_and_metrics(monkeypatch):
+    monkeypatch.setattr("cryptoadvance.specter.rpc.RPC_BACKOFF", 0)
+
+    class FakeResponse:
+        status_code = 200
+
+        def __init__(self, result):
+            self.result = result
+
+        def json(self):
+            return self.result
+
+    class FakeSession:
+        def __init__(self):
+            self.timeouts = []
+
+        def post(self, url, data, headers, timeout):
+            self.timeouts.append(timeout)
+            if len(self.timeouts) < 3:
+                error = {"code": -28, "message": "Loading block index..."}
+                return FakeResponse([{"result": None, "error": error, "id": 0}])
+            return FakeResponse([{"result": 42, "error": None, "id": 0}])
+
+    session = FakeSession()
+    rpc = BitcoinRPC(timeout=5, session=session, retries=3)
+    BitcoinRPC.metrics.clear()
+    # warmup errors are retried
+    assert rpc.getblockcount() == 42
+    assert session.timeouts == [5, 5, 5]
+    # slow methods get a longer timeout
+    rpc.wallet("w").rescanblockchain()
+    assert session.timeouts[-1] > 5
+    stats = BitcoinRPC.metrics.stats()
+    assert stats["getblockcount"]["requests"] == 3
+    assert stats["rescanblockchain"]["calls"] == 1
+    # without retries the warmup error is raised
+    session.timeouts = []
+    with pytest.raises(RpcError) as e:
+        BitcoinRPC(session=session, retries=0).getblockcount()
+    assert e.value.error_code == -28
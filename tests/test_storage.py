@@ -0,0 +1,122 @@
+import os
+from cryptoadvance.specter.addresslist import Address
+from cryptoadvance.specter.persistence import write_csv
+from cryptoadvance.specter.storage import CsvStore, RawTxStore, SqliteStore, get_store
+from cryptoadvance.specter.txlist import TxItem
+
+
+def test_get_store(tmp_path, monkeypatch):
+    path = os.path.join(tmp_path, "my_wallet_txs.csv")
+    store = get_store(path, TxItem, "txs", "txid")
+    assert isinstance(store, SqliteStore)
+    assert store.path == os.path.join(tmp_path, "my_wallet.sqlite")
+    monkeypatch.setenv("SPECTER_WALLET_STORAGE", "csv")
+    assert isinstance(get_store(path, TxItem, "txs", "txid"), CsvStore)
+
+
+def test_sqlite_store(tmp_path):
+    store = SqliteStore(
+        os.path.join(tmp_path, "wallet.sqlite"),
+        "addresses",
+        Address,
+        "address",
+        indexes=["label"],
+    )
+    assert not store.exists
+    addresses = [
+        Address(None, address="addr0", index=0, change=False, used=True),
+        Address(None, address="addr1", index=1, change=True, label="Savings"),
+    ]
+    store.save(addresses)
+    assert store.exists
+    loaded = {addr.address: addr for addr in store.load(None)}
+    assert loaded["addr0"].used is True
+    assert loaded["addr0"].change is False
+    assert loaded["addr1"].change is True
+    assert loaded["addr1"].label == "Savings"
+    # incremental upsert only touches the changed row
+    addresses[1]["label"] = "Cold storage"
+    store.save(addresses, changed=[addresses[1]])
+    loaded = {addr.address: addr for addr in store.load(None)}
+    assert len(loaded) == 2
+    assert loaded["addr1"].label == "Cold storage"
+    store.clear()
+    assert not store.exists
+    store.delete()
+    assert not os.path.isfile(store.path)
+
+
+def test_sqlite_store_txitem_roundtrip(tmp_path):
+    store = SqliteStore(
+        os.path.join(tmp_path, "wallet.sqlite"), "txs", TxItem, "txid", ["time"]
+    )
+    tx = TxItem(
+        None,
+        None,
+        tmp_path,
+        txid="ab" * 32,
+        blockheight=100,
+        time=1600000000,
+        conflicts=[],
+        category="send",
+        address=["addr0", "addr1"],
+        amount=[0.1, 0.2],
+        ismine=False,
+    )
+    store.save([tx])
+    loaded = store.load(None, None, tmp_path)[0]
+    assert loaded["blockheight"] == 100
+    assert loaded["address"] == ["addr0", "addr1"]
+    assert loaded["amount"] == [0.1, 0.2]
+    assert loaded["ismine"] is False
+
+
+def test_sqlite_store_migrates_csv(tmp_path):
+    csv_path = os.path.join(tmp_path, "wallet_addr.csv")
+    write_csv(
+        csv_path,
+        [Address(None, address="addr0", index=0, change=False, label="Old")],
+        Address,
+    )
+    store = get_store(csv_path, Address, "addresses", "address")
+    loaded = store.load(None)
+    assert loaded[0].label == "Old"
+    assert not os.path.isfile(csv_path)
+    # second load comes from the database
+    assert store.load(None)[0].label == "Old"
+
+
+def test_rawtx_store(tmp_path):
+    rawdir = os.path.join(tmp_path, "wallet_txs_raw")
+    # legacy layout - one file per transaction
+    os.mkdir(rawdir)
+    with open(os.path.join(rawdir, "aa" * 32 + ".bin"), "wb") as f:
+        f.write(b"legacy")
+    store = RawTxStore(rawdir)
+    assert store.get("aa" * 32) == b"legacy"
+    assert not os.path.isdir(rawdir)
+    store.put_many([("bb" * 32, b"tx1"), ("cc" * 32, b"tx22")])
+    store.put("bb" * 32, b"ignored")
+    assert len(store) == 3
+    assert store.get("bb" * 32) == b"tx1"
+    assert store.get("dd" * 32) is None
+    store.close()
+    # reading with mmap from a fresh instance uses the index
+    store = RawTxStore(rawdir, use_mmap=True)
+    assert store.get("cc" * 32) == b"tx22"
+    store.put("dd" * 32, b"tx333")
+    assert store.get("dd" * 32) == b"tx333"
+    size = os.path.getsize(store.path)
+    assert store.compact(keep=["cc" * 32, "dd" * 32]) > 0
+    assert os.path.getsize(store.path) < size
+    assert "bb" * 32 not in store
+    assert store.get("dd" * 32) == b"tx333"
+    store.close()
+    # index lagging behind the pack is recovered from the pack
+    with open(store.index_path, "r+b") as f:
+        f.truncate(RawTxStore.INDEX.size)
+    store = RawTxStore(rawdir)
+    assert store.get("dd" * 32) == b"tx333"
+    assert len(store) == 2
+    store.delete()
+    assert not os.path.isfile(store.path)
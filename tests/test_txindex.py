@@ -0,0 +1,90 @@
+import os
+from cryptoadvance.specter.addresslist import Address, AddressList
+from cryptoadvance.specter.txindex import merge_queries
+from cryptoadvance.specter.txlist import TxItem, TxList
+
+
+def make_txlist(path, name, txs):
+    addresses = AddressList(os.path.join(path, f"{name}_addr.csv"), None)
+    addresses["addr0"] = Address(None, address="addr0", index=0, change=False)
+    addresses["addr1"] = Address(
+        None, address="addr1", index=1, change=False, label="Savings"
+    )
+    txlist = TxList(os.path.join(path, f"{name}_txs.csv"), None, addresses, "regtest")
+    for tx in txs:
+        txlist[tx["txid"]] = TxItem(None, addresses, txlist.rawstore, **tx)
+    return txlist
+
+
+def tx(n, address, amount, blockheight=None, ismine=True, conflicts=[]):
+    return {
+        "txid": f"{n:064x}",
+        "time": 1600000000 + n,
+        "blockheight": blockheight,
+        "blockhash": f"{blockheight:064x}" if blockheight else None,
+        "category": "receive",
+        "address": address,
+        "amount": amount,
+        "ismine": ismine,
+        "conflicts": conflicts,
+    }
+
+
+def test_txindex(tmp_path):
+    txlist = make_txlist(
+        tmp_path,
+        "wallet",
+        [
+            tx(1, "addr0", 0.5, blockheight=100),
+            tx(2, "addr1", 2.0, blockheight=101),
+            tx(3, ["addr0", "addr1"], [0.1, 0.2]),
+            tx(4, "external", 1, ismine=False),
+            # replaced by a newer transaction
+            tx(5, "addr0", 0.3, conflicts=[f"{6:064x}"]),
+            tx(6, "addr0", 0.3, conflicts=[f"{5:064x}"]),
+        ],
+    )
+    index = txlist.index
+    txids, total = index.query()
+    assert total == 4
+    # newest first by default
+    assert txids == [f"{n:064x}" for n in [6, 3, 2, 1]]
+    txids, total = index.query(sortby="amount", sortdir="desc", limit=2)
+    assert total == 4
+    assert txids == [f"{n:064x}" for n in [2, 1]]
+    txids, _ = index.query(sortby="confirmations", current_blockheight=110)
+    assert txids == [f"{n:064x}" for n in [6, 3, 2, 1]]
+    # search by label, address and confirmations
+    assert index.query(search="Savings")[1] == 2
+    assert index.query(search="addr0")[1] == 3
+    assert index.query(search="1001", current_blockheight=1100)[0] == [f"{1:064x}"]
+    # label changes update the index
+    txlist._addresses["addr0"]["label"] = "Cold"
+    txlist._addresses.save(changed=["addr0"])
+    assert index.query(search="Cold")[1] == 3
+    # display rows have labels joined
+    assert index.display_row(f"{3:064x}")["label"] == ["Cold", "Savings"]
+    assert index.display_row(f"{2:064x}")["label"] == "Savings"
+    txids, _ = index.query(sortby="label", sortdir="asc")
+    assert txids[0] == f"{6:064x}"
+
+
+def test_merge_queries(tmp_path):
+    txlist1 = make_txlist(tmp_path, "w1", [tx(1, "addr0", 1), tx(3, "addr0", 3)])
+    txlist2 = make_txlist(tmp_path, "w2", [tx(2, "addr0", 2), tx(4, "addr0", 4)])
+    items, total = merge_queries(
+        [txlist1.index, txlist2.index], sortby="amount", sortdir="desc", limit=3
+    )
+    assert total == 4
+    assert [txid for _, txid in items] == [f"{n:064x}" for n in [4, 3, 2]]
+    items, _ = merge_queries([txlist1.index, txlist2.index], idx=1, limit=3)
+    assert [(index, txid) for index, txid in items] == [(txlist1.index, f"{1:064x}")]
+
+
+def test_validated_proofs(tmp_path):
+    txlist = make_txlist(tmp_path, "wallet", [tx(1, "addr0", 1, blockheight=100)])
+    assert txlist.validated_proofs == {}
+    txlist.set_validated([{"txid": f"{1:064x}", "blockhash": f"{100:064x}"}])
+    # proofs are persisted and loaded by a new instance
+    txlist = make_txlist(tmp_path, "wallet", [])
+    assert txlist.validated_proofs == {f"{1:064x}": f"{100:064x}"}
@@ -0,0 +1,67 @@
+import random
+
+from cryptoadvance.specter.util.coin_selection import (
+    Coin,
+    select_bnb,
+    select_coins,
+    select_knapsack,
+    select_largest_first,
+    waste,
+)
+
+
+def coins(*values, vsize=68):
+    return [Coin("%064x" % i, 0, value, vsize) for i, value in enumerate(values)]
+
+
+def test_select_bnb():
+    # effective values at 1 sat/vB are value - 68
+    pool = coins(100068, 50068, 30068, 20068)
+    selected = select_bnb(pool, 80000, 1, cost_of_change=100)
+    assert sorted(c.value for c in selected) == [30068, 50068]
+    # no exact match within the cost of change
+    assert select_bnb(pool, 80500, 1, cost_of_change=100) is None
+    # not enough funds
+    assert select_bnb(pool, 300000, 1, cost_of_change=100) is None
+
+
+def test_select_knapsack():
+    pool = coins(1000068, 50068, 30068, 20068)
+    rng = random.Random(1)
+    # exact match of the small coins
+    selected = select_knapsack(pool, 50000, 1, rng=rng)
+    assert [c.value for c in selected] == [50068]
+    selected = select_knapsack(pool, 100000, 1, rng=rng)
+    assert sorted(c.value for c in selected) == [20068, 30068, 50068]
+    # small coins don't cover it - the smallest larger coin
+    selected = select_knapsack(pool, 200000, 1, rng=rng)
+    assert [c.value for c in selected] == [1000068]
+    assert select_knapsack(pool, 2000000, 1, rng=rng) is None
+
+
+def test_select_largest_first():
+    pool = coins(10000, 50000, 30000)
+    selected = select_largest_first(pool, 60000, 1)
+    assert [c.value for c in selected] == [50000, 30000]
+    assert select_largest_first(pool, 100000, 1) is None
+
+
+def test_waste():
+    pool = coins(50068, 30068)
+    # spending at the long term fee rate, no change: waste is the excess
+    assert waste(pool, 79900, 1, 500, long_term_fee_rate=1) == 100
+    # spending at a higher fee rate costs (20 - 10) * 68 per input
+    assert waste(pool[:1], 10000, 20, 500, long_term_fee_rate=10) == 680 + 500
+
+
+def test_select_coins():
+    pool = coins(100068, 50068, 30068, 20068)
+    selection = select_coins(pool, 80000, 1, 100)
+    # the changeless solution of bnb has the lowest waste
+    assert selection.algorithm == "bnb"
+    assert not selection.change
+    assert len(selection.inputs) == 2
+    selection = select_coins(pool, 80000, 1, 100, algorithm="largest_first")
+    assert selection.change
+    assert selection.inputs == [{"txid": "%064x" % 0, "vout": 0}]
+    assert select_coins(pool, 1000000, 1, 100) is None
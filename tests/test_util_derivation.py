@@ -0,0 +1,30 @@
+from embit import bip32
+from embit.liquid.descriptor import LDescriptor
+from embit.liquid.networks import get_network
+from cryptoadvance.specter.util.derivation import AddressDeriver, get_address_deriver
+
+ROOT = bip32.HDKey.from_seed(b"\x01" * 64)
+TPUB = bytes.fromhex("043587cf")
+XPUB1 = ROOT.derive("m/84h/1h/0h").to_public().to_base58(version=TPUB)
+XPUB2 = ROOT.derive("m/48h/1h/0h/2h").to_public().to_base58(version=TPUB)
+FGP = ROOT.my_fingerprint.hex()
+
+
+def test_address_deriver():
+    descriptors = [
+        f"wpkh([{FGP}/84h/1h/0h]{XPUB1}/0/*)",
+        f"sh(wpkh({XPUB1}/1/*))",
+        f"wsh(sortedmulti(1,[{FGP}/84h/1h/0h]{XPUB1}/0/*,{XPUB2}/0/*))",
+        f"pkh({XPUB1}/*)",
+    ]
+    net = get_network("regtest")
+    for desc in descriptors:
+        deriver = AddressDeriver(desc, "regtest")
+        addresses = deriver.addresses(0, 20)
+        for idx in [0, 1, 19]:
+            expected = LDescriptor.from_string(desc).derive(idx).address(net)
+            assert addresses[idx] == expected
+        assert deriver.address(5) == addresses[5]
+    assert get_address_deriver(descriptors[0], "regtest") is get_address_deriver(
+        descriptors[0], "regtest"
+    )
@@ -0,0 +1,115 @@
+import time
+
+from cryptoadvance.specter.util.checker import Checker
+from cryptoadvance.specter.util.fee_estimation import (
+    CircuitBreaker,
+    FeeEstimation,
+    get_fees,
+)
+
+CONFIG = {
+    "EXPLORERS_LIST": {
+        "MEMPOOL_SPACE": {"url": "https://mempool.space/"},
+        "MEMPOOL_SPACE_ONION": {"url": "http://mempoolhqx.onion/"},
+    }
+}
+
+FEES = {"fastestFee": 20, "halfHourFee": 10, "hourFee": 5, "minimumFee": 1}
+
+
+class FakeResponse:
+    def json(self):
+        return dict(FEES)
+
+
+class FakeSpecter:
+    is_liquid = False
+    only_tor = False
+    fee_estimator = "mempool"
+    config = {}
+
+    def __init__(self):
+        self.requests = []
+        self.fail = set()
+        self.fee_estimation = FeeEstimation(self)
+        # no background thread in tests
+        self.fee_estimation.checker.start = lambda: None
+
+    def requests_session(self, force_tor=False):
+        specter = self
+
+        class Session:
+            def get(self, url, timeout=None):
+                specter.requests.append(url)
+                if force_tor in specter.fail:
+                    raise ConnectionError("unreachable")
+                return FakeResponse()
+
+        return Session()
+
+    def estimatesmartfee(self, blocks):
+        return {"feerate": 0.0001}
+
+
+def test_circuit_breaker(monkeypatch):
+    breaker = CircuitBreaker(max_failures=2, reset_after=300)
+    breaker.failure()
+    assert not breaker.is_open
+    breaker.failure()
+    assert breaker.is_open
+    # after reset_after seconds the source gets another try
+    breaker.opened_at -= 301
+    assert not breaker.is_open
+    breaker.success()
+    assert breaker.failures == 0
+
+
+def test_fee_estimation():
+    specter = FakeSpecter()
+    specter.fail = {True}
+    fees = get_fees(specter, CONFIG)
+    assert fees["hourFee"] == 5
+    assert fees["age"] == 0
+    # onion failed, clearnet worked
+    assert len(specter.requests) == 2
+    # cached values are served without requests
+    get_fees(specter, CONFIG)
+    assert len(specter.requests) == 2
+    # explicit refresh right after the fetch isn't skipped
+    specter.requests = []
+    specter.fee_estimation.refresh()
+    assert specter.requests[-1] == "https://mempool.space/api/v1/fees/recommended"
+    # repeated failures open the breaker of the onion service
+    specter.fee_estimation._cache = {}
+    get_fees(specter, CONFIG)
+    specter.requests = []
+    specter.fee_estimation._cache = {}
+    get_fees(specter, CONFIG)
+    assert specter.requests == ["https://mempool.space/api/v1/fees/recommended"]
+    # everything fails - last good value is kept on refresh
+    specter.fail = {True, False}
+    specter.fee_estimation.breakers = {}
+    cached = specter.fee_estimation._cache[("mempool", "")]
+    specter.fee_estimation._cache[("mempool", "")] = (cached[0], cached[1] - 10)
+    specter.estimatesmartfee = lambda blocks: {"errors": ["Insufficient data"]}
+    specter.fee_estimation.refresh()
+    fees = get_fees(specter, CONFIG)
+    assert fees["hourFee"] == 5
+    assert fees["age"] >= 10
+    # with a new provider Bitcoin Core is the fallback
+    specter.fee_estimator = "custom"
+    specter.config = {"fee_estimator_custom_url": "https://example.com"}
+    fees = get_fees(specter, CONFIG)
+    assert fees["failed"]
+
+
+def test_checker_initial_delay():
+    calls = []
+    checker = Checker(lambda: calls.append(1), period=60, initial_delay=True)
+    checker.start()
+    time.sleep(0.1)
+    checker.stop()
+    assert calls == []
+    assert checker.last_check > 0
+    # the fee estimation checker waits for the first period
+    assert FeeEstimation(FakeSpecter()).checker.initial_delay
@@ -0,0 +1,45 @@
+import os
+from cryptoadvance.specter.addresslist import AddressList
+from cryptoadvance.specter.txlist import TxList
+from cryptoadvance.specter.util.lru import LRUCache
+
+HEXTX = "02000000000101902666609a245e45e426ead256ad47dca8a2b4dd65d1a634ad35b4a1c0603c0e0000000017160014c08fd0c4658b89678b9e0726838c2c2c2f41c3dffeffffff02b44d5a0300000000160014f81b3e69f5cafc2f1e69ed5625d07876e3558e6900e1f50500000000160014255fe80139657184c1de8e04f71c74c667dd7c3f02473044022038a29d1958d295a9739798c1a5f138404711d824f3bf103221d31bcbc11ff0010220635b4996de17290980c78e3de2547717de119e8312a52eb54fce73c27728c5e00121020356c34dd0931251a6e306704a912dbfeedb0f550a30a89689a1c8434cefa91000000000"
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache.get("a") == 1
+    # b is the least recently used now
+    cache["c"] = 3
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert cache.pop("a") == 1
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_txlist_cache(tmp_path):
+    addresses = AddressList(os.path.join(tmp_path, "wallet_addr.csv"), None)
+    txlist = TxList(
+        os.path.join(tmp_path, "wallet_txs.csv"), None, addresses, "regtest"
+    )
+    txid = "abf0ddfa5c8b5e7e6bfe6bf9c55c5d0f0e1ba3f0a1ba1b1ceab3ce4dd23ba7b4"
+    txlist.add({txid: {"hex": HEXTX, "time": 1600000000}})
+    assert txlist[txid]["vsize"] == 164
+    # raw tx was dumped to disk, but the parsed tx stays in memory
+    assert txlist[txid]._tx is None
+    assert str(txlist.get_tx(txid)) == HEXTX
+    decoded = txlist.decodetx(txid)
+    assert txlist.decodetx(txid) is decoded
+    tx = txlist.gettransaction(txid, 0, decode=True)
+    assert tx["hex"] == HEXTX
+    assert tx["vsize"] == 164
+    assert txlist.cache_stats["decoded"]["hits"] >= 2
+    assert txlist.cache_stats["transactions"]["hits"] >= 1
@@ -0,0 +1,88 @@
+import os
+import time
+
+from cryptoadvance.specter.util.price_providers import (
+    DAY,
+    PriceHistory,
+    get_price_at,
+    get_prices_at,
+)
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSpecter:
+    price_check = True
+    weight_unit = "oz"
+
+    def __init__(self, path, price_provider):
+        self.price_provider = price_provider
+        self.price_history = PriceHistory(path)
+        self.urls = []
+
+    def requests_session(self, force_tor=False):
+        specter = self
+
+        class Session:
+            def get(self, url):
+                specter.urls.append(url)
+                if "/ohlc/" in url:
+                    start = int(url.split("start=")[1])
+                    limit = int(url.split("limit=")[1].split("&")[0])
+                    candles = [
+                        {"timestamp": str(start + i * DAY), "close": str(1000 + i)}
+                        for i in range(limit)
+                    ]
+                    return FakeResponse({"data": {"ohlc": candles}})
+                return FakeResponse({"data": [[0] * 7 + [500]]})
+
+        return Session()
+
+
+def test_get_prices_at(tmp_path):
+    path = os.path.join(tmp_path, "price_history.sqlite")
+    specter = FakeSpecter(path, "bitstamp_eur")
+    start = 18000 * DAY
+    # 3 transactions on the same day and one 10 days later
+    timestamps = [start + 10, start + 3600, start + 7200, start + 10 * DAY + 5]
+    prices = get_prices_at(specter, None, timestamps)
+    # one bulk request for all days
+    assert len(specter.urls) == 1
+    assert "btceur" in specter.urls[0]
+    assert prices[start + 10] == (True, 1000.0, "€")
+    assert prices[start + 7200] == (True, 1000.0, "€")
+    assert prices[start + 10 * DAY + 5] == (True, 1010.0, "€")
+    # cached on disk - no requests with a fresh cache instance
+    specter = FakeSpecter(path, "bitstamp_eur")
+    assert get_price_at(specter, None, timestamp=start + 50) == (True, 1000.0, "€")
+    assert specter.urls == []
+    # other currency is not in the cache
+    specter.price_provider = "bitstamp"
+    assert get_price_at(specter, None, timestamp=start)[2] == "$"
+    assert len(specter.urls) == 1
+    # today's price is not stored, it's not final yet
+    now = int(time.time())
+    assert get_price_at(specter, None, timestamp=now)[0]
+    assert specter.price_history.get("bitstamp", "usd", now // DAY) is None
+
+
+def test_get_prices_at_spotbit(tmp_path):
+    specter = FakeSpecter(
+        os.path.join(tmp_path, "price_history.sqlite"), "spotbit_kraken_xau"
+    )
+    start = 18000 * DAY
+    prices = get_prices_at(specter, None, [start, start + 5, start + DAY, None])
+    # one request per day
+    assert len(specter.urls) == 2
+    assert "/hist/xau/kraken/" in specter.urls[0]
+    assert prices[start] == (True, 500.0, " oz. ")
+    assert None not in prices
+    # coindesk has no history
+    specter.price_provider = "coindesk"
+    assert get_price_at(specter, None, timestamp=start) == (False, 0, "")
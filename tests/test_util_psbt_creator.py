@@ -1,7 +1,12 @@
 import logging
+
+import pytest
 from cryptoadvance.specter.key import Key
+from cryptoadvance.specter.specter_error import SpecterError
+from cryptoadvance.specter.util.coin_selection import Coin, select_coins
 from cryptoadvance.specter.util.descriptor import Descriptor
 from cryptoadvance.specter.util.psbt_creator import PsbtCreator
+from cryptoadvance.specter.wallet import Wallet
 from mock import MagicMock, call, patch
 
 
@@ -170,3 +175,115 @@ def test_PsbtCreator_json(caplog):
     }
 
     psbt_creator.create_psbt(wallet_mock)
+
+
+def test_PsbtCreator_csv():
+    specter_mock = MagicMock()
+    specter_mock.is_liquid = False
+    specter_mock.chain = "regtest"
+    wallet_mock = MagicMock()
+    request_form_data = {"fee_options": "manual", "fee_rate": "5", "rbf": "on"}
+    recipients_csv = [
+        "address,amount,label\n",
+        "BCRT1qgc6h85z43g3ss2dl5zdrzrp3ef6av4neqcqhh8,10000000,Alice\n",
+        "\n",
+        "bcrt1q3kfetuxpxvujasww6xas94nawklvpz0e52uw8a,111211\n",
+    ]
+    psbt_creator = PsbtCreator(
+        specter_mock,
+        wallet_mock,
+        "csv",
+        request_form=request_form_data,
+        recipients_csv=recipients_csv,
+        recipients_amount_unit="sat",
+    )
+    assert psbt_creator.addresses == [
+        "bcrt1qgc6h85z43g3ss2dl5zdrzrp3ef6av4neqcqhh8",
+        "bcrt1q3kfetuxpxvujasww6xas94nawklvpz0e52uw8a",
+    ]
+    assert psbt_creator.amounts == [0.1, 0.00111211]
+    assert psbt_creator.labels == ["Alice", ""]
+    # labels are set at once
+    wallet_mock.setlabels.assert_called_once_with(
+        {"bcrt1qgc6h85z43g3ss2dl5zdrzrp3ef6av4neqcqhh8": "Alice"}
+    )
+    assert psbt_creator.kwargs["fee_rate"] == 5.0
+
+    # all invalid lines are reported
+    with pytest.raises(SpecterError) as e:
+        PsbtCreator(
+            specter_mock,
+            wallet_mock,
+            "csv",
+            request_form=request_form_data,
+            recipients_csv="bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4,1\nfoo,1\nbar,x\n",
+            recipients_amount_unit="btc",
+        )
+    assert str(e.value) == (
+        "Invalid recipients: "
+        "line 1: bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4 is not a regtest address, "
+        "line 2: foo is not a valid address, "
+        "line 3: can't parse the amount"
+    )
+
+
+class FakeWallet:
+    MIN_FEE_RATE = 1.01
+    weight_per_input = 109
+    change_address = "bcrt1q3kfetuxpxvujasww6xas94nawklvpz0e52uw8a"
+    name = "fake"
+    output_vsize = staticmethod(Wallet.output_vsize)
+
+    def __init__(self, coins):
+        self.coins = coins
+        self.created = []
+
+    def select_coins(self, addresses, amounts, fee_rate, exclude=()):
+        coins = [c for c in self.coins if f"{c.txid}:{c.vout}" not in exclude]
+        target = round(sum(amounts) * 1e8)
+        return select_coins(coins, target, fee_rate, 0, "largest_first")
+
+    def createpsbt(self, addresses, amounts, **kwargs):
+        self.created.append((addresses, kwargs["inputs"]))
+        return {
+            "tx": {"txid": "%064x" % len(self.created)},
+            "fee": 0.0001,
+            "tx_full_size": 1000,
+        }
+
+
+def test_PsbtCreator_batch():
+    specter_mock = MagicMock()
+    specter_mock.is_liquid = False
+    specter_mock.chain = "regtest"
+    recipients_csv = "\n".join(
+        f"bcrt1qgc6h85z43g3ss2dl5zdrzrp3ef6av4neqcqhh8,0.01,Payout {i}"
+        for i in range(100)
+    )
+    psbt_creator = PsbtCreator(
+        specter_mock,
+        MagicMock(),
+        "csv",
+        request_form={"fee_options": "manual", "fee_rate": "1", "rbf": "on"},
+        recipients_csv=recipients_csv,
+        recipients_amount_unit="btc",
+    )
+    # one coin per batch
+    wallet = FakeWallet([Coin("%064x" % i, 0, 100_000_000, 68) for i in range(10)])
+    batches = psbt_creator.create_batch_psbts(wallet, max_vsize=2000)
+    # 19 outputs fit next to the reserved inputs
+    assert [b["recipients"] for b in batches] == [19] * 5 + [5]
+    assert batches[0]["inputs"] == 1
+    assert batches[0]["vsize"] == 1000
+    assert len(psbt_creator.psbts) == 6
+    inputs = [i["txid"] for _, batch_inputs in wallet.created for i in batch_inputs]
+    assert len(inputs) == len(set(inputs))
+    # small coins - batches are split until the inputs fit
+    wallet = FakeWallet([Coin("%064x" % i, 0, 100_000, 68) for i in range(1200)])
+    batches = psbt_creator.create_batch_psbts(wallet, max_vsize=2000)
+    assert sum(b["recipients"] for b in batches) == 100
+    assert max(b["inputs"] for b in batches) * 68 < 2000
+    # not enough funds
+    wallet = FakeWallet([Coin("%064x" % i, 0, 100_000_000, 68) for i in range(1)])
+    with pytest.raises(SpecterError):
+        psbt_creator.create_batch_psbts(wallet, max_vsize=2000)
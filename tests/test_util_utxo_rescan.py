@@ -0,0 +1,121 @@
+import os
+
+from cryptoadvance.specter.persistence import read_json_file, write_json_file
+from cryptoadvance.specter.util.utxo_rescan import UtxoRescan, rescan_state_path
+
+DESCRIPTORS = [{"desc": "wpkh(recv)", "range": 1000}]
+
+
+class FakeRPC:
+    def __init__(self, unspents, pruned=()):
+        self.unspents = unspents
+        # txids in pruned blocks
+        self.pruned = set(pruned)
+        self.imported = []
+        self.batches = []
+
+    def scantxoutset(self, action, scan_objects):
+        return {"unspents": self.unspents}
+
+    def multi(self, calls):
+        self.batches.append(len(calls))
+        res = []
+        for method, *args in calls:
+            result = None
+            error = None
+            if method == "getblockhash":
+                result = "%064x" % args[0]
+            elif method == "gettxoutproof":
+                if args[0][0] not in self.pruned:
+                    result = "proof" + args[0][0]
+            elif method == "getrawtransaction":
+                if args[0] not in self.pruned:
+                    result = "raw" + args[0]
+            elif method == "importprunedfunds":
+                if args[0] == "rawbad":
+                    error = {"code": -5, "message": "Something wrong with merkleblock"}
+                else:
+                    self.imported.append(args[0][3:])
+            res.append({"result": result, "error": error})
+        return res
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        txid = url.split("/")[-2]
+        if url.endswith("/hex"):
+            return FakeResponse("raw" + txid)
+        return FakeResponse("proof" + txid)
+
+
+def unspent(txid, height=100):
+    return {"txid": txid, "vout": 0, "height": height, "desc": "wpkh(recv)"}
+
+
+def test_utxo_rescan(tmp_path):
+    path = str(tmp_path / ".wallet_rescan.json")
+    unspents = [unspent("tx%d" % i, 100 + i % 3) for i in range(7)]
+    # two outputs of the same transaction are imported once
+    unspents.append(unspent("tx0"))
+    rpc = FakeRPC(unspents, pruned=["tx5", "tx6"])
+    session = FakeSession()
+    rescan = UtxoRescan(
+        rpc, path, explorer="https://explorer/", requests_session=session, chunk_size=2
+    )
+    rescan.run(rescan.scan(DESCRIPTORS))
+    assert sorted(rpc.imported) == ["tx%d" % i for i in range(7)]
+    # no batch is larger than two txs
+    assert max(rpc.batches) <= 4
+    assert "https://explorer/api/tx/tx5/hex" in session.urls
+    assert rescan.progress == {
+        "stage": "done",
+        "total": 7,
+        "imported": 7,
+        "missing": 2,
+        "failed": 0,
+    }
+    assert rescan.percent == 100
+    assert not os.path.isfile(path)
+
+
+def test_utxo_rescan_resume(tmp_path):
+    path = str(tmp_path / ".wallet_rescan.json")
+    unspents = [unspent("tx1"), unspent("bad"), unspent("tx2")]
+    rpc = FakeRPC(unspents, pruned=["tx2"])
+    # no explorer - tx2 can't be imported
+    rescan = UtxoRescan(rpc, path)
+    rescan.run(rescan.scan(DESCRIPTORS))
+    assert rpc.imported == ["tx1"]
+    assert rescan.progress["failed"] == 2
+    assert read_json_file(path)["imported"] == ["tx1"]
+    # the next rescan only retries the failed txs
+    rpc = FakeRPC(unspents)
+    rescan = UtxoRescan(rpc, path)
+    rescan.run(rescan.scan(DESCRIPTORS))
+    assert rpc.imported == ["tx2"]
+    assert rescan.progress["imported"] == 2
+    # state of other descriptors is ignored
+    write_json_file({"descriptors": ["wpkh(other)"], "imported": ["tx1"]}, path)
+    rpc = FakeRPC(unspents)
+    rescan = UtxoRescan(rpc, path)
+    rescan.run(rescan.scan(DESCRIPTORS))
+    assert rpc.imported == ["tx1", "tx2"]
+
+
+def test_rescan_state_path():
+    path = os.path.join("wallets", "regtest", "my_wallet.json")
+    assert rescan_state_path(path) == os.path.join(
+        "wallets", "regtest", ".my_wallet_rescan.json"
+    )
@@ -7,6 +7,7 @@ import pytest
 from cryptoadvance.specter.helpers import (
     is_testnet,
     generate_mnemonic,
+    load_jsons,
 )
 from cryptoadvance.specter.key import Key
 from cryptoadvance.specter.devices import DeviceTypes
@@ -684,3 +685,57 @@ def test_multisig_wallet_backup_and_restore(caplog, specter_regtest_configured):
 
     # We restored the wallet's utxos
     assert wallet.get_balance()["trusted"] > 0.0
+
+
+def test_wallet_manager_parallel_loading(tmp_path, monkeypatch):
+    """Wallets are loaded by a bounded pool, failures don't stop the others"""
+    os.makedirs(os.path.join(tmp_path, "regtest"))
+    for i in range(6):
+        with open(os.path.join(tmp_path, "regtest", f"wallet{i}.json"), "w") as f:
+            json.dump({"name": f"Wallet {i}", "keys": []}, f)
+
+    class FakeRPC:
+        def test_connection(self):
+            return True
+
+        def listwallets(self):
+            return []
+
+        def loadwallet(self, path):
+            if path.endswith("wallet3"):
+                raise RpcError("Wallet file not found")
+
+    class FakeWallet:
+        def __init__(self, alias):
+            self.alias = alias
+            self.pending_psbts = {}
+            self.frozen_utxo = []
+
+    running = []
+    max_running = []
+
+    def from_json(cls, wallet_dict, device_manager, manager):
+        running.append(wallet_dict["alias"])
+        max_running.append(len(running))
+        # later wallets finish first
+        time.sleep(0.1 - 0.01 * int(wallet_dict["alias"][-1]))
+        running.remove(wallet_dict["alias"])
+        return FakeWallet(wallet_dict["alias"])
+
+    monkeypatch.setattr(Wallet, "from_json", classmethod(from_json))
+    monkeypatch.setattr(
+        "cryptoadvance.specter.managers.wallet_manager.WALLET_LOADING_THREADS", 3
+    )
+    wm = WalletManager(None, str(tmp_path), FakeRPC(), "regtest", None)
+    while wm.is_loading:
+        time.sleep(0.01)
+    assert 1 < max(max_running) <= 3
+    assert sorted(w.alias for w in wm.wallets.values()) == [
+        f"wallet{i}" for i in [0, 1, 2, 4, 5]
+    ]
+    # order of the wallet files, not the completion order
+    order = load_jsons(os.path.join(tmp_path, "regtest"), key="name")
+    assert list(wm.wallets) == [name for name in order if name != "Wallet 3"]
+    assert [w["alias"] for w in wm.failed_load_wallets] == ["wallet3"]
+    assert wm.loading_progress["wallet3"] == "failed"
+    assert wm.loading_progress["wallet0"] == "done"
@@ -0,0 +1,152 @@
+import pytest
+
+from cryptoadvance.specter.wallet import Wallet
+
+
+class FakeRPC:
+    def __init__(self):
+        self.tip = "aa" * 32
+        # transactions of the wallet: txid -> blockhash
+        self.txs = {}
+        self.removed = []
+        self.txcount = None
+        self.errors = set()
+        self.calls = []
+
+    def entry(self, txid):
+        return {
+            "txid": txid,
+            "blockhash": self.txs[txid],
+            "walletconflicts": [],
+        }
+
+    def multi(self, calls):
+        res = []
+        for method, *args in calls:
+            self.calls.append(method)
+            result = None
+            if method == "getbestblockhash":
+                result = self.tip
+            elif method == "getwalletinfo":
+                txcount = len(self.txs) if self.txcount is None else self.txcount
+                result = {"txcount": txcount}
+            elif method == "listsinceblock":
+                result = {
+                    "transactions": [self.entry(txid) for txid in self.txs],
+                    "removed": self.removed,
+                    "lastblock": self.tip,
+                }
+            if method in self.errors:
+                res.append({"result": None, "error": {"message": "failed"}})
+            else:
+                res.append({"result": result, "error": None})
+        return res
+
+    def listtransactions(self, label, count, skip, watchonly):
+        self.calls.append("listtransactions")
+        return [self.entry(txid) for txid in list(self.txs)[skip : skip + count]]
+
+
+def make_wallet(rpc):
+    wallet = Wallet.__new__(Wallet)
+    wallet.rpc = rpc
+    wallet.info = {}
+    wallet.sync_block = None
+    wallet._synced_txcount = None
+    wallet._transactions = {}
+    wallet.stored = []
+
+    def add_transactions(arr):
+        wallet.stored.append([tx["txid"] for tx in arr])
+        for tx in arr:
+            wallet._transactions[tx["txid"]] = {
+                "address": "addr",
+                "blockhash": rpc.txs.get(tx["txid"]),
+                "blockheight": 100 if rpc.txs.get(tx["txid"]) else None,
+                "conflicts": [],
+            }
+
+    wallet._add_transactions = add_transactions
+    return wallet
+
+
+def test_fetch_transactions_since():
+    rpc = FakeRPC()
+    rpc.txs = {"11" * 32: "aa" * 32, "22" * 32: "aa" * 32}
+    wallet = make_wallet(rpc)
+    # first sync pages through listtransactions
+    wallet.fetch_transactions()
+    assert "listtransactions" in rpc.calls
+    assert wallet.stored == [["11" * 32, "22" * 32]]
+    assert wallet.sync_block == "aa" * 32
+    assert wallet._synced_txcount == 2
+    # new block with a new transaction, only the change is requested
+    rpc.calls = []
+    rpc.tip = "bb" * 32
+    rpc.txs["33" * 32] = "bb" * 32
+    wallet.fetch_transactions()
+    assert "listtransactions" not in rpc.calls
+    assert wallet.stored[-1] == ["33" * 32]
+    assert wallet.sync_block == "bb" * 32
+
+
+def test_fetch_transactions_reorg():
+    rpc = FakeRPC()
+    rpc.txs = {"11" * 32: "aa" * 32}
+    wallet = make_wallet(rpc)
+    wallet.fetch_transactions()
+    # block aa is reorged out and the tx is only listed in "removed"
+    rpc.calls = []
+    rpc.tip = "cc" * 32
+    del rpc.txs["11" * 32]
+    rpc.removed = [{"txid": "11" * 32, "blockhash": "aa" * 32}]
+    wallet.fetch_transactions()
+    assert "listtransactions" not in rpc.calls
+    # removed entries are refreshed even if they look unchanged
+    assert wallet.stored[-1] == ["11" * 32]
+    assert wallet._transactions["11" * 32]["blockhash"] is None
+    assert wallet.sync_block == "cc" * 32
+
+
+def test_fetch_transactions_fallback():
+    rpc = FakeRPC()
+    rpc.txs = {"11" * 32: "aa" * 32}
+    wallet = make_wallet(rpc)
+    wallet.fetch_transactions()
+    # transactions outside of the window (rescan) - full sync
+    rpc.calls = []
+    rpc.txcount = 5
+    wallet.fetch_transactions()
+    assert rpc.calls.count("listsinceblock") == 1
+    assert "listtransactions" in rpc.calls
+    assert wallet._synced_txcount == 5
+    # rpc error - full sync
+    rpc.calls = []
+    rpc.errors = {"listsinceblock"}
+    wallet.fetch_transactions()
+    assert "listtransactions" in rpc.calls
+    assert wallet.sync_block == "aa" * 32
+
+
+def test_fetch_transactions_cursor():
+    rpc = FakeRPC()
+    rpc.txs = {"11" * 32: "aa" * 32}
+    wallet = make_wallet(rpc)
+    wallet.fetch_transactions()
+    # cursor doesn't move if transactions were not stored
+    rpc.tip = "bb" * 32
+    rpc.txs["22" * 32] = "bb" * 32
+
+    def fail(arr):
+        raise RuntimeError("disk full")
+
+    wallet._add_transactions = fail
+    with pytest.raises(RuntimeError):
+        wallet.fetch_transactions()
+    assert wallet.sync_block == "aa" * 32
+    # or if the tip is unknown
+    wallet = make_wallet(rpc)
+    rpc.errors = {"getbestblockhash"}
+    wallet.fetch_transactions()
+    assert wallet.stored == [["11" * 32, "22" * 32]]
+    assert wallet.sync_block is None
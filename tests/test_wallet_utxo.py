@@ -0,0 +1,225 @@
+from cryptoadvance.specter.addresslist import Address
+from cryptoadvance.specter.wallet import Wallet
+
+
+class FakeRPC:
+    def __init__(self):
+        self.tip = "aa" * 32
+        self.unspent = []
+        self.locked = []
+        self.calls = []
+
+    def multi(self, calls):
+        res = []
+        for method, *args in calls:
+            self.calls.append(method)
+            if method == "getbestblockhash":
+                result = self.tip
+            elif method == "getwalletinfo":
+                result = {"txcount": len(self.unspent), "balance": 1}
+            elif method == "listlockunspent":
+                result = self.locked
+            elif method == "gettxout":
+                txid, vout = args
+                result = next(
+                    (
+                        {
+                            "confirmations": u["confirmations"],
+                            "value": u["amount"],
+                            "scriptPubKey": {"hex": "0014", "address": u["address"]},
+                        }
+                        for u in self.unspent
+                        if u["txid"] == txid and u["vout"] == vout
+                    ),
+                    None,
+                )
+            res.append({"result": result, "error": None})
+        return res
+
+    def getbalances(self):
+        self.calls.append("getbalances")
+        trusted = sum(u["amount"] for u in self.unspent if u["confirmations"])
+        pending = sum(u["amount"] for u in self.unspent if not u["confirmations"])
+        return {
+            "watchonly": {
+                "trusted": trusted,
+                "untrusted_pending": pending,
+                "immature": 0,
+            }
+        }
+
+    def listunspent(self, minconf):
+        self.calls.append("listunspent")
+        locked = {(u["txid"], u["vout"]) for u in self.locked}
+        return [dict(u) for u in self.unspent if (u["txid"], u["vout"]) not in locked]
+
+    def lockunspent(self, unlock, outpoints):
+        self.calls.append("lockunspent")
+        if unlock:
+            self.locked = [u for u in self.locked if u not in outpoints]
+        else:
+            self.locked += outpoints
+
+
+DESC = "wpkh([12345678/84h/1h/0h/0/1]02aa)"
+
+
+def utxo(txid, vout, address, desc=DESC):
+    return {
+        "txid": txid,
+        "vout": vout,
+        "address": address,
+        "amount": 0.1,
+        "confirmations": 1,
+        "desc": desc,
+    }
+
+
+def make_wallet(rpc):
+    wallet = Wallet.__new__(Wallet)
+    wallet.rpc = rpc
+    wallet._utxo = {}
+    wallet._utxo_state_key = None
+    wallet.full_utxo = []
+    wallet._utxo_by_address = {}
+    wallet._locked_outpoints = set()
+    wallet._balance_state_key = None
+    wallet.pending_psbts = {}
+    wallet.info = {}
+    wallet._transactions = {
+        "11" * 32: {"time": 100},
+        "22" * 32: {"time": 200},
+    }
+    wallet.get_descriptor = lambda address=None: DESC
+    wallet._addresses = {
+        "recv": Address(rpc, address="recv", index=0, change=False, label="Salary"),
+        "change": Address(rpc, address="change", index=0, change=True),
+    }
+    return wallet
+
+
+def test_check_utxo():
+    rpc = FakeRPC()
+    rpc.unspent = [
+        utxo("11" * 32, 0, "recv"),
+        utxo("22" * 32, 1, "change"),
+        utxo("22" * 32, 2, "foreign", desc=""),
+    ]
+    wallet = make_wallet(rpc)
+    wallet.check_utxo()
+    assert [u["txid"] for u in wallet.full_utxo] == ["22" * 32, "11" * 32]
+    assert wallet.full_utxo[0]["category"] == "send"
+    assert wallet.full_utxo[1]["category"] == "receive"
+    assert wallet.full_utxo[1]["label"] == "Salary"
+    assert not any(u["locked"] for u in wallet.full_utxo)
+    # nothing changed - only the state is checked
+    rpc.calls = []
+    wallet.check_utxo()
+    assert "listunspent" not in rpc.calls
+    # locking a known utxo doesn't need the unlock / relock dance
+    rpc.locked = [{"txid": "11" * 32, "vout": 0}]
+    rpc.calls = []
+    wallet.check_utxo()
+    assert "lockunspent" not in rpc.calls
+    assert "gettxout" in rpc.calls
+    assert [u["locked"] for u in wallet.full_utxo] == [False, True]
+    assert len(wallet.utxo) == 1
+    # unknown locked utxos are taken from gettxout, they are never unlocked
+    wallet = make_wallet(rpc)
+    rpc.calls = []
+    wallet.check_utxo()
+    assert "lockunspent" not in rpc.calls
+    assert [u["locked"] for u in wallet.full_utxo] == [False, True]
+    locked = wallet.full_utxo[1]
+    assert (locked["amount"], locked["category"], locked["label"]) == (
+        0.1,
+        "receive",
+        "Salary",
+    )
+    assert rpc.locked == [{"txid": "11" * 32, "vout": 0}]
+    # new block - the set is refreshed
+    rpc.unspent = rpc.unspent[1:]
+    rpc.locked = []
+    rpc.tip = "bb" * 32
+    wallet.check_utxo()
+    assert [u["txid"] for u in wallet.full_utxo] == ["22" * 32]
+
+
+def test_addresses_info():
+    rpc = FakeRPC()
+    rpc.unspent = [
+        utxo("11" * 32, 0, "recv"),
+        utxo("22" * 32, 0, "recv"),
+        utxo("22" * 32, 1, "change"),
+    ]
+    wallet = make_wallet(rpc)
+    wallet.check_utxo()
+    assert wallet.utxo_on_address("recv") == (2, 0.2)
+    assert wallet.utxo_on_address("unknown") == (0, 0)
+    info = wallet.addresses_info(False)
+    assert len(info) == 1
+    assert info[0]["utxo"] == 2
+    assert info[0]["amount"] == 0.2
+    assert wallet.addresses_info(True)[0]["utxo"] == 1
+    # spent utxos are removed from the aggregate
+    rpc.unspent = rpc.unspent[2:]
+    rpc.tip = "bb" * 32
+    wallet.check_utxo()
+    assert wallet.utxo_on_address("recv") == (0, 0)
+    assert wallet.addresses_info(False)[0]["amount"] == 0
+
+
+def test_get_balance():
+    rpc = FakeRPC()
+    rpc.unspent = [
+        utxo("11" * 32, 0, "recv"),
+        utxo("22" * 32, 1, "change"),
+    ]
+    rpc.unspent[1]["confirmations"] = 0
+    wallet = make_wallet(rpc)
+    assert wallet.get_balance()["available"] == {
+        "trusted": 0.1,
+        "untrusted_pending": 0.1,
+        "immature": 0,
+    }
+    # nothing changed - the balance is cached
+    rpc.calls = []
+    wallet.get_balance()
+    assert "getbalances" not in rpc.calls
+    # locked utxos are taken from the utxo set
+    rpc.locked = [{"txid": "11" * 32, "vout": 0}, {"txid": "22" * 32, "vout": 1}]
+    available = wallet.get_balance()["available"]
+    assert available["trusted"] == 0
+    assert available["untrusted_pending"] == 0
+    # outpoints missing in the utxo set are taken from pending psbts
+    rpc.locked = [{"txid": "33" * 32, "vout": 0}]
+    wallet.pending_psbts = {
+        "44"
+        * 32: {
+            "tx": {"vin": [{"txid": "33" * 32, "vout": 0}]},
+            "inputs": [{"witness_utxo": {"amount": 0.05}}],
+        }
+    }
+    requested = []
+    txs = {"33" * 32: {"blockhash": "aa" * 32, "blockheight": 100}}
+
+    def gettransaction(txid, blockheight=None, decode=False, full=True):
+        requested.append(decode)
+        return txs.get(txid)
+
+    wallet.gettransaction = gettransaction
+    available = wallet.get_balance()["available"]
+    assert available["trusted"] == 0.05
+    assert requested == [False]
+    # unconfirmed ones are subtracted from untrusted_pending
+    txs["33" * 32] = {"blockhash": None, "blockheight": None}
+    wallet._balance_state_key = None
+    available = wallet.get_balance()["available"]
+    assert available["trusted"] == 0.1
+    assert available["untrusted_pending"] == 0.05
+    # unknown transactions are skipped
+    del txs["33" * 32]
+    wallet._balance_state_key = None
+    available = wallet.get_balance()["available"]
+    assert available["trusted"] == 0.1
+    assert available["untrusted_pending"] == 0.1
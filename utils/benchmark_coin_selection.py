@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+""" Compares fee cost and runtime of the local coin selection algorithms
+    on synthetic UTXO sets, e.g.:
+    PYTHONPATH=src python3 utils/benchmark_coin_selection.py --utxos 5000
+"""
+
+import logging
+import random
+import time
+
+import click
+
+from cryptoadvance.specter.util.coin_selection import (
+    ALGORITHMS,
+    LONG_TERM_FEE_RATE,
+    Coin,
+    select_coins,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# p2wpkh input and output
+INPUT_VSIZE = 68
+CHANGE_VSIZE = 31
+
+DISTRIBUTIONS = {
+    # values in sats
+    "uniform": lambda rng: rng.randint(10_000, 10_000_000),
+    "exponential": lambda rng: int(rng.expovariate(1 / 500_000)) + 1_000,
+    "bimodal": lambda rng: rng.choice(
+        [rng.randint(1_000, 50_000), rng.randint(5_000_000, 50_000_000)]
+    ),
+}
+
+
+def make_coins(distribution, count, rng):
+    value = DISTRIBUTIONS[distribution]
+    return [Coin("%064x" % i, 0, value(rng), INPUT_VSIZE) for i in range(count)]
+
+
+@click.command()
+@click.option("--utxos", default=1000, help="number of coins in the UTXO set")
+@click.option("--runs", default=20, help="payments per distribution")
+@click.option("--fee-rate", default=20.0, help="fee rate in sat/vB")
+@click.option("--seed", default=0, help="random seed")
+def execute(utxos, runs, fee_rate, seed):
+    rng = random.Random(seed)
+    cost_of_change = int(fee_rate * CHANGE_VSIZE + LONG_TERM_FEE_RATE * INPUT_VSIZE)
+    print(
+        f"{'distribution':12} {'algorithm':14} {'found':>6} {'inputs':>7} "
+        f"{'fee':>8} {'waste':>8} {'no change':>9} {'ms':>8}"
+    )
+    for distribution in DISTRIBUTIONS:
+        coins = make_coins(distribution, utxos, rng)
+        total = sum(coin.value for coin in coins)
+        targets = [rng.randint(10_000, total // 10) for _ in range(runs)]
+        for algorithm in ALGORITHMS + ["auto"]:
+            found = inputs = fee = waste = changeless = 0
+            elapsed = 0
+            for target in targets:
+                t0 = time.perf_counter()
+                selection = select_coins(
+                    coins, target, fee_rate, cost_of_change, algorithm
+                )
+                elapsed += time.perf_counter() - t0
+                if selection is None:
+                    continue
+                found += 1
+                inputs += len(selection.coins)
+                # fee of the inputs and the change output
+                fee += selection.fee
+                if selection.change:
+                    fee += int(fee_rate * CHANGE_VSIZE)
+                else:
+                    changeless += 1
+                waste += selection.waste
+            n = found or 1
+            print(
+                f"{distribution:12} {algorithm:14} {found:>6} {inputs / n:>7.1f} "
+                f"{fee / n:>8.0f} {waste / n:>8.0f} {changeless:>9} "
+                f"{1000 * elapsed / runs:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    execute()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+""" Compares merkle proof validation with MerkleBlock.is_valid (one proof per tx)
+    and the batch verifier on synthetic blocks, e.g.:
+    PYTHONPATH=src python3 utils/benchmark_merkle_proofs.py --txs 2000
+"""
+
+import random
+import time
+
+import click
+
+from cryptoadvance.specter.util.merkleblock import (
+    MerkleProofVerifier,
+    build_merkle_proof,
+    hash256,
+    is_valid_merkle_proof,
+    merkle_root,
+)
+
+
+def make_block(count, rng):
+    txids = ["%064x" % rng.getrandbits(256) for _ in range(count)]
+    root = merkle_root([bytes.fromhex(txid)[::-1] for txid in txids])
+    header = rng.getrandbits(36 * 8).to_bytes(36, "little") + root + bytes(12)
+    return header, hash256(header)[::-1].hex(), txids
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, 1000 * (time.perf_counter() - t0)
+
+
+@click.command()
+@click.option("--blocks", default=20, help="number of blocks")
+@click.option("--txs", default=2000, help="transactions per block")
+@click.option("--wallet-txs", default=10, help="wallet transactions per block")
+@click.option("--seed", default=0, help="random seed")
+def execute(blocks, txs, wallet_txs, seed):
+    rng = random.Random(seed)
+    single = []
+    grouped = []
+    for _ in range(blocks):
+        header, blockhash, txids = make_block(txs, rng)
+        mine = rng.sample(txids, wallet_txs)
+        # gettxoutproof per tx as before and one gettxoutproof per block
+        single += [
+            (txid, blockhash, build_merkle_proof(header, txids, [txid]))
+            for txid in mine
+        ]
+        proof = build_merkle_proof(header, txids, mine)
+        grouped += [(txid, blockhash, proof) for txid in mine]
+
+    def one_by_one(items):
+        return [is_valid_merkle_proof(proof, txid, bh) for txid, bh, proof in items]
+
+    verifier = MerkleProofVerifier()
+    runs = [
+        ("MerkleBlock.is_valid", one_by_one, single),
+        ("batch, proof per tx", MerkleProofVerifier().verify, single),
+        ("batch, proof per block", verifier.verify, grouped),
+        ("batch, cached results", verifier.verify, grouped),
+    ]
+    print(f"{len(single)} txs in {blocks} blocks of {txs} txs")
+    print(f"{'method':24} {'valid':>6} {'ms':>8}")
+    for name, fn, items in runs:
+        result, elapsed = timed(fn, items)
+        print(f"{name:24} {sum(result):>6} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    execute()